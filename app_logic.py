@@ -7,6 +7,8 @@ from typing import Dict, List, Optional, Tuple
 class CacheState:
     ordini: Optional[Dict[str, List[dict]]] = None
     last_update: Optional[datetime] = None
+    # Cresce a ogni modifica delle liste: chi ne deriva dati (dashboard) sa quando ricalcolare
+    versione: int = 0
 
 
 @dataclass
@@ -18,6 +20,7 @@ class ListCacheState:
 def set_cache(state: CacheState, da_spedire: List[dict], in_viaggio: List[dict]) -> None:
     state.ordini = {"da_spedire": da_spedire, "in_viaggio": in_viaggio}
     state.last_update = datetime.now()
+    state.versione += 1
 
 
 def get_cached_lists(state: CacheState) -> Tuple[List[dict], List[dict]]:
@@ -29,6 +32,43 @@ def get_cached_lists(state: CacheState) -> Tuple[List[dict], List[dict]]:
 def invalidate_cache(state: CacheState) -> None:
     state.ordini = None
     state.last_update = None
+    state.versione += 1
+
+
+def segna_ordine_spedito(
+    state: CacheState,
+    order_id: str,
+    tracking: str,
+    shipped_at: Optional[str] = None,
+) -> bool:
+    """
+    Sposta un ordine da da_spedire a in_viaggio con il nuovo tracking, senza
+    riscaricare la lista. Ritorna False se l'ordine non è in cache.
+    """
+    if not state.ordini:
+        return False
+    da_spedire = state.ordini.get("da_spedire", [])
+    in_viaggio = state.ordini.get("in_viaggio", [])
+
+    for i, ordine in enumerate(da_spedire):
+        if ordine.get("order_id") == order_id:
+            del da_spedire[i]
+            break
+    else:
+        # Già in viaggio (es. etichetta rifatta): aggiorniamo solo il tracking
+        for ordine in in_viaggio:
+            if ordine.get("order_id") == order_id:
+                ordine["tracking"] = tracking
+                state.versione += 1
+                return True
+        return False
+
+    state.versione += 1
+    ordine["tracking"] = tracking
+    ordine["status_interno"] = "IN_VIAGGIO"
+    ordine["shipped_at"] = shipped_at or datetime.now().strftime("%d/%m %H:%M")
+    in_viaggio.insert(0, ordine)
+    return True
 
 
 def set_list_cache(state: ListCacheState, items: List[dict]) -> None:
@@ -40,6 +80,19 @@ def get_cached_list(state: ListCacheState) -> List[dict]:
     return state.items or []
 
 
+def prepend_list_cache(state: ListCacheState, item: dict, massimo: Optional[int] = None) -> bool:
+    """
+    Aggiunge un elemento in testa alla lista in cache (se la cache è caricata).
+    Con massimo, le voci più vecchie in coda oltre quel numero vengono tolte.
+    """
+    if state.items is None:
+        return False
+    state.items.insert(0, item)
+    if massimo is not None:
+        del state.items[massimo:]
+    return True
+
+
 def invalidate_list_cache(state: ListCacheState) -> None:
     state.items = None
     state.last_update = None
@@ -68,13 +121,45 @@ def resolve_dashboard_selection(ordini: List[dict], selection_index: int) -> dic
     return {"action": "tracking_unavailable"}
 
 
+def parse_selezione_multipla(testo: str, massimo: int) -> List[int]:
+    """
+    Converte una selezione tipo "1-5,8" in indici 1-based (ordinati, senza doppioni).
+    Solleva ValueError se un numero è fuori da 1..massimo o il formato non è valido.
+    """
+    indici = set()
+    for parte in testo.replace(" ", "").split(","):
+        if not parte:
+            continue
+        try:
+            if "-" in parte:
+                inizio, _, fine = parte.partition("-")
+                a, b = sorted((int(inizio), int(fine)))
+                numeri = range(a, b + 1)
+            else:
+                numeri = [int(parte)]
+        except ValueError:
+            raise ValueError(f"Selezione non valida: '{parte}' (es. 1-5,8)") from None
+        for n in numeri:
+            if n < 1 or n > massimo:
+                raise ValueError(f"Numero fuori intervallo: {n} (1-{massimo})")
+            indici.add(n)
+    if not indici:
+        raise ValueError("Nessun ordine selezionato")
+    return sorted(indici)
+
+
+def e_selezione_multipla(testo: str) -> bool:
+    return "," in testo or "-" in testo
+
+
 def build_payload(
     weight: float,
     sender: dict,
     recipient: dict,
     discount_code: Optional[str] = None,
 ) -> dict:
-    payload = {"weight": weight, "sender": sender, "recipient": recipient}
+    # Copia: le modifiche al riepilogo non devono toccare l'ordine in cache
+    payload = {"weight": weight, "sender": sender, "recipient": dict(recipient)}
     if discount_code:
         payload["discountCode"] = discount_code
     return payload
\ No newline at end of file
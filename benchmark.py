@@ -0,0 +1,346 @@
+"""
+Benchmark dei percorsi critici contro lo stub locale (stub_server.py): nessuna API reale.
+
+    python benchmark.py                          # scrive benchmark_baseline.json
+    python benchmark.py --output nuova.json --confronta benchmark_baseline.json
+    python benchmark.py --rapido                 # salta le misure più lunghe (10k ordini...)
+
+Misure:
+  ordini      parse GetOrders (tempo e memoria) e scarica_lista_ordini end-to-end a 100/1k/10k ordini
+  dashboard   prepara_dashboard_poste a freddo e a caldo per numero di tracking e TRACKING_MAX_WORKERS
+  classifica  _classifica_tracking_poste al secondo (cache Poste già piena: solo CPU)
+  storico     latenza di history.salva_in_storico al crescere dello storico
+  indirizzi   input_utils.parse_indirizzo_blocco al secondo
+  avvio       tempo fino al primo menu (main.py --startup-profile in un processo nuovo)
+
+Tutto gira in una cartella temporanea (log, cache e storico non toccano quelli veri).
+Il file JSON contiene anche versione Python, piattaforma e commit git, così i
+risultati di versioni diverse sono confrontabili con --confronta.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import stub_server
+
+CARTELLA_PROGETTO = os.path.dirname(os.path.abspath(__file__))
+FILE_BASELINE = "benchmark_baseline.json"
+# Peggioramento oltre il quale --confronta segnala una regressione
+SOGLIA_REGRESSIONE = 0.20
+# Sotto questa differenza assoluta (ms, o µs per le metriche per chiamata) è rumore di misura
+SOGLIA_MINIMA_ASSOLUTA = 1.0
+# Metriche a cache calda: frazioni di ms, dominate dal rumore, non si confrontano
+_METRICHE_NON_CONFRONTATE = (".caldo_ms",)
+
+
+def _mediana_ms(funzione, ripetizioni):
+    tempi = []
+    for _ in range(ripetizioni):
+        t0 = time.perf_counter()
+        funzione()
+        tempi.append((time.perf_counter() - t0) * 1000)
+    return round(statistics.median(tempi), 3)
+
+def _al_secondo(funzione, argomenti, minimo_s=0.5):
+    """Chiamate al secondo di funzione(arg) ciclando su argomenti per almeno minimo_s secondi."""
+    chiamate = 0
+    t0 = time.perf_counter()
+    while True:
+        for arg in argomenti:
+            funzione(arg)
+        chiamate += len(argomenti)
+        durata = time.perf_counter() - t0
+        if durata >= minimo_s:
+            return round(chiamate / durata)
+
+
+# --- MISURE ---
+
+def bench_ordini(server, dimensioni):
+    import ebay
+
+    risultati = []
+    for n in dimensioni:
+        server.stato = stub_server.StatoStub(ordini=n, quota_spediti=0.5)
+        per_pagina = ebay.ORDINI_PER_PAGINA
+        pagine = [
+            stub_server.risposta_ebay(
+                server.stato, "GetOrders",
+                f"<EntriesPerPage>{per_pagina}</EntriesPerPage><PageNumber>{p}</PageNumber>",
+            ).encode("utf-8")
+            for p in range(1, (n + per_pagina - 1) // per_pagina + 1)
+        ]
+
+        def _parse():
+            da_spedire, in_viaggio = [], []
+            for pagina in pagine:
+                ebay.parse_risposta_ordini(pagina, da_spedire, in_viaggio)
+            return da_spedire, in_viaggio
+
+        parse_ms = _mediana_ms(_parse, 3)
+        gc.collect()
+        tracemalloc.start()
+        ordini = _parse()
+        corrente, picco = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del ordini
+
+        end_to_end_ms = _mediana_ms(lambda: ebay.scarica_lista_ordini(30, solleva_errori=True), 3)
+        risultati.append({
+            "ordini": n,
+            "xml_kb": round(sum(len(p) for p in pagine) / 1024, 1),
+            "parse_ms": parse_ms,
+            "memoria_ordini_kb": round(corrente / 1024, 1),
+            "memoria_picco_kb": round(picco / 1024, 1),
+            "end_to_end_ms": end_to_end_ms,
+        })
+        print(f"   ordini={n:<6} parse={parse_ms:>9.1f} ms  e2e={end_to_end_ms:>9.1f} ms  mem={corrente / 1024:>8.0f} KB")
+    return risultati
+
+def bench_dashboard(server, trackings, workers, latenza_poste_ms):
+    import config
+    import ebay
+    import history
+    import services
+    import shipitalia
+    import utils
+
+    risultati = []
+    for n in trackings:
+        # Tutti spediti: ogni ordine ha un tracking da chiedere a Poste
+        server.stato = stub_server.StatoStub(ordini=n, quota_spediti=1.0, latenza_poste_ms=latenza_poste_ms)
+        for w in workers:
+            config.TRACKING_MAX_WORKERS = w
+            utils._TRACKING_CACHE.clear()  # A freddo: nessuna risposta Poste in memoria
+            service = services.SpedizioniService(ebay, shipitalia, history)
+            service._snapshot_tracking_importato = True  # Niente snapshot del giro precedente
+            service.sincronizza_ordini(30)
+
+            t0 = time.perf_counter()
+            righe, _cambiamenti = service.prepara_dashboard_poste(30)
+            freddo_ms = (time.perf_counter() - t0) * 1000
+            caldo_ms = _mediana_ms(lambda: service.prepara_dashboard_poste(30), 5)
+            risultati.append({
+                "tracking": n,
+                "workers": w,
+                "latenza_poste_ms": latenza_poste_ms,
+                "freddo_ms": round(freddo_ms, 1),
+                "caldo_ms": caldo_ms,
+                "righe": len(righe),
+            })
+            print(f"   tracking={n:<5} workers={w:<3} freddo={freddo_ms:>9.1f} ms  caldo={caldo_ms:>7.3f} ms")
+    return risultati
+
+def bench_classifica(server, n):
+    import ebay
+    import history
+    import services
+    import shipitalia
+    import utils
+
+    server.stato = stub_server.StatoStub(ordini=n, quota_spediti=1.0)
+    codici = [o["tracking"] for o in server.stato.ordini]
+    utils._TRACKING_CACHE.clear()
+    for codice in codici:
+        utils.get_stato_tracking_poste_cached(codice)
+    service = services.SpedizioniService(ebay, shipitalia, history)
+    al_secondo = _al_secondo(service._classifica_tracking_poste, codici)
+    print(f"   _classifica_tracking_poste: {al_secondo} al secondo (cache Poste piena)")
+    return {"tracking": n, "al_secondo": al_secondo}
+
+def bench_storico(dimensioni, ripetizioni=20):
+    import history
+
+    risultati = []
+    for n in dimensioni:
+        esistenti = [
+            {"data": "01/01/2026 10:00", "tipo": "EBAY", "destinatario": f"Cliente {i}",
+             "tracking": f"TRK{i:010d}", "order_id": "-", "titolo": f"Oggetto {i}"}
+            for i in range(n)
+        ]
+
+        def _riempi_e_salva():
+            with open(history.FILE_STORICO, "w", encoding="utf-8") as f:
+                json.dump(esistenti, f)
+            t0 = time.perf_counter()
+            history.salva_in_storico("EBAY", "Mario Rossi", "TRKNUOVO0001", order_id="12-12345-12345", titolo="Bench")
+            return (time.perf_counter() - t0) * 1000
+
+        tempi = [_riempi_e_salva() for _ in range(ripetizioni)]
+        ms = round(statistics.median(tempi), 3)
+        risultati.append({"voci_storico": n, "salva_ms": ms})
+        print(f"   storico={n:<6} salva_in_storico={ms:>8.2f} ms")
+    return risultati
+
+_INDIRIZZI_ESEMPIO = [
+    "Mario Rossi\nVia Roma 10\n20121 Milano MI\n+39 333 1234567",
+    "Giulia Bianchi\nCorso Vittorio Emanuele II, 145\nScala B int. 4\nIT-00186, Roma\nTel. 06 1234567",
+    "Via Garibaldi 3\n10122 Torino\n",
+    "Luca Verdi\nPiazza del Duomo 1\n50122 Firenze (FI)\nItalia\n347 765 4321",
+]
+
+def bench_indirizzi():
+    import input_utils
+
+    al_secondo = _al_secondo(input_utils.parse_indirizzo_blocco, _INDIRIZZI_ESEMPIO)
+    print(f"   parse_indirizzo_blocco: {al_secondo} al secondo")
+    return {"al_secondo": al_secondo}
+
+def bench_avvio(env, ripetizioni=3):
+    """main.py --startup-profile in un processo nuovo, uscita subito dal menu (scelta 0)."""
+    processo_ms = []
+    fino_al_menu_ms = []
+    for _ in range(ripetizioni):
+        t0 = time.perf_counter()
+        esito = subprocess.run(
+            [sys.executable, os.path.join(CARTELLA_PROGETTO, "main.py"), "--startup-profile"],
+            input="0\n", capture_output=True, text=True, encoding="utf-8", env=env, timeout=120,
+        )
+        processo_ms.append((time.perf_counter() - t0) * 1000)
+        m = re.search(r"TOTALE\s+([\d.]+) ms", esito.stdout)
+        if m:
+            fino_al_menu_ms.append(float(m.group(1)))
+    risultato = {
+        "processo_ms": round(statistics.median(processo_ms), 1),
+        "primo_menu_ms": round(statistics.median(fino_al_menu_ms), 1) if fino_al_menu_ms else None,
+    }
+    print(f"   primo menu={risultato['primo_menu_ms']} ms  processo completo={risultato['processo_ms']} ms")
+    return risultato
+
+
+# --- CONFRONTO ---
+
+# Parametri che identificano una riga (non sono misure)
+_CHIAVI_RIGA = ("ordini", "tracking", "workers", "voci_storico")
+_PARAMETRI = {"latenza_poste_ms"}
+
+def _metriche_piatte(risultati):
+    """{"ordini[ordini=1000].parse_ms": 12.3, ...}: solo i tempi (più alto = peggio)."""
+    piatte = {}
+    for sezione, valore in risultati.items():
+        righe = valore if isinstance(valore, list) else [valore]
+        for riga in righe:
+            chiavi = [f"{k}={riga[k]}" for k in _CHIAVI_RIGA if k in riga]
+            prefisso = f"{sezione}[{','.join(chiavi)}]" if chiavi else sezione
+            for k, v in riga.items():
+                if k in _PARAMETRI:
+                    continue
+                if k.endswith("_ms") and isinstance(v, (int, float)):
+                    piatte[f"{prefisso}.{k}"] = v
+                elif k == "al_secondo" and v:
+                    piatte[f"{prefisso}.us_per_chiamata"] = 1_000_000 / v
+    return piatte
+
+def confronta(attuale, riferimento, soglia=SOGLIA_REGRESSIONE):
+    """Stampa le variazioni rispetto al riferimento; ritorna le metriche peggiorate oltre soglia."""
+    prima = _metriche_piatte(riferimento.get("risultati", {}))
+    dopo = _metriche_piatte(attuale.get("risultati", {}))
+    regressioni = []
+    print(f"\n📊 Confronto con {riferimento.get('meta', {}).get('commit') or 'riferimento'}")
+    for nome in sorted(set(prima) & set(dopo)):
+        if not prima[nome] or nome.endswith(_METRICHE_NON_CONFRONTATE):
+            continue
+        delta = (dopo[nome] - prima[nome]) / prima[nome]
+        significativo = abs(dopo[nome] - prima[nome]) >= SOGLIA_MINIMA_ASSOLUTA
+        peggiorato = significativo and delta > soglia
+        segno = "❌" if peggiorato else ("✅" if significativo and delta < -soglia else "  ")
+        print(f" {segno} {nome:<60} {prima[nome]:>10.2f} -> {dopo[nome]:>10.2f} ({delta:+.0%})")
+        if peggiorato:
+            regressioni.append(nome)
+    return regressioni
+
+
+def _commit_git():
+    try:
+        esito = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=CARTELLA_PROGETTO,
+                               capture_output=True, text=True, timeout=10)
+        return esito.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark dei percorsi critici (contro lo stub locale).")
+    parser.add_argument("--output", default=FILE_BASELINE, help=f"File JSON dei risultati (default {FILE_BASELINE}).")
+    parser.add_argument("--confronta", help="Baseline precedente: segnala le regressioni (codice di uscita 1).")
+    parser.add_argument("--rapido", action="store_true", help="Dimensioni ridotte (niente 10k ordini).")
+    parser.add_argument("--latenza-poste-ms", type=int, default=20)
+    parser.add_argument("--solo", nargs="+", choices=["ordini", "dashboard", "classifica", "storico", "indirizzi", "avvio"])
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output)
+    riferimento = None
+    if args.confronta:
+        with open(args.confronta, "r", encoding="utf-8") as f:
+            riferimento = json.load(f)
+
+    server = stub_server.avvia_in_background(porta=0)
+    env = dict(os.environ)
+    env.update({
+        "API_STUB_URL": server.base_url,
+        "EBAY_XML_TOKEN": "benchmark",
+        "SHIPITALIA_API_KEY": "benchmark",
+        "EBAY_ACCOUNTS": "",
+        "HTTP_FIXTURE_MODE": "",
+        "LOG_LEVEL": "WARN",
+        "PYTHONIOENCODING": "utf-8",
+    })
+    # La configurazione si legge all'import: l'ambiente va preparato prima
+    os.environ.update(env)
+    cartella = tempfile.mkdtemp(prefix="benchmark_spedizioni_")
+    os.chdir(cartella)
+    sys.path.insert(0, CARTELLA_PROGETTO)
+
+    sezioni = args.solo or ["ordini", "dashboard", "classifica", "storico", "indirizzi", "avvio"]
+    risultati = {}
+    print(f"🏁 Benchmark (stub {server.base_url}, cartella {cartella})")
+    for sezione in sezioni:
+        print(f"\n▶ {sezione}")
+        if sezione == "ordini":
+            risultati[sezione] = bench_ordini(server, [100, 1000] if args.rapido else [100, 1000, 10000])
+        elif sezione == "dashboard":
+            risultati[sezione] = bench_dashboard(
+                server, [50, 200] if args.rapido else [50, 200, 1000], [1, 4, 8], args.latenza_poste_ms
+            )
+        elif sezione == "classifica":
+            risultati[sezione] = bench_classifica(server, 500)
+        elif sezione == "storico":
+            risultati[sezione] = bench_storico([0, 100, 250, 499])
+        elif sezione == "indirizzi":
+            risultati[sezione] = bench_indirizzi()
+        elif sezione == "avvio":
+            risultati[sezione] = bench_avvio(env)
+    server.shutdown()
+
+    dati = {
+        "meta": {
+            "data": datetime.now().isoformat(timespec="seconds"),
+            "commit": _commit_git(),
+            "python": platform.python_version(),
+            "piattaforma": platform.platform(),
+            "cpu": os.cpu_count(),
+            "rapido": args.rapido,
+        },
+        "risultati": risultati,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(dati, f, indent=2, ensure_ascii=False)
+    print(f"\n💾 Risultati salvati in {output}")
+
+    if riferimento is not None and confronta(dati, riferimento):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
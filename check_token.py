@@ -1,28 +1,85 @@
+import hashlib
 import xml.etree.ElementTree as ET
 from datetime import datetime
 import config
+import history
 import logger
 import utils
 
+# Snapshot con la scadenza già letta: la data cambia solo rigenerando il token
+NOME_SNAPSHOT_TOKEN = "token_ebay"
+
+def _hash_token(token):
+    """Impronta del token: permette di capire se è cambiato senza salvarlo su disco."""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def _calcola_avviso(scadenza):
+    delta = scadenza - datetime.now()
+    giorni = delta.days
+
+    if giorni < 0:
+        return f"❌ IL TOKEN EBAY È SCADUTO DA {abs(giorni)} GIORNI! Rigeneralo subito."
+    elif giorni < 60:
+        return f"⚠️  ATTENZIONE: Il token eBay scade tra {giorni} giorni ({scadenza.strftime('%d/%m/%Y')})."
+
+    logger.log.info(f"Check Token OK: scade tra {giorni} gg.")
+    return None
+
+def _nome_snapshot(account):
+    # L'account principale tiene il nome storico dello snapshot
+    if account is config.EBAY_ACCOUNTS[0]:
+        return NOME_SNAPSHOT_TOKEN
+    return f"{NOME_SNAPSHOT_TOKEN}_{account.nome}"
+
+def _scadenza_salvata(token_hash, ignora_eta=False, nome_snapshot=NOME_SNAPSHOT_TOKEN):
+    """Scadenza dallo snapshot se è dello stesso token e controllata da meno di un giorno."""
+    dati, ts = history.leggi_snapshot(nome_snapshot)
+    if not dati or dati.get("token_hash") != token_hash:
+        return None
+    if not ignora_eta and (datetime.now() - ts).total_seconds() > config.TOKEN_CHECK_INTERVAL_SECONDS:
+        return None
+    try:
+        return datetime.fromisoformat(dati["scadenza"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
 @logger.traccia
 def check_scadenza_token_silenzioso():
     """
-    Controlla la scadenza del token all'avvio.
+    Controlla la scadenza dei token all'avvio (uno per account eBay).
     Ritorna una stringa di avviso se manca poco, altrimenti None.
+    GetTokenStatus viene chiamato al massimo una volta al giorno (o se il token cambia):
+    negli altri casi l'avviso si calcola dalla scadenza salvata in cache/.
     """
     # Se mancano le chiavi nel .env, saltiamo il controllo senza errori
-    if not all([config.EBAY_APP_ID, config.EBAY_DEV_ID, config.EBAY_CERT_ID, config.EBAY_XML_TOKEN]):
+    if not all([config.EBAY_APP_ID, config.EBAY_DEV_ID, config.EBAY_CERT_ID]):
         return None
 
+    avvisi = []
+    for account in config.EBAY_ACCOUNTS:
+        if not account.token:
+            continue
+        avviso = _avviso_account(account)
+        if avviso:
+            avvisi.append(f"[{account.nome}] {avviso}" if len(config.EBAY_ACCOUNTS) > 1 else avviso)
+    return "\n".join(avvisi) or None
+
+def _avviso_account(account):
+    nome_snapshot = _nome_snapshot(account)
+    token_hash = _hash_token(account.token)
+    scadenza = _scadenza_salvata(token_hash, nome_snapshot=nome_snapshot)
+    if scadenza is not None:
+        return _calcola_avviso(scadenza)
+
     # Usiamo il namespace dinamico anche nell'XML (opzionale, ma coerente)
     ns_url = config.EBAY_NS['ns']
     xml_body = f"""<?xml version="1.0" encoding="utf-8"?>
     <GetTokenStatusRequest xmlns="{ns_url}">
-      <RequesterCredentials><eBayAuthToken>{config.EBAY_XML_TOKEN}</eBayAuthToken></RequesterCredentials>
+      <RequesterCredentials><eBayAuthToken>{account.token}</eBayAuthToken></RequesterCredentials>
     </GetTokenStatusRequest>"""
 
     headers = {
-        "X-EBAY-API-SITEID": "101",
+        "X-EBAY-API-SITEID": str(account.site_id),
         "X-EBAY-API-COMPATIBILITY-LEVEL": "1131",
         "X-EBAY-API-CALL-NAME": "GetTokenStatus",
         "X-EBAY-API-APP-NAME": config.EBAY_APP_ID,
@@ -50,19 +107,17 @@ def check_scadenza_token_silenzioso():
             if data_str:
                 raw_date = data_str.replace("Z", "").split(".")[0]
                 scadenza = datetime.strptime(raw_date, "%Y-%m-%dT%H:%M:%S")
-                delta = scadenza - datetime.now()
-                giorni = delta.days
-
-                if giorni < 0:
-                    return f"❌ IL TOKEN EBAY È SCADUTO DA {abs(giorni)} GIORNI! Rigeneralo subito."
-                elif giorni < 60:
-                    return f"⚠️  ATTENZIONE: Il token eBay scade tra {giorni} giorni ({scadenza.strftime('%d/%m/%Y')})."
-                
-                logger.log.info(f"Check Token OK: scade tra {giorni} gg.")
-                return None
+                history.salva_snapshot(nome_snapshot, {
+                    "token_hash": token_hash,
+                    "scadenza": scadenza.isoformat(),
+                })
+                return _calcola_avviso(scadenza)
 
     except Exception as e:
-        logger.log.warning(f"Check token avvio fallito (ignorato): {e}")
-        return None
-        
+        logger.log.warning(f"Check token avvio fallito per {account.nome} (ignorato): {e}")
+
+    # eBay non ha risposto: meglio l'ultima scadenza nota (stesso token) che nessun avviso
+    scadenza = _scadenza_salvata(token_hash, ignora_eta=True, nome_snapshot=nome_snapshot)
+    if scadenza is not None:
+        return _calcola_avviso(scadenza)
     return None
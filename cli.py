@@ -0,0 +1,245 @@
+"""
+Comandi non interattivi (cron / Utilità di pianificazione).
+
+    python main.py sync-orders [--giorni 30]
+    python main.py refresh-tracking [--giorni 30]
+    python main.py sync-shipments [--limit 15]
+    python main.py export {orders,dashboard,history,shipments} [--format json|csv] [--output FILE]
+    python main.py verify-orders [--giorni 30]
+    python main.py drain-outbox [--anche-falliti]
+    python main.py reconcile [--giorni 90] [--limit 500] [--correggi]
+
+Ogni comando stampa su stdout un solo oggetto JSON; i messaggi di avanzamento
+dei moduli vanno su stderr. Codici di uscita: vedi EXIT_*.
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import sys
+import time
+
+import config
+import ebay
+import history
+import logger
+import metrics
+import models
+import profilazione
+import riconciliazione
+import services
+import shipitalia
+
+EXIT_OK = 0
+EXIT_ERRORE = 1          # Il comando non è riuscito (API irraggiungibile, errore eBay...)
+EXIT_CONFIG = 2          # Configurazione mancante o argomenti non validi
+EXIT_PARZIALE = 3        # Completato, ma alcune chiamate upstream sono fallite
+
+
+def _crea_parser():
+    parser = argparse.ArgumentParser(
+        prog="main.py",
+        description="Spedizione Manager - comandi non interattivi (output JSON).",
+    )
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("sync-orders", help="Scarica gli ordini eBay e aggiorna lo snapshot locale.")
+    p.add_argument("--giorni", type=int, default=30)
+
+    p = sub.add_parser("refresh-tracking", help="Aggiorna lo stato Poste dei tracking (cache e snapshot, non lo stato della dashboard).")
+    p.add_argument("--giorni", type=int, default=30)
+
+    p = sub.add_parser("sync-shipments", help="Scarica lo storico spedizioni ShipItalia.")
+    p.add_argument("--limit", type=int, default=15)
+
+    p = sub.add_parser("export", help="Esporta dati locali/cache in JSON o CSV.")
+    p.add_argument("cosa", choices=["orders", "dashboard", "history", "shipments"])
+    p.add_argument("--format", choices=["json", "csv"], default="json")
+    p.add_argument("--output", help="File di destinazione (default: stdout).")
+    p.add_argument("--giorni", type=int, default=30)
+    p.add_argument("--limit", type=int, default=15)
+
+    p = sub.add_parser("verify-orders", help="Confronta GetOrders completo e leggero (OutputSelector).")
+    p.add_argument("--giorni", type=int, default=30)
+
+    p = sub.add_parser("drain-outbox", help="Carica su eBay i tracking in coda (outbox).")
+    p.add_argument("--anche-falliti", action="store_true",
+                   help="Rimette in coda anche le voci che hanno esaurito i tentativi.")
+
+    p = sub.add_parser("reconcile", help="Confronta ordini eBay, etichette ShipItalia e storico locale.")
+    p.add_argument("--giorni", type=int, default=90, help="Periodo degli ordini eBay (max 90).")
+    p.add_argument("--limit", type=int, default=500, help="Etichette ShipItalia da scaricare.")
+    p.add_argument("--correggi", action="store_true",
+                   help="Carica su eBay i tracking delle etichette non caricate (via outbox).")
+    return parser
+
+
+# ------------------------------------
+
+def _cmd_sync_orders(service, args):
+    da_spedire, in_viaggio = service.sincronizza_ordini(args.giorni)
+    return {"da_spedire": len(da_spedire), "in_viaggio": len(in_viaggio)}
+
+def _cmd_refresh_tracking(service, args):
+    # Lo stato della dashboard resta all'operatore: i cambi li vede alla prossima sessione
+    dashboard, cambiamenti = service.aggiorna_tracking(args.giorni, salva_stato=False)
+    conteggi = {}
+    for item in dashboard:
+        stato = item.get("dashboard_status", "")
+        conteggi[stato] = conteggi.get(stato, 0) + 1
+    return {"ordini_attivi": len(dashboard), "per_stato": conteggi, "cambiamenti": cambiamenti}
+
+def _cmd_sync_shipments(service, args):
+    lista = service.sincronizza_spedizioni(args.limit)
+    return {"spedizioni": len(lista)}
+
+def _cmd_export(service, args):
+    if args.cosa == "orders":
+        da_spedire, in_viaggio = service.carica_ordini_cached(args.giorni)
+        righe = list(da_spedire) + list(in_viaggio)
+    elif args.cosa == "dashboard":
+        righe, _cambiamenti = service.prepara_dashboard_poste(args.giorni)
+    elif args.cosa == "shipments":
+        righe = service.lista_spedizioni_cached(limit=args.limit)
+    else:
+        righe = history.leggi_storico_locale()
+    righe = [models.come_dict(r) for r in righe]
+
+    testo = _formatta_csv(righe) if args.format == "csv" else json.dumps(righe, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as f:
+            f.write(testo)
+        return {"righe": len(righe), "output": args.output}
+    # Senza --output i dati stessi sono l'output del comando
+    return {"righe": len(righe), "dati": righe} if args.format == "json" else testo
+
+
+def _cmd_verify_orders(service, args):
+    """Scarica gli ordini nei due modi e verifica che il parser produca lo stesso risultato."""
+    misure = {}
+    risultati = {}
+    for modo, lean in (("completo", False), ("leggero", True)):
+        byte_prima = metrics.registro.valore("http_byte_ricevuti_totale", endpoint="ebay:GetOrders")
+        t0 = time.perf_counter()
+        da_spedire, in_viaggio = ebay.scarica_lista_ordini(args.giorni, solleva_errori=True, lean=lean)
+        misure[modo] = {
+            "ms": round((time.perf_counter() - t0) * 1000),
+            "byte": metrics.registro.valore("http_byte_ricevuti_totale", endpoint="ebay:GetOrders") - byte_prima,
+            "ordini": len(da_spedire) + len(in_viaggio),
+        }
+        risultati[modo] = {o["order_id"]: models.come_dict(o) for o in da_spedire + in_viaggio}
+
+    completo, leggero = risultati["completo"], risultati["leggero"]
+    diversi = sorted(oid for oid in set(completo) & set(leggero) if completo[oid] != leggero[oid])
+    esito = {
+        "equivalenti": completo == leggero,
+        "solo_completo": sorted(set(completo) - set(leggero)),
+        "solo_leggero": sorted(set(leggero) - set(completo)),
+        "diversi": diversi,
+        "misure": misure,
+    }
+    if not esito["equivalenti"]:
+        raise RuntimeError(f"GetOrders leggero NON equivalente: {json.dumps(esito, ensure_ascii=False)}")
+    return esito
+
+
+def _cmd_drain_outbox(service, args):
+    if args.anche_falliti:
+        service.riprova_outbox()
+    inviate, errori = service.svuota_outbox()
+    return {"inviate": inviate, "errori": errori, "in_coda": service.stato_outbox()}
+
+
+def _cmd_reconcile(service, args):
+    report = service.verifica_riconciliazione(args.giorni, args.limit)
+    if args.correggi:
+        accodate = service.correggi_riconciliazione(riconciliazione.correggibili(report))
+        inviate, errori = service.svuota_outbox()
+        report["correzioni"] = {"accodate": accodate, "inviate": inviate, "errori": errori}
+    return report
+
+
+def _appiattisci(riga, prefisso=""):
+    piatta = {}
+    for chiave, valore in riga.items():
+        nome = f"{prefisso}{chiave}"
+        if isinstance(valore, dict):
+            piatta.update(_appiattisci(valore, f"{nome}."))
+        else:
+            piatta[nome] = valore
+    return piatta
+
+def _formatta_csv(righe):
+    piatte = [_appiattisci(r) for r in righe]
+    colonne = []
+    for r in piatte:
+        for c in r:
+            if c not in colonne:
+                colonne.append(c)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=colonne, extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(piatte)
+    return buffer.getvalue()
+
+
+_COMANDI = {
+    "sync-orders": _cmd_sync_orders,
+    "refresh-tracking": _cmd_refresh_tracking,
+    "sync-shipments": _cmd_sync_shipments,
+    "export": _cmd_export,
+    "verify-orders": _cmd_verify_orders,
+    "drain-outbox": _cmd_drain_outbox,
+    "reconcile": _cmd_reconcile,
+}
+
+# ------------------------------------
+
+def main(argv=None):
+    parser = _crea_parser()
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit as e:
+        return EXIT_CONFIG if e.code else EXIT_OK
+
+    logger.log.info(f"--- CLI: {args.comando} ---")
+    esito = {"comando": args.comando}
+    t0 = time.perf_counter()
+
+    if args.comando != "export" or args.cosa != "history":
+        try:
+            config.validate_config()
+        except RuntimeError as e:
+            esito.update({"esito": "errore", "errore": str(e)})
+            print(json.dumps(esito, ensure_ascii=False))
+            return EXIT_CONFIG
+
+    service = services.SpedizioniService(ebay, shipitalia, history)
+    profilazione.inizia_azione(f"cli {args.comando}")
+    fallimenti_prima = metrics.registro.totale("http_fallimenti_totale")
+    codice = EXIT_OK
+    try:
+        # I print di avanzamento dei moduli non devono sporcare il JSON su stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            risultato = _COMANDI[args.comando](service, args)
+    except Exception as e:
+        logger.log.errore(f"CLI {args.comando} fallito: {e}")
+        esito.update({"esito": "errore", "errore": str(e)})
+        codice = EXIT_ERRORE
+    else:
+        if isinstance(risultato, str):
+            # export CSV su stdout: il CSV è l'output
+            sys.stdout.write(risultato)
+            return EXIT_OK
+        fallimenti = metrics.registro.totale("http_fallimenti_totale") - fallimenti_prima
+        esito.update({"esito": "parziale" if fallimenti else "ok", **risultato})
+        if fallimenti:
+            esito["chiamate_fallite"] = fallimenti
+            codice = EXIT_PARZIALE
+
+    esito["durata_ms"] = round((time.perf_counter() - t0) * 1000)
+    profilazione.chiudi_sessione()
+    print(json.dumps(esito, ensure_ascii=False, default=str))
+    logger.log.info(f"CLI {args.comando} terminato con codice {codice}")
+    return codice
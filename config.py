@@ -1,4 +1,5 @@
 import os
+from collections import namedtuple
 from dotenv import load_dotenv
 
 # Carica il .env, ma NON sovrascrive se la variabile esiste già nel sistema
@@ -10,6 +11,48 @@ HTTP_RETRIES = 3
 HTTP_BACKOFF_FACTOR = 1
 TRACKING_CACHE_TTL_SECONDS = 3600
 TRACKING_MAX_WORKERS = 4
+# Oltre questo numero di voci la cache tracking Poste dimentica le più vecchie
+TRACKING_CACHE_MAX_VOCI = int(os.getenv("TRACKING_CACHE_MAX_VOCI", "5000"))
+# Etichette generate in parallelo nella spedizione multipla
+SPEDIZIONI_MAX_WORKERS = 4
+# Età massima degli snapshot su disco (cache/) usati per partire senza riscaricare
+SNAPSHOT_MAX_AGE_SECONDS = int(os.getenv("SNAPSHOT_MAX_AGE_SECONDS", "7200"))
+# Dopo un'etichetta le cache vengono aggiornate localmente; la verifica con le API
+# parte dopo questi secondi dall'ultima spedizione (30 pacchi di fila = 1 sola verifica)
+RICONCILIA_DELAY_SECONDS = 60
+# Outbox tracking eBay: attesa tra i tentativi (raddoppia a ogni errore, fino al massimo)
+# e numero di tentativi automatici prima di segnare la voce come fallita
+OUTBOX_BACKOFF_BASE_SECONDS = int(os.getenv("OUTBOX_BACKOFF_BASE_SECONDS", "30"))
+OUTBOX_BACKOFF_MAX_SECONDS = int(os.getenv("OUTBOX_BACKOFF_MAX_SECONDS", "3600"))
+OUTBOX_MAX_TENTATIVI = int(os.getenv("OUTBOX_MAX_TENTATIVI", "10"))
+# Modalità offline (connessione.py): dopo un errore di rete, o dopo questo numero di
+# risposte 5xx di fila, il servizio viene considerato offline e per la pausa le
+# chiamate falliscono subito (le viste usano gli ultimi dati salvati)
+CIRCUITO_SOGLIA_ERRORI = int(os.getenv("CIRCUITO_SOGLIA_ERRORI", "3"))
+CIRCUITO_PAUSA_SECONDS = int(os.getenv("CIRCUITO_PAUSA_SECONDS", "60"))
+# Timeout della prova di connessione all'avvio
+SONDA_TIMEOUT_SECONDS = float(os.getenv("SONDA_TIMEOUT_SECONDS", "2"))
+# Ogni quanto riverificare la scadenza del token su eBay (GetTokenStatus)
+TOKEN_CHECK_INTERVAL_SECONDS = 86400
+
+# --- CONFIGURAZIONE LOG ---
+# Livello minimo scritto su file: DEBUG, INFO, OK, WARN, ERROR.
+# Sotto DEBUG il decoratore @traccia non formatta né input né output.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+# I log più vecchi di questi giorni vengono compressi (.txt.gz), non cancellati
+LOG_GIORNI_COMPRESSIONE = int(os.getenv("LOG_GIORNI_COMPRESSIONE", "7"))
+# Tetto alla dimensione della cartella logs/: oltre, si eliminano i file più vecchi
+LOG_MAX_MB = float(os.getenv("LOG_MAX_MB", "50"))
+# Ogni quanto scrivere nel log le dimensioni delle cache e applicare i tetti
+# MEMORIA_MAX_MB_<CACHE> (memoria.py); 0 = mai
+MEMORIA_LOG_INTERVAL_SECONDS = int(os.getenv("MEMORIA_LOG_INTERVAL_SECONDS", "900"))
+# tracemalloc dall'avvio (più lento): senza, parte alla prima richiesta dal menu (tasto M)
+MEMORIA_TRACEMALLOC = os.getenv("MEMORIA_TRACEMALLOC", "0") == "1"
+# Profilazione delle azioni del menu (profilazione.py): vuoto = spenta, "1" = tempi,
+# "cprofile" = tempi + file .pstats in logs/ per ogni azione (come --profile)
+PROFILE_MODE = os.getenv("PROFILE_MODE", "").strip().lower()
+if PROFILE_MODE in ("0", "false", "no"):
+    PROFILE_MODE = ""
 
 # --- VARIABILI D'AMBIENTE ---
 # os.getenv leggerà indifferentemente dal Sistema o dal file .env
@@ -21,12 +64,73 @@ EBAY_APP_ID = os.getenv("EBAY_APP_ID")
 EBAY_DEV_ID = os.getenv("EBAY_DEV_ID")
 EBAY_CERT_ID = os.getenv("EBAY_CERT_ID")
 
+# --- ACCOUNT EBAY ---
+# Un account venditore: token XML, sito eBay (101 = Italia) e profilo mittente
+# (nome di una sezione di config/mittente.txt; vuoto = profilo predefinito).
+AccountEbay = namedtuple("AccountEbay", "nome token site_id mittente")
+
+def _suffisso_account(nome):
+    return nome.upper().replace("-", "_").replace(" ", "_")
+
+def _leggi_account_ebay():
+    """
+    Più account con EBAY_ACCOUNTS=negozio,outlet e, per ognuno,
+    EBAY_XML_TOKEN_NEGOZIO, EBAY_SITE_ID_NEGOZIO, EBAY_MITTENTE_NEGOZIO.
+    Senza EBAY_ACCOUNTS vale il solo EBAY_XML_TOKEN (account "principale").
+    """
+    site_default = os.getenv("EBAY_SITE_ID", "101")
+    nomi = [n.strip() for n in os.getenv("EBAY_ACCOUNTS", "").split(",") if n.strip()]
+    if not nomi:
+        return [AccountEbay("principale", EBAY_XML_TOKEN, site_default, os.getenv("EBAY_MITTENTE", ""))]
+    account = []
+    for nome in nomi:
+        suffisso = _suffisso_account(nome)
+        account.append(AccountEbay(
+            nome,
+            os.getenv(f"EBAY_XML_TOKEN_{suffisso}"),
+            os.getenv(f"EBAY_SITE_ID_{suffisso}", site_default),
+            os.getenv(f"EBAY_MITTENTE_{suffisso}", ""),
+        ))
+    return account
+
+EBAY_ACCOUNTS = _leggi_account_ebay()
+# Compatibilità: il token "principale" è quello del primo account
+EBAY_XML_TOKEN = EBAY_XML_TOKEN or EBAY_ACCOUNTS[0].token
+
 # --- COSTANTI API ---
-API_URL_SHIPITALIA = "https://shipitalia.com/api/generate-label"
+# Gli endpoint sono sovrascrivibili per test e benchmark: API_STUB_URL (es.
+# http://127.0.0.1:8765, vedi stub_server.py) li punta tutti allo stub locale,
+# le variabili singole vincono su API_STUB_URL.
+_API_STUB_URL = os.getenv("API_STUB_URL", "").strip().rstrip("/")
+SHIPITALIA_BASE_URL = os.getenv("SHIPITALIA_BASE_URL", _API_STUB_URL or "https://shipitalia.com").rstrip("/")
+API_URL_SHIPITALIA = f"{SHIPITALIA_BASE_URL}/api/generate-label"
+API_URL_SHIPITALIA_SPEDIZIONI = f"{SHIPITALIA_BASE_URL}/api/shipments"
+POSTE_TRACKING_URL = os.getenv(
+    "POSTE_TRACKING_URL",
+    (_API_STUB_URL or "https://www.poste.it") + "/online/dovequando/DQ-REST/ricercasemplice",
+)
 MITTENTE_FILE = os.path.join("config", "mittente.txt")
+# Dopo quanto riscaricare da eBay il profilo mittente salvato (se non c'è il file)
+MITTENTE_MAX_AGE_SECONDS = 30 * 86400
 
-EBAY_XML_API_URL = "https://api.ebay.com/ws/api.dll"
+EBAY_XML_API_URL = os.getenv("EBAY_XML_API_URL", (_API_STUB_URL or "https://api.ebay.com") + "/ws/api.dll")
 EBAY_NS = {'ns': 'urn:ebay:apis:eBLBaseComponents'}
+# Registrazione/riproduzione delle risposte HTTP (fixtures.py): "record", "replay" o vuoto
+HTTP_FIXTURE_MODE = os.getenv("HTTP_FIXTURE_MODE", "").strip().lower()
+HTTP_FIXTURE_DIR = os.getenv("HTTP_FIXTURE_DIR", "fixtures")
+# GetOrders "leggero": OutputSelector + OrderStatus=Completed (0 per la richiesta completa)
+EBAY_GETORDERS_LEAN = os.getenv("EBAY_GETORDERS_LEAN", "1") != "0"
+
+# --- DEMONE LOCALE (demone.py) ---
+# Con DEMONE_URL (es. http://192.168.1.10:8770) il menu usa il demone come backend:
+# ordini, dashboard, tracking e storico arrivano dalla cache condivisa del negozio.
+DEMONE_URL = os.getenv("DEMONE_URL", "").strip().rstrip("/")
+DEMONE_HOST = os.getenv("DEMONE_HOST", "127.0.0.1")
+DEMONE_PORTA = int(os.getenv("DEMONE_PORTA", "8770"))
+# Segreto condiviso (header X-Demone-Token): obbligatorio se il demone ascolta in rete
+DEMONE_TOKEN = os.getenv("DEMONE_TOKEN", "")
+# Ogni quanto il demone riscarica ordini, tracking Poste e storico ShipItalia
+DEMONE_AGGIORNAMENTO_SECONDS = int(os.getenv("DEMONE_AGGIORNAMENTO_SECONDS", "300"))
 
 def validate_config():
     """
@@ -34,10 +138,12 @@ def validate_config():
     Le chiavi APP/DEV/CERT sono opzionali (servono solo al check token),
     quindi non blocchiamo il programma se mancano.
     """
-    required = {
-        "SHIPITALIA_API_KEY": SHIPITALIA_API_KEY,
-        "EBAY_XML_TOKEN": EBAY_XML_TOKEN,
-    }
+    required = {"SHIPITALIA_API_KEY": SHIPITALIA_API_KEY}
+    if os.getenv("EBAY_ACCOUNTS", "").strip():
+        for account in EBAY_ACCOUNTS:
+            required[f"EBAY_XML_TOKEN_{_suffisso_account(account.nome)}"] = account.token
+    else:
+        required["EBAY_XML_TOKEN"] = EBAY_XML_TOKEN
     missing = [key for key, val in required.items() if not val]
     if missing:
         raise RuntimeError(
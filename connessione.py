@@ -0,0 +1,146 @@
+"""
+Modalità offline: un interruttore (circuit breaker) per eBay, ShipItalia e Poste.
+
+Dopo un errore di rete (già ripetuto dai retry di urllib3) o CIRCUITO_SOGLIA_ERRORI
+risposte 5xx di fila il servizio è "offline": per CIRCUITO_PAUSA_SECONDS le
+chiamate falliscono subito invece di rifare tutto il ciclo di retry, e le viste
+usano gli ultimi dati salvati. Passata la pausa passa una sola richiesta di
+prova: se riesce il servizio torna online, altrimenti si riparte con la pausa.
+
+All'avvio sonda() prova in background una connessione TCP veloce verso ogni
+servizio, così anche la prima schermata non aspetta i timeout se manca la rete.
+"""
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+import config
+import logger
+import metrics
+
+SERVIZI = ("ebay", "shipitalia", "poste")
+NOMI = {"ebay": "eBay", "shipitalia": "ShipItalia", "poste": "Poste"}
+
+
+class _Circuito:
+    def __init__(self, nome):
+        self.nome = nome
+        self.errori_consecutivi = 0
+        self.aperto_fino = None   # monotonic: fino a quando le chiamate falliscono subito
+        self.prova_in_corso = False
+        self.ultimo_errore = None
+        self.sonda_finita = threading.Event()
+        self.sonda_finita.set()
+        self._lock = threading.Lock()
+
+    def consenti(self):
+        # Sonda in corso (avvio): meglio aspettarla due secondi che rifare tutti i retry
+        self.sonda_finita.wait(config.SONDA_TIMEOUT_SECONDS + 1)
+        with self._lock:
+            if self.aperto_fino is None:
+                return True
+            if time.monotonic() < self.aperto_fino or self.prova_in_corso:
+                return False
+            self.prova_in_corso = True  # Semiaperto: una sola richiesta di prova
+            return True
+
+    def successo(self):
+        with self._lock:
+            era_aperto = self.aperto_fino is not None
+            self.errori_consecutivi = 0
+            self.aperto_fino = None
+            self.prova_in_corso = False
+        if era_aperto:
+            logger.log.info(f"{NOMI[self.nome]} di nuovo raggiungibile: modalità online")
+
+    def errore(self, motivo, grave=False):
+        """grave: errore di rete (la connessione non c'è), apre subito il circuito."""
+        with self._lock:
+            era_aperto = self.aperto_fino is not None
+            self.errori_consecutivi += 1
+            self.ultimo_errore = str(motivo)[:200]
+            self.prova_in_corso = False
+            if not (grave or era_aperto or self.errori_consecutivi >= config.CIRCUITO_SOGLIA_ERRORI):
+                return
+            self.aperto_fino = time.monotonic() + config.CIRCUITO_PAUSA_SECONDS
+        if not era_aperto:
+            metrics.incrementa("circuito_aperture_totale", servizio=self.nome)
+            logger.log.warning(f"{NOMI[self.nome]} non raggiungibile ({motivo}): modalità offline")
+
+
+_circuiti = {nome: _Circuito(nome) for nome in SERVIZI}
+
+
+def _url_servizi():
+    return (
+        ("ebay", config.EBAY_XML_API_URL),
+        ("shipitalia", config.SHIPITALIA_BASE_URL),
+        ("poste", config.POSTE_TRACKING_URL),
+    )
+
+def servizio(url):
+    """Nome del servizio a cui va l'URL (None per gli altri, es. i PDF delle etichette)."""
+    for nome, base in _url_servizi():
+        if url.startswith(base):
+            return nome
+    return None
+
+# --- STATO ---
+
+def consenti(nome):
+    """False se il servizio è in pausa: la chiamata va fatta fallire subito."""
+    return _circuiti[nome].consenti()
+
+def registra_successo(nome):
+    _circuiti[nome].successo()
+
+def registra_errore(nome, motivo, grave=False):
+    _circuiti[nome].errore(motivo, grave=grave)
+
+def offline(nome=None):
+    """Servizio (o almeno uno, con nome=None) in modalità offline, anche in attesa della prova."""
+    if nome is None:
+        return bool(servizi_offline())
+    return _circuiti[nome].aperto_fino is not None
+
+def servizi_offline():
+    return [nome for nome in SERVIZI if offline(nome)]
+
+def secondi_alla_prova(nome):
+    """Secondi prima che il servizio venga riprovato (0 = si può provare subito)."""
+    aperto_fino = _circuiti[nome].aperto_fino
+    return 0 if aperto_fino is None else max(0, round(aperto_fino - time.monotonic()))
+
+def disponibile(nome):
+    """Vale la pena provare il servizio adesso (online o pausa finita)?"""
+    return secondi_alla_prova(nome) == 0
+
+# --- SONDA ---
+
+def sonda(nome, timeout=None):
+    """Connessione TCP veloce verso il servizio: se non riesce il servizio va offline."""
+    parti = urlsplit(dict(_url_servizi())[nome])
+    porta = parti.port or (443 if parti.scheme == "https" else 80)
+    try:
+        with socket.create_connection((parti.hostname, porta), timeout=timeout or config.SONDA_TIMEOUT_SECONDS):
+            return True
+    except OSError as e:
+        registra_errore(nome, f"sonda {parti.hostname}:{porta}: {e}", grave=True)
+        return False
+    finally:
+        _circuiti[nome].sonda_finita.set()
+
+def avvia_sonda():
+    """Sonda tutti i servizi in parallelo, in background (l'avvio non aspetta)."""
+    if config.HTTP_FIXTURE_MODE == "replay":
+        return []  # Nessuna chiamata di rete in replay
+    thread = [
+        threading.Thread(target=sonda, args=(nome,), name=f"sonda-{nome}", daemon=True)
+        for nome in SERVIZI
+    ]
+    for nome in SERVIZI:
+        _circuiti[nome].sonda_finita.clear()
+    for t in thread:
+        t.start()
+    return thread
@@ -0,0 +1,473 @@
+"""
+Demone locale: un solo SpedizioniService per negozio, condiviso da tutte le postazioni.
+
+    python demone.py [--host 0.0.0.0] [--porta 8770]      (sul PC del negozio)
+    DEMONE_URL=http://192.168.1.10:8770 python main.py    (su ogni postazione)
+
+Il demone scarica ordini eBay, stati Poste e storico ShipItalia una volta sola e li
+tiene aggiornati ogni DEMONE_AGGIORNAMENTO_SECONDS; le postazioni leggono la stessa
+cache invece di interrogare ognuna le API. Storico locale, cache e coda eBay vengono
+scritti solo dal demone, una scrittura alla volta. API JSON:
+
+    GET  /salute                        GET  /spedizioni?limit=15
+    GET  /ordini                        GET  /storico
+    GET  /dashboard?dopo=N              GET  /outbox
+    GET  /dashboard/filtro?testo=&ordinamento=
+    GET  /tracking?codice=XX            GET  /rubrica?testo=&limite=9
+    POST /etichette {"payload"}         POST /storico {"tipo", "destinatario", "tracking", ...}
+    POST /etichette/blocco {"lavori"}   POST /spedizioni/registra {"order_id", "tracking", "label_url"}
+    POST /outbox {"order_id", "tracking"}   POST /outbox/riprova
+
+Con DEMONE_TOKEN ogni richiesta deve avere l'header X-Demone-Token; senza token
+il demone accetta solo connessioni da questo PC (127.0.0.1). Il periodo degli
+ordini è quello del demone (--giorni) per tutte le postazioni.
+"""
+import argparse
+import hmac
+import json
+import threading
+import time
+from collections import deque
+from collections.abc import Mapping
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import config
+import connessione
+import ebay
+import history
+import logger
+import metrics
+import models
+import profilazione
+import rubrica
+import services
+import shipitalia
+
+INTESTAZIONE_TOKEN = "X-Demone-Token"
+# Timeout delle richieste al demone; dashboard ed etichette usano quello lungo di ClientDemone
+TIMEOUT_SECONDS = 30
+# Cambi di stato della dashboard tenuti per le postazioni che non li hanno ancora visti
+MAX_CAMBIAMENTI = 200
+
+_HOST_LOCALI = ("127.0.0.1", "localhost", "::1")
+
+
+def _json_default(valore):
+    if isinstance(valore, Mapping):
+        return models.come_dict(valore)  # Order, DashboardItem
+    if isinstance(valore, datetime):
+        return valore.isoformat(timespec="seconds")
+    raise TypeError(f"{type(valore).__name__} non serializzabile")
+
+def _codifica(dati):
+    return json.dumps(dati, ensure_ascii=False, default=_json_default).encode("utf-8")
+
+def _data(testo):
+    return datetime.fromisoformat(testo) if testo else None
+
+
+class Demone:
+    """
+    Servizio condiviso dietro l'API. La vista dashboard (indice materializzato) e le
+    scritture (storico, cache, outbox) hanno ognuna il proprio lock: due postazioni
+    non le modificano mai insieme, ma un aggiornamento Poste lungo non blocca le etichette.
+    """
+
+    def __init__(self, service=None, giorni=30, limit_spedizioni=15):
+        self.service = service or services.SpedizioniService(ebay, shipitalia, history)
+        self.giorni = giorni
+        self.limit_spedizioni = limit_spedizioni
+        self.avvio = datetime.now()
+        self._lock_dashboard = threading.Lock()
+        self._lock_scritture = threading.Lock()
+        self._cambiamenti = deque(maxlen=MAX_CAMBIAMENTI)
+        self._sequenza = 0  # Numero dell'ultimo cambio di stato: il cursore delle postazioni
+        self._ferma = threading.Event()
+
+    def avvia(self):
+        """Cache calde subito, coda eBay attiva e aggiornamento periodico in background."""
+        connessione.avvia_sonda()
+        self.service.avvia_preriscaldamento(self.giorni, self.limit_spedizioni)
+        self.service.avvia_outbox()
+        if config.DEMONE_AGGIORNAMENTO_SECONDS > 0:
+            threading.Thread(target=self._ciclo_aggiornamento, name="demone-aggiornamento", daemon=True).start()
+
+    def ferma(self):
+        self._ferma.set()
+
+    def _ciclo_aggiornamento(self):
+        while not self._ferma.wait(config.DEMONE_AGGIORNAMENTO_SECONDS):
+            self.aggiorna()
+
+    def aggiorna(self):
+        """Riscarica ordini, stati Poste e storico ShipItalia (gli errori finiscono nel log)."""
+        try:
+            self.service.sincronizza_ordini(self.giorni)
+        except Exception as e:
+            logger.log.warning(f"Demone: aggiornamento ordini non riuscito: {e}")
+        try:
+            self.dashboard(salva_snapshot=True)
+        except Exception as e:
+            logger.log.warning(f"Demone: aggiornamento tracking non riuscito: {e}")
+        try:
+            self.service.sincronizza_spedizioni(self.limit_spedizioni)
+        except Exception as e:
+            logger.log.warning(f"Demone: aggiornamento storico ShipItalia non riuscito: {e}")
+
+# ------------------------------------
+
+    def dashboard(self, dopo=None, salva_snapshot=False):
+        """
+        Righe della dashboard e cambi di stato con numero maggiore di dopo (tutti quelli
+        tenuti se None). I cambi sono conservati qui: chi ricalcola la vista non li
+        "consuma" per le altre postazioni.
+        """
+        with self._lock_dashboard:
+            if salva_snapshot:
+                righe, cambiamenti = self.service.aggiorna_tracking(self.giorni)
+            else:
+                righe, cambiamenti = self.service.prepara_dashboard_poste(self.giorni)
+            # Copie fatte qui: dopo il lock un ricalcolo può modificare le righe
+            righe = [models.come_dict(r) for r in righe]
+            adesso = datetime.now()
+            for cambiamento in cambiamenti:
+                self._sequenza += 1
+                self._cambiamenti.append(dict(cambiamento, quando=adesso, seq=self._sequenza))
+            if dopo is not None and dopo > self._sequenza:
+                dopo = None  # Cursore di prima di un riavvio del demone: si riparte da quelli tenuti
+            recenti = [c for c in self._cambiamenti if dopo is None or c["seq"] > dopo]
+        return {"righe": righe, "cambiamenti": recenti, "ultimo": self._sequenza}
+
+    def filtra_dashboard(self, testo, ordinamento):
+        with self._lock_dashboard:
+            return self.service.filtra_dashboard(testo, ordinamento)
+
+    def salva_storico(self, dati):
+        with self._lock_scritture:
+            return self.service.salva_storico(
+                tipo=dati.get("tipo"),
+                destinatario=dati.get("destinatario"),
+                tracking=dati.get("tracking"),
+                order_id=dati.get("order_id"),
+                titolo=dati.get("titolo"),
+                indirizzo=dati.get("indirizzo"),
+            )
+
+    def registra_spedizione(self, order_id, tracking, label_url=None):
+        with self._lock_scritture:
+            self.service.registra_spedizione(order_id, tracking, label_url)
+
+    def aggiorna_tracking_ebay(self, order_id, tracking):
+        with self._lock_scritture:
+            return self.service.aggiorna_tracking_ebay(order_id, tracking)
+
+# ------------------------------------
+
+def _rotte(demone):
+    """(metodo, percorso) -> funzione(parametri, corpo) che ritorna i dati JSON della risposta."""
+    s = demone.service
+
+    def salute(p, c):
+        return {
+            "stato": "ok",
+            "avvio": demone.avvio,
+            "spedizioni_aggiornate": s.get_ship_cache_last_update(),
+            **s.stato_menu(),
+        }
+
+    def ordini(p, c):
+        da_spedire, in_viaggio = s.carica_ordini_cached(demone.giorni)
+        return {"da_spedire": da_spedire, "in_viaggio": in_viaggio, "aggiornati": s.get_cache_last_update()}
+
+    def registra_spedizione(p, c):
+        demone.registra_spedizione(c.get("order_id"), c["tracking"], c.get("label_url"))
+        return {"registrata": True}
+
+    return {
+        ("GET", "/salute"): salute,
+        ("GET", "/ordini"): ordini,
+        ("GET", "/dashboard"): lambda p, c: demone.dashboard(int(p["dopo"]) if p.get("dopo") else None),
+        ("GET", "/dashboard/filtro"): lambda p, c: {
+            "righe": demone.filtra_dashboard(p.get("testo", ""), p.get("ordinamento") or None),
+        },
+        ("GET", "/tracking"): lambda p, c: {
+            "dati": s.stato_tracking(p.get("codice", "")),
+            "aggiornato": s.aggiornamento_tracking(p.get("codice", "")),
+        },
+        ("GET", "/spedizioni"): lambda p, c: {
+            "spedizioni": s.lista_spedizioni_cached(int(p.get("limit", demone.limit_spedizioni))),
+        },
+        ("GET", "/storico"): lambda p, c: {"storico": s.leggi_storico_locale()},
+        ("GET", "/rubrica"): lambda p, c: {
+            "indirizzi": s.cerca_rubrica(p.get("testo", ""), int(p.get("limite", rubrica.MAX_RISULTATI))),
+        },
+        ("GET", "/outbox"): lambda p, c: {"conteggi": s.stato_outbox(), "voci": s.voci_outbox()},
+        # L'etichetta è una chiamata a ShipItalia: le scritture che seguono hanno le loro richieste
+        ("POST", "/etichette"): lambda p, c: s.crea_etichetta(c["payload"], apri_pdf=False),
+        ("POST", "/etichette/blocco"): lambda p, c: {"esiti": s.spedisci_in_blocco(c.get("lavori") or [])},
+        ("POST", "/storico"): lambda p, c: {"salvato": demone.salva_storico(c)},
+        ("POST", "/spedizioni/registra"): registra_spedizione,
+        ("POST", "/outbox"): lambda p, c: {"esito": demone.aggiorna_tracking_ebay(c["order_id"], c["tracking"])},
+        ("POST", "/outbox/riprova"): lambda p, c: {"rimessi": s.riprova_outbox()},
+    }
+
+
+class _Gestore(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "DemoneSpedizioni/1.0"
+
+    def log_message(self, formato, *args):
+        logger.log.debug(f"Demone {self.client_address[0]}: {formato % args}")
+
+    def _rispondi(self, status, dati):
+        corpo = _codifica(dati)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def _gestisci(self, metodo):
+        parti = urlsplit(self.path)
+        lunghezza = int(self.headers.get("Content-Length") or 0)
+        grezzo = self.rfile.read(lunghezza) if lunghezza else b""
+
+        token = self.server.token
+        if token and not hmac.compare_digest(self.headers.get(INTESTAZIONE_TOKEN, ""), token):
+            return self._rispondi(401, {"errore": "token del demone mancante o errato"})
+        funzione = self.server.rotte.get((metodo, parti.path))
+        if funzione is None:
+            return self._rispondi(404, {"errore": f"percorso sconosciuto: {metodo} {parti.path}"})
+
+        t0 = time.perf_counter()
+        try:
+            parametri = {k: v[-1] for k, v in parse_qs(parti.query).items()}
+            corpo = json.loads(grezzo.decode("utf-8")) if grezzo else {}
+            dati = funzione(parametri, corpo)
+            status = 200
+        except (ValueError, KeyError) as e:
+            dati, status = {"errore": f"richiesta non valida: {e}"}, 400
+        except Exception as e:
+            logger.log.errore(f"Demone {metodo} {parti.path}: {e}")
+            dati, status = {"errore": str(e)}, 500
+        metrics.registra_chiamata_http(f"demone {parti.path}", time.perf_counter() - t0, status=status)
+        self._rispondi(status, dati)
+
+    def do_GET(self):
+        self._gestisci("GET")
+
+    def do_POST(self):
+        self._gestisci("POST")
+
+
+def crea_server(demone, host=None, porta=None, token=None):
+    """Server pronto (non avviato); porta=0 sceglie una porta libera."""
+    host = host or config.DEMONE_HOST
+    porta = config.DEMONE_PORTA if porta is None else porta
+    token = config.DEMONE_TOKEN if token is None else token
+    if host not in _HOST_LOCALI and not token:
+        raise RuntimeError(f"Per ascoltare su {host} serve DEMONE_TOKEN (chiunque in rete potrebbe creare etichette)")
+    server = ThreadingHTTPServer((host, porta), _Gestore)
+    server.daemon_threads = True
+    server.rotte = _rotte(demone)
+    server.token = token
+    server.base_url = f"http://{host}:{server.server_address[1]}"
+    return server
+
+# ------------------------------------
+
+class ClientDemone:
+    """
+    Backend del menu quando DEMONE_URL è impostato: stessi metodi di SpedizioniService
+    usati da main.py, con i dati presi dal demone. I PDF delle etichette vengono
+    scaricati anche qui, per stamparli dalla postazione.
+    """
+
+    # Selezioni sulle liste già ricevute: logica pura, identica al servizio locale
+    resolve_dashboard = services.SpedizioniService.resolve_dashboard
+    resolve_lista_spedire = services.SpedizioniService.resolve_lista_spedire
+    resolve_storico_index = services.SpedizioniService.resolve_storico_index
+
+    def __init__(self, url=None, token=None, timeout=120):
+        import requests
+
+        self.url = (url or config.DEMONE_URL).rstrip("/")
+        self.timeout = timeout  # Dashboard a freddo (Poste per tutti i tracking) ed etichette
+        # Stato per il menu a ogni ridisegno: con il PC del demone spento non si aspetta
+        self.timeout_stato = config.SONDA_TIMEOUT_SECONDS
+        self._sessione = requests.Session()
+        token = config.DEMONE_TOKEN if token is None else token
+        if token:
+            self._sessione.headers[INTESTAZIONE_TOKEN] = token
+        self._cambiamenti_dopo = None  # Numero dell'ultimo cambio di stato già mostrato
+        self._aggiornamenti_tracking = {}  # Orario dei dati Poste dell'ultima risposta /tracking
+
+    @profilazione.misurata("rete")
+    def _chiama(self, metodo, percorso, corpo=None, timeout=TIMEOUT_SECONDS, **parametri):
+        import requests
+
+        t0 = time.perf_counter()
+        try:
+            response = self._sessione.request(
+                metodo,
+                self.url + percorso,
+                params=parametri or None,
+                data=_codifica(corpo) if corpo is not None else None,
+                headers={"Content-Type": "application/json"},
+                timeout=timeout,
+            )
+        except requests.RequestException as e:
+            metrics.registra_chiamata_http("demone", time.perf_counter() - t0)
+            raise RuntimeError(f"Demone non raggiungibile ({self.url}): {e}") from e
+        metrics.registra_chiamata_http(
+            "demone", time.perf_counter() - t0, status=response.status_code, byte_ricevuti=len(response.content),
+        )
+        try:
+            dati = response.json()
+        except ValueError:
+            dati = {}
+        if response.status_code >= 400:
+            raise RuntimeError(f"Errore dal demone ({response.status_code}): {dati.get('errore', response.reason)}")
+        return dati
+
+    def salute(self):
+        return self._chiama("GET", "/salute", timeout=self.timeout_stato)
+
+    def stato_menu(self):
+        """Una sola /salute (timeout breve) per tutto quello che il menu mostra."""
+        try:
+            dati = self.salute()
+        except RuntimeError:
+            # Il menu resta utilizzabile: l'errore arriva alla prima azione
+            return {"ordini_aggiornati": None, "outbox": {}, "offline": {"servizi": [], "dati": {}}}
+        offline = dati.get("offline") or {}
+        return {
+            "ordini_aggiornati": _data(dati.get("ordini_aggiornati")),
+            "outbox": dati.get("outbox") or {},
+            # Servizi offline visti dal demone (che è quello che chiama le API)
+            "offline": {
+                **offline,
+                "servizi": offline.get("servizi", []),
+                "dati": {vista: _data(ts) for vista, ts in (offline.get("dati") or {}).items()},
+            },
+        }
+
+    def stato_offline(self):
+        return self.stato_menu()["offline"]
+
+    def puo_creare_etichette(self):
+        return "shipitalia" not in self.stato_offline()["servizi"]
+
+# ------------------------------------
+
+    def avvia_preriscaldamento(self, giorni=30, limit_spedizioni=15):
+        pass  # Le cache del demone sono già calde
+
+    def avvia_outbox(self):
+        pass  # La coda eBay la svuota il demone
+
+    def get_cache_last_update(self):
+        return self.stato_menu()["ordini_aggiornati"]
+
+    def carica_ordini_cached(self, giorni=30):
+        dati = self._chiama("GET", "/ordini")
+        return models.ordini_da_dict(dati["da_spedire"]), models.ordini_da_dict(dati["in_viaggio"])
+
+    def prepara_dashboard_poste(self, giorni=30):
+        """Righe e cambi di stato non ancora visti da questa postazione."""
+        parametri = {"dopo": self._cambiamenti_dopo} if self._cambiamenti_dopo is not None else {}
+        dati = self._chiama("GET", "/dashboard", timeout=self.timeout, **parametri)
+        self._cambiamenti_dopo = dati["ultimo"]
+        return dati["righe"], dati["cambiamenti"]
+
+    def filtra_dashboard(self, testo="", ordinamento=None):
+        return self._chiama("GET", "/dashboard/filtro", testo=testo, ordinamento=ordinamento or "")["righe"]
+
+    def stato_tracking(self, tracking):
+        dati = self._chiama("GET", "/tracking", codice=tracking)
+        self._aggiornamenti_tracking = {tracking: _data(dati.get("aggiornato"))}
+        return dati["dati"]
+
+    def aggiornamento_tracking(self, tracking):
+        return self._aggiornamenti_tracking.get(tracking)
+
+    def lista_spedizioni_cached(self, limit=15):
+        return self._chiama("GET", "/spedizioni", limit=limit)["spedizioni"]
+
+    def leggi_storico_locale(self):
+        return self._chiama("GET", "/storico")["storico"]
+
+    def cerca_rubrica(self, testo="", limite=rubrica.MAX_RISULTATI):
+        return self._chiama("GET", "/rubrica", testo=testo, limite=limite)["indirizzi"]
+
+# ------------------------------------
+
+    def crea_etichetta(self, payload, apri_pdf=True):
+        result = self._chiama("POST", "/etichette", {"payload": payload}, timeout=self.timeout)
+        if result.get("labelUrl"):
+            shipitalia.scarica_pdf(result["labelUrl"], result["trackingCode"], apri=apri_pdf)
+        return result
+
+    def spedisci_in_blocco(self, lavori, max_workers=None):
+        if not lavori:
+            return []
+        esiti = self._chiama("POST", "/etichette/blocco", {"lavori": lavori}, timeout=self.timeout)["esiti"]
+        for lavoro, esito in zip(lavori, esiti):
+            esito["ordine"] = lavoro["ordine"]  # L'oggetto della selezione, non la copia JSON
+            if esito.get("labelUrl"):
+                shipitalia.scarica_pdf(esito["labelUrl"], esito["tracking"], apri=False)
+        return esiti
+
+    def salva_storico(self, **kwargs):
+        return self._chiama("POST", "/storico", kwargs)["salvato"]
+
+    def registra_spedizione(self, order_id, tracking, label_url=None):
+        self._chiama("POST", "/spedizioni/registra", {"order_id": order_id, "tracking": tracking, "label_url": label_url})
+
+    def aggiorna_tracking_ebay(self, order_id, tracking):
+        return self._chiama("POST", "/outbox", {"order_id": order_id, "tracking": tracking})["esito"]
+
+    def stato_outbox(self):
+        return self.stato_menu()["outbox"]
+
+    def voci_outbox(self):
+        return self._chiama("GET", "/outbox")["voci"]
+
+    def riprova_outbox(self):
+        return self._chiama("POST", "/outbox/riprova")["rimessi"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Demone locale: cache condivisa per tutte le postazioni.")
+    parser.add_argument("--host", default=config.DEMONE_HOST, help="0.0.0.0 per le altre postazioni (serve DEMONE_TOKEN).")
+    parser.add_argument("--porta", type=int, default=config.DEMONE_PORTA)
+    parser.add_argument("--giorni", type=int, default=30)
+    args = parser.parse_args(argv)
+
+    try:
+        config.validate_config()
+        demone = Demone(giorni=args.giorni)
+        server = crea_server(demone, host=args.host, porta=args.porta)
+    except (RuntimeError, OSError) as e:
+        print(f"❌ {e}")
+        return 2
+    demone.avvia()
+    logger.log.avvia_manutenzione()
+    logger.log.info(f"Demone in ascolto su {server.base_url}")
+    print(f"Demone in ascolto su {server.base_url}  (CTRL+C per fermare)")
+    indirizzo = "<IP di questo PC>" if args.host in ("0.0.0.0", "::") else args.host
+    print(f"Sulle postazioni: DEMONE_URL=http://{indirizzo}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        demone.ferma()
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
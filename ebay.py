@@ -1,11 +1,34 @@
-import requests
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from xml.sax.saxutils import escape
 from datetime import datetime
 import config
 import logger
+import models
+import profilazione
 import utils
 
+class ErroreEbay(RuntimeError):
+    """Errore già segnalato (log + messaggio) durante una chiamata eBay."""
+
+
+def account_ebay(nome=None):
+    """Account configurato per nome (None = il primo, cioè quello principale)."""
+    if nome:
+        for account in config.EBAY_ACCOUNTS:
+            if account.nome == nome:
+                return account
+        raise ValueError(f"Account eBay sconosciuto: {nome}")
+    return config.EBAY_ACCOUNTS[0]
+
+def _headers(call_name, account):
+    return {
+        "X-EBAY-API-SITEID": str(account.site_id),
+        "X-EBAY-API-COMPATIBILITY-LEVEL": "1131",
+        "X-EBAY-API-CALL-NAME": call_name,
+        "Content-Type": "text/xml"
+    }
+
 def _find_text(root, tag_name):
     if root is None: return ""
     element = root.find(f".//ns:{tag_name}", config.EBAY_NS)
@@ -58,12 +81,13 @@ def _parse_indirizzo_xml(order_element):
 
 # --- NUOVA FUNZIONE: RECUPERO MITTENTE ---
 @logger.traccia
-def get_mittente_ebay():
+def get_mittente_ebay(account=None):
     """Scarica l'indirizzo di registrazione dell'account eBay (Mittente)."""
-    token = config.EBAY_XML_TOKEN
+    account = account or account_ebay()
+    token = account.token
     if not token: return None
     
-    print("   ☁️  Recupero indirizzo mittente da eBay...")
+    utils.stampa_avanzamento("   ☁️  Recupero indirizzo mittente da eBay...")
 
     xml_body = f"""<?xml version="1.0" encoding="utf-8"?>
 <GetUserRequest xmlns="urn:ebay:apis:eBLBaseComponents">
@@ -71,12 +95,7 @@ def get_mittente_ebay():
   <DetailLevel>ReturnAll</DetailLevel>
 </GetUserRequest>"""
 
-    headers = {
-        "X-EBAY-API-SITEID": "101",
-        "X-EBAY-API-COMPATIBILITY-LEVEL": "1131",
-        "X-EBAY-API-CALL-NAME": "GetUser",
-        "Content-Type": "text/xml"
-    }
+    headers = _headers("GetUser", account)
 
     session = utils.get_robust_session()
 
@@ -103,135 +122,273 @@ def get_mittente_ebay():
     
     return None
 
-@logger.traccia
-def scarica_lista_ordini(giorni_storico=30):
-    da_spedire = []
-    in_viaggio = []
+def _ordini_non_disponibili(solleva_errori, motivo):
+    if solleva_errori:
+        raise ErroreEbay(motivo)
+    return [], []
 
-    token = config.EBAY_XML_TOKEN
-    if not token:
-        logger.log.errore("Token XML eBay mancante")
-        print("⚠️ Manca token XML.")
-        return [], []
+# Campi davvero letti da _parse_ordine: con OutputSelector eBay non manda il resto
+OUTPUT_SELECTOR_ORDINI = (
+    "Ack",
+    "Errors",
+    "HasMoreOrders",
+    "PaginationResult",
+    "OrderArray.Order.OrderID",
+    "OrderArray.Order.OrderStatus",
+    "OrderArray.Order.PaidTime",
+    "OrderArray.Order.ShippedTime",
+    "OrderArray.Order.CreatedTime",
+    "OrderArray.Order.AmountPaid",
+    "OrderArray.Order.BuyerUserID",
+    "OrderArray.Order.ShippingAddress",
+    "OrderArray.Order.ShippingDetails.ShipmentTrackingDetails",
+    "OrderArray.Order.ShippingServiceSelected.ShippingPackageInfo",
+    "OrderArray.Order.TransactionArray.Transaction.Item.Title",
+    "OrderArray.Order.TransactionArray.Transaction.ShippingDetails.ShipmentTrackingDetails",
+    "OrderArray.Order.TransactionArray.Transaction.ShippingServiceSelected.ShippingPackageInfo",
+)
 
-    print(f"   ☁️  Scarico ordini eBay (Ultimi {giorni_storico} gg)...")
+ORDINI_PER_PAGINA = 100  # Massimo consentito da GetOrders
+MAX_PAGINE_ORDINI = 50
 
-    xml_body = f"""<?xml version="1.0" encoding="utf-8"?>
+def _xml_richiesta_ordini(token, giorni_storico, pagina, lean):
+    filtri = ""
+    if lean:
+        # Completed = pagato e non annullato: eBay scarta da solo annullati, inattivi e non pagati
+        filtri = "\n  <OrderStatus>Completed</OrderStatus>" + "".join(
+            f"\n  <OutputSelector>{campo}</OutputSelector>" for campo in OUTPUT_SELECTOR_ORDINI
+        )
+    return f"""<?xml version="1.0" encoding="utf-8"?>
 <GetOrdersRequest xmlns="urn:ebay:apis:eBLBaseComponents">
   <RequesterCredentials><eBayAuthToken>{token}</eBayAuthToken></RequesterCredentials>
   <NumberOfDays>{giorni_storico}</NumberOfDays>
   <OrderRole>Seller</OrderRole>
   <DetailLevel>ReturnAll</DetailLevel>
+  <Pagination><EntriesPerPage>{ORDINI_PER_PAGINA}</EntriesPerPage><PageNumber>{pagina}</PageNumber></Pagination>{filtri}
 </GetOrdersRequest>"""
 
-    headers = {
-        "X-EBAY-API-SITEID": "101",
-        "X-EBAY-API-COMPATIBILITY-LEVEL": "1131",
-        "X-EBAY-API-CALL-NAME": "GetOrders",
-        "Content-Type": "text/xml"
-    }
+def _parse_ordine(order):
+    """Converte un nodo <Order> nel models.Order usato da dashboard e liste (None = da scartare)."""
+    order_id = _find_text(order, "OrderID")
+    status = _find_text(order, "OrderStatus")
+    
+    if status in ["Cancelled", "Inactive"]:
+        return None
 
-    session = utils.get_robust_session()
+    paid_time = _find_text(order, "PaidTime")
+    if not paid_time:
+        return None
 
+    shipped_time = _find_text(order, "ShippedTime")
+    delivery_time = _find_text(order, "ActualDeliveryTime")
+    
+    created_time = _find_text(order, "CreatedTime")
+    created_fmt = _format_data(created_time)
+    shipped_fmt = _format_data(shipped_time) if shipped_time else "-"
+    delivered_fmt = _format_data(delivery_time) if delivery_time else "-"
+
+    # --- ESTRAZIONE TRACKING UNIVERSALE ---
+    tracking_code = "N.D."
+    track_nodes = order.findall(".//ns:ShipmentTrackingNumber", config.EBAY_NS)
+    if track_nodes:
+        for node in track_nodes:
+            if node.text and len(node.text.strip()) > 5:
+                tracking_code = node.text.strip()
+                break
+    # --------------------------------------
+
+    titolo = "Oggetto eBay"
     try:
-        response = session.post(config.EBAY_XML_API_URL, data=xml_body, headers=headers, timeout=30)
-        response.raise_for_status()
-        
-        try:
-            root = ET.fromstring(response.content)
-        except ET.ParseError as e:
-            logger.log.errore(f"XML non valido da eBay: {e}")
-            return [], []
+        t_node = order.find(".//ns:Item/ns:Title", config.EBAY_NS)
+        if t_node is not None: titolo = t_node.text
+    except: pass
 
-        ack = _find_text(root, "Ack")
-        if ack == "Failure":
-            error_msg = _find_text(root, "LongMessage")
-            logger.log.errore(f"Errore API eBay: {error_msg}")
-            print(f"❌ Errore API eBay: {error_msg[:100]}...")
-            return [], []
+    titolo_corto = (titolo[:40] + '..') if len(titolo) > 40 else titolo
+    destinatario = _parse_indirizzo_xml(order)
+    
+    if not (order_id and destinatario):
+        return None
 
-        orders = root.findall(".//ns:Order", config.EBAY_NS) or []
-        
-        for order in orders:
-            order_id = _find_text(order, "OrderID")
-            status = _find_text(order, "OrderStatus")
-            
-            if status in ["Cancelled", "Inactive"]:
-                continue
+    obj_ordine = models.Order(
+        order_id=order_id,
+        buyer=_find_text(order, "BuyerUserID"),
+        date=created_fmt,
+        created_at=created_time or None,
+        title=titolo_corto,
+        destinatario=destinatario,
+        shipped_at=shipped_fmt,
+        delivered_at=delivered_fmt,
+        amount=_find_text(order, "AmountPaid"),
+        tracking=tracking_code,
+    )
 
-            paid_time = _find_text(order, "PaidTime")
-            if not paid_time:
-                continue 
+    if not shipped_time:
+        obj_ordine["status_interno"] = "DA_SPEDIRE"
+    elif not delivery_time:
+        obj_ordine["status_interno"] = "IN_VIAGGIO"
+    else:
+        return None  # Consegnato: non serve a nessuna vista
+    return obj_ordine
 
-            shipped_time = _find_text(order, "ShippedTime")
-            delivery_time = _find_text(order, "ActualDeliveryTime")
-            
-            created_fmt = _format_data(_find_text(order, "CreatedTime"))
-            shipped_fmt = _format_data(shipped_time) if shipped_time else "-"
-            delivered_fmt = _format_data(delivery_time) if delivery_time else "-"
-
-            # --- ESTRAZIONE TRACKING UNIVERSALE ---
-            tracking_code = "N.D."
-            track_nodes = order.findall(".//ns:ShipmentTrackingNumber", config.EBAY_NS)
-            if track_nodes:
-                for node in track_nodes:
-                    if node.text and len(node.text.strip()) > 5:
-                        tracking_code = node.text.strip()
-                        break
-            # --------------------------------------
-
-            titolo = "Oggetto eBay"
-            try:
-                t_node = order.find(".//ns:Item/ns:Title", config.EBAY_NS)
-                if t_node is not None: titolo = t_node.text
-            except: pass
+@profilazione.misurata("parse")
+def parse_risposta_ordini(contenuto, da_spedire, in_viaggio):
+    """
+    Analizza una pagina di risposta GetOrders e accoda gli ordini alle liste.
+    Ritorna True se eBay segnala altre pagine (HasMoreOrders).
+    Solleva ErroreEbay per XML non valido o Ack=Failure.
+    """
+    try:
+        root = ET.fromstring(contenuto)
+    except ET.ParseError as e:
+        logger.log.errore(f"XML non valido da eBay: {e}")
+        raise ErroreEbay(f"XML non valido da eBay: {e}")
 
-            titolo_corto = (titolo[:40] + '..') if len(titolo) > 40 else titolo
-            destinatario = _parse_indirizzo_xml(order)
-            
-            if order_id and destinatario:
-                obj_ordine = {
-                    "order_id": order_id,
-                    "buyer": _find_text(order, "BuyerUserID"),
-                    "date": created_fmt,
-                    "title": titolo_corto,
-                    "destinatario": destinatario,
-                    "shipped_at": shipped_fmt,
-                    "delivered_at": delivered_fmt,
-                    "amount": _find_text(order, "AmountPaid"),
-                    "tracking": tracking_code 
-                }
-
-                if not shipped_time:
-                    obj_ordine["status_interno"] = "DA_SPEDIRE"
-                    da_spedire.append(obj_ordine)
-                elif not delivery_time:
-                    obj_ordine["status_interno"] = "IN_VIAGGIO"
-                    in_viaggio.append(obj_ordine)
-
-        logger.log.info(f"Trovati {len(da_spedire)} da spedire (PAGATI) e {len(in_viaggio)} in viaggio.")
+    ack = _find_text(root, "Ack")
+    if ack == "Failure":
+        error_msg = _find_text(root, "LongMessage")
+        logger.log.errore(f"Errore API eBay: {error_msg}")
+        utils.stampa_avanzamento(f"❌ Errore API eBay: {error_msg[:100]}...")
+        raise ErroreEbay(f"Errore API eBay: {error_msg}")
+
+    for order in root.findall(".//ns:Order", config.EBAY_NS) or []:
+        obj_ordine = _parse_ordine(order)
+        if obj_ordine is None:
+            continue
+        if obj_ordine["status_interno"] == "DA_SPEDIRE":
+            da_spedire.append(obj_ordine)
+        else:
+            in_viaggio.append(obj_ordine)
+
+    # HasMoreOrders è un figlio diretto della risposta (non cercare dentro gli ordini)
+    has_more = root.find("ns:HasMoreOrders", config.EBAY_NS)
+    return has_more is not None and (has_more.text or "").strip().lower() == "true"
+
+@logger.traccia
+def scarica_lista_ordini(giorni_storico=30, solleva_errori=False, lean=None, account=None):
+    """
+    Scarica gli ordini pagati degli ultimi N giorni e li divide in (da_spedire, in_viaggio).
+    In caso di errore ritorna due liste vuote, oppure solleva ErroreEbay se
+    solleva_errori=True (serve a distinguere "nessun ordine" da "eBay non risponde").
+
+    lean=True (default da config.EBAY_GETORDERS_LEAN) chiede a eBay solo i campi
+    usati (OutputSelector) e solo gli ordini pagati (OrderStatus=Completed):
+    risposta molto più piccola, stesso risultato del parser.
+
+    Con più account (config.EBAY_ACCOUNTS) e account=None gli ordini di tutti gli
+    account vengono scaricati in parallelo e uniti; ogni ordine ha la chiave "account".
+    """
+    if account is None and len(config.EBAY_ACCOUNTS) > 1:
+        return _scarica_ordini_tutti_account(giorni_storico, solleva_errori, lean)
+    account = account or account_ebay()
+
+    da_spedire = []
+    in_viaggio = []
+    if lean is None:
+        lean = config.EBAY_GETORDERS_LEAN
+
+    token = account.token
+    if not token:
+        logger.log.errore(f"Token XML eBay mancante (account {account.nome})")
+        utils.stampa_avanzamento("⚠️ Manca token XML.")
+        return _ordini_non_disponibili(solleva_errori, f"Token XML eBay mancante (account {account.nome})")
+
+    utils.stampa_avanzamento(f"   ☁️  Scarico ordini eBay [{account.nome}] (Ultimi {giorni_storico} gg)...")
+
+    headers = _headers("GetOrders", account)
+
+    session = utils.get_robust_session()
+
+    try:
+        for pagina in range(1, MAX_PAGINE_ORDINI + 1):
+            xml_body = _xml_richiesta_ordini(token, giorni_storico, pagina, lean)
+            response = session.post(config.EBAY_XML_API_URL, data=xml_body, headers=headers, timeout=30)
+            response.raise_for_status()
+            if not parse_risposta_ordini(response.content, da_spedire, in_viaggio):
+                break
+        else:
+            logger.log.warning(f"GetOrders: raggiunto il limite di {MAX_PAGINE_ORDINI} pagine.")
+
+        for ordine in da_spedire + in_viaggio:
+            ordine["account"] = account.nome
+        logger.log.info(
+            f"[{account.nome}] Trovati {len(da_spedire)} da spedire (PAGATI) e {len(in_viaggio)} in viaggio."
+        )
         return da_spedire, in_viaggio
 
+    except ErroreEbay as e:
+        return _ordini_non_disponibili(solleva_errori, str(e))
     except Exception as e:
         logger.log.errore(f"Errore durante scaricamento ordini: {e}")
-        print(f"⚠️ Errore ricerca: {e}")
-        return [], []
+        utils.stampa_avanzamento(f"⚠️ Errore ricerca: {e}")
+        return _ordini_non_disponibili(solleva_errori, f"Errore durante scaricamento ordini: {e}")
+
+def _scarica_ordini_tutti_account(giorni_storico, solleva_errori, lean):
+    """GetOrders di tutti gli account in parallelo, uniti nell'ordine di config.EBAY_ACCOUNTS."""
+    da_spedire = []
+    in_viaggio = []
+    falliti = []
+    with ThreadPoolExecutor(max_workers=len(config.EBAY_ACCOUNTS)) as executor:
+        futuri = [
+            (account, executor.submit(scarica_lista_ordini, giorni_storico, True, lean, account))
+            for account in config.EBAY_ACCOUNTS
+        ]
+        for account, futuro in futuri:
+            try:
+                ds, iv = futuro.result()
+            except Exception as e:
+                falliti.append(f"{account.nome}: {e}")
+                continue
+            da_spedire.extend(ds)
+            in_viaggio.extend(iv)
+
+    if falliti:
+        motivo = "Ordini non scaricati per " + "; ".join(falliti)
+        logger.log.errore(motivo)
+        utils.stampa_avanzamento(f"⚠️ {motivo}")
+        # Un elenco parziale non deve sostituire uno snapshot completo
+        if solleva_errori:
+            raise ErroreEbay(motivo)
+    return da_spedire, in_viaggio
+
+def carica_tracking(order_id, tracking, account=None, carrier="Poste Italiane"):
+    """
+    Carica il tracking su eBay (CompleteSale) con l'account dell'ordine.
+    Se l'account non è noto (es. Order ID inserito a mano) si provano tutti gli account.
+    Ritorna il nome dell'account che ha accettato; solleva l'ultimo errore se nessuno accetta.
+    """
+    if account or len(config.EBAY_ACCOUNTS) == 1:
+        candidati = [account_ebay(account)]
+    else:
+        candidati = list(config.EBAY_ACCOUNTS)
+
+    for candidato in candidati:
+        try:
+            invia_tracking_xml(order_id, tracking, carrier, candidato)
+            logger.log.successo(f"eBay [{candidato.nome}] aggiornato per {order_id} -> {tracking}")
+            return candidato.nome
+        except Exception as e:
+            errore = e
+            if len(candidati) > 1:
+                logger.log.warning(f"CompleteSale {order_id} non accettato da [{candidato.nome}]: {e}")
+    raise errore
 
 @logger.traccia
-def gestisci_ordine_ebay(order_id, tracking):
-    carrier = "Poste Italiane" 
+def gestisci_ordine_ebay(order_id, tracking, account=None):
+    """Come carica_tracking, ma non solleva: ritorna True se riuscito (errore nel log)."""
     try:
-        invia_tracking_xml(order_id, tracking, carrier)
-        print("✅ Tracking caricato su eBay (XML).")
-        logger.log.successo(f"eBay aggiornato per {order_id} -> {tracking}")
+        carica_tracking(order_id, tracking, account)
+        utils.stampa_avanzamento("✅ Tracking caricato su eBay (XML).")
+        return True
     except Exception as e:
         logger.log.errore(f"Fallimento aggiornamento eBay per {order_id}: {e}")
-        print(f"⚠️ Errore aggiornamento eBay: {e}")
+        utils.stampa_avanzamento(f"⚠️ Errore aggiornamento eBay: {e}")
+        return False
 
 @logger.traccia
-def invia_tracking_xml(order_id, tracking, carrier):
-    token = config.EBAY_XML_TOKEN
-    if not token: raise RuntimeError("Manca EBAY_XML_TOKEN.")
+def invia_tracking_xml(order_id, tracking, carrier, account=None):
+    account = account or account_ebay()
+    token = account.token
+    if not token: raise RuntimeError(f"Manca il token XML eBay (account {account.nome}).")
     
     order_id_clean = order_id.strip().replace(" ", "")
     session = utils.get_robust_session()
@@ -252,14 +409,9 @@ def invia_tracking_xml(order_id, tracking, carrier):
   </Shipment>
 </CompleteSaleRequest>"""
     
-    headers = {
-        "X-EBAY-API-SITEID": "101",
-        "X-EBAY-API-COMPATIBILITY-LEVEL": "1131",
-        "X-EBAY-API-CALL-NAME": "CompleteSale",
-        "Content-Type": "text/xml",
-    }
+    headers = _headers("CompleteSale", account)
     
-    print(f"   ☁️  Invio tracking a eBay ({order_id_clean})...")
+    utils.stampa_avanzamento(f"   ☁️  Invio tracking a eBay ({order_id_clean})...")
     response = session.post(config.EBAY_XML_API_URL, data=xml_body, headers=headers, timeout=30)
     response.raise_for_status()
     
@@ -0,0 +1,182 @@
+"""
+Registrazione e riproduzione delle risposte HTTP (HTTP_FIXTURE_MODE).
+
+    record  -> ogni chiamata reale viene salvata in fixtures/<endpoint>.json
+    replay  -> nessuna chiamata di rete: si risponde con le registrazioni
+
+Token, chiavi API e dati personali (logger.SENSITIVE_KEYS) vengono oscurati
+prima di scrivere su disco, sia nelle richieste sia nelle risposte, così le
+fixture si possono condividere. Order ID e tracking restano: senza, ordini e
+dashboard riprodotti non sarebbero distinguibili.
+"""
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+from urllib.parse import urlsplit
+
+import config
+import logger
+import storage
+
+OSCURATO = "***"
+
+# Identificativi necessari al replay (vedi docstring del modulo)
+_IDENTIFICATIVI = {"tracking", "orderid"}
+# Nomi normalizzati (minuscolo, solo lettere): "postal_code", "PostalCode" -> "postalcode"
+_CAMPI_SENSIBILI = (
+    {re.sub(r"[^a-z]", "", k) for k in logger.SENSITIVE_KEYS} - _IDENTIFICATIVI
+) | {"street", "street1", "street2", "cityname", "email"}
+_SUFFISSI_SENSIBILI = ("token", "apikey", "authorization")
+
+_XML_CAMPO = re.compile(r"<(?P<tag>[A-Za-z_][\w.-]*)(?P<attr>\s[^>]*)?>(?P<testo>[^<]*)</(?P=tag)>")
+
+_lock = threading.Lock()
+_registrazioni = {}   # endpoint -> lista voci (caricata al primo uso)
+_prossimo_replay = {}  # endpoint -> indice per le richieste senza corrispondenza esatta
+
+
+def modalita():
+    return config.HTTP_FIXTURE_MODE if config.HTTP_FIXTURE_MODE in ("record", "replay") else ""
+
+def _sensibile(nome):
+    n = re.sub(r"[^a-z]", "", str(nome).lower())
+    return n in _CAMPI_SENSIBILI or n.endswith(_SUFFISSI_SENSIBILI)
+
+# --- OSCURAMENTO ---
+
+def _oscura_json(obj):
+    if isinstance(obj, dict):
+        return {k: OSCURATO if _sensibile(k) and v not in (None, "") else _oscura_json(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_oscura_json(x) for x in obj]
+    return obj
+
+def _oscura_xml(testo):
+    def _sostituisci(m):
+        if not _sensibile(m.group("tag")) or not m.group("testo").strip():
+            return m.group(0)
+        return f"<{m.group('tag')}{m.group('attr') or ''}>{OSCURATO}</{m.group('tag')}>"
+    return _XML_CAMPO.sub(_sostituisci, testo)
+
+def oscura_testo(testo):
+    """Oscura i campi sensibili di un corpo JSON o XML (altri formati restano invariati)."""
+    if not testo:
+        return testo
+    inizio = testo.lstrip()[:1]
+    if inizio in ("{", "["):
+        try:
+            return json.dumps(_oscura_json(json.loads(testo)), ensure_ascii=False, sort_keys=True)
+        except ValueError:
+            return testo
+    if inizio == "<":
+        return _oscura_xml(testo)
+    return testo
+
+def oscura_headers(headers):
+    return {k: OSCURATO if _sensibile(k) else v for k, v in (headers or {}).items()}
+
+# --- CHIAVE RICHIESTA ---
+
+def _corpo_richiesta(kwargs):
+    if kwargs.get("json") is not None:
+        return json.dumps(kwargs["json"], ensure_ascii=False, sort_keys=True)
+    dati = kwargs.get("data")
+    if isinstance(dati, bytes):
+        return dati.decode("utf-8", errors="replace")
+    return dati if isinstance(dati, str) else ""
+
+def _chiave(metodo, url, corpo_oscurato):
+    # Senza host: le registrazioni fatte in produzione valgono anche puntando allo stub
+    parti = urlsplit(url)
+    impronta = hashlib.sha256(f"{metodo.upper()} {parti.path}?{parti.query}\n{corpo_oscurato}".encode("utf-8"))
+    return impronta.hexdigest()[:16]
+
+# --- FILE ---
+
+def _percorso(endpoint):
+    return os.path.join(config.HTTP_FIXTURE_DIR, re.sub(r"[^A-Za-z0-9_-]", "_", endpoint) + ".json")
+
+def _voci(endpoint):
+    voci = _registrazioni.get(endpoint)
+    if voci is None:
+        voci = []
+        percorso = _percorso(endpoint)
+        if os.path.exists(percorso):
+            with open(percorso, "r", encoding="utf-8") as f:
+                voci = json.load(f)
+        _registrazioni[endpoint] = voci
+    return voci
+
+def _salva(endpoint):
+    storage.scrivi_json(_percorso(endpoint), _registrazioni[endpoint], indent=2)
+
+# --- RECORD / REPLAY ---
+
+def registra(metodo, url, endpoint, kwargs, response):
+    """Salva (oscurata) la risposta di una chiamata reale. Una voce per richiesta distinta."""
+    if kwargs.get("stream"):
+        return  # Il corpo non è stato letto: registrarlo lo consumerebbe
+    richiesta = oscura_testo(_corpo_richiesta(kwargs))
+    contenuto = response.content or b""
+    try:
+        corpo, codifica = oscura_testo(contenuto.decode("utf-8")), "testo"
+    except UnicodeDecodeError:
+        corpo, codifica = base64.b64encode(contenuto).decode("ascii"), "base64"  # PDF etichette
+    voce = {
+        "chiave": _chiave(metodo, url, richiesta),
+        "metodo": metodo.upper(),
+        "url": url,
+        "headers_richiesta": oscura_headers(kwargs.get("headers")),
+        "richiesta": richiesta,
+        "status": response.status_code,
+        "headers": oscura_headers(dict(response.headers)),
+        "codifica": codifica,
+        "corpo": corpo,
+    }
+    with _lock:
+        voci = _voci(endpoint)
+        voci[:] = [v for v in voci if v["chiave"] != voce["chiave"]] + [voce]
+        _salva(endpoint)
+    logger.log.debug(f"Fixture registrata: {endpoint} {voce['chiave']}")
+
+def riproduci(metodo, url, endpoint, kwargs):
+    """
+    Risposta registrata per la richiesta: prima per corrispondenza esatta,
+    altrimenti a turno tra le registrazioni dello stesso endpoint.
+    Senza registrazioni solleva ConnectionError (come una rete assente).
+    """
+    import requests
+    from requests.structures import CaseInsensitiveDict
+
+    chiave = _chiave(metodo, url, oscura_testo(_corpo_richiesta(kwargs)))
+    with _lock:
+        voci = _voci(endpoint)
+        voce = next((v for v in voci if v["chiave"] == chiave), None)
+        if voce is None and voci:
+            indice = _prossimo_replay.get(endpoint, 0)
+            voce = voci[indice % len(voci)]
+            _prossimo_replay[endpoint] = indice + 1
+            logger.log.debug(f"Fixture {endpoint}: nessuna corrispondenza esatta, uso la n.{indice % len(voci) + 1}")
+    if voce is None:
+        raise requests.ConnectionError(f"Nessuna fixture registrata per {endpoint} ({_percorso(endpoint)})")
+
+    response = requests.Response()
+    response.status_code = voce["status"]
+    response.headers = CaseInsensitiveDict(voce.get("headers") or {})
+    response.url = url
+    response.reason = ""
+    response.encoding = "utf-8"
+    if voce.get("codifica") == "base64":
+        response._content = base64.b64decode(voce["corpo"])
+    else:
+        response._content = (voce["corpo"] or "").encode("utf-8")
+    return response
+
+def azzera_cache():
+    """Dimentica le registrazioni lette (es. dopo aver cambiato HTTP_FIXTURE_DIR)."""
+    with _lock:
+        _registrazioni.clear()
+        _prossimo_replay.clear()
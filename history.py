@@ -2,24 +2,25 @@ import json
 import os
 from datetime import datetime
 
+import profilazione
+import storage
+import utils
+
 FILE_STORICO = "storico_spedizioni.json"
 
 FILE_DASHBOARD_STATE = "dashboard_state.json"
 
-def salva_in_storico(tipo, destinatario, tracking, order_id=None, titolo=None):
+# Ultime copie dei dati scaricati (ordini, tracking, spedizioni) per l'avvio a caldo
+CARTELLA_SNAPSHOT = "cache"
+
+@profilazione.misurata("disco")
+def salva_in_storico(tipo, destinatario, tracking, order_id=None, titolo=None, indirizzo=None):
     """
     Salva una nuova spedizione nel file JSON locale.
+    Sotto lock e partendo dal file attuale: più postazioni possono salvare insieme.
+    indirizzo: indirizzo completo del destinatario (per la rubrica).
     """
-    # 1. Carica esistente
-    lista = []
-    if os.path.exists(FILE_STORICO):
-        try:
-            with open(FILE_STORICO, "r", encoding="utf-8") as f:
-                lista = json.load(f)
-        except:
-            lista = []
-
-    # 2. Prepara il nuovo oggetto
+    # 1. Prepara il nuovo oggetto
     nuovo_elemento = {
         "data": datetime.now().strftime("%d/%m/%Y %H:%M"),
         "tipo": tipo,  # "EBAY" o "MANUALE"
@@ -28,29 +29,39 @@ def salva_in_storico(tipo, destinatario, tracking, order_id=None, titolo=None):
         "order_id": order_id if order_id else "-",
         "titolo": titolo if titolo else "-"
     }
+    if indirizzo:
+        nuovo_elemento["indirizzo"] = dict(indirizzo)
 
-    # 3. Aggiungi in cima alla lista
-    lista.insert(0, nuovo_elemento)
+    # 2. Aggiungi in cima alla lista attuale (tieni solo gli ultimi 500 per non appesantire)
+    def _aggiungi(lista):
+        lista = lista if isinstance(lista, list) else []
+        return [nuovo_elemento] + lista[:499]
 
-    # 4. Salva (tieni solo gli ultimi 500 per non appesantire)
     try:
-        with open(FILE_STORICO, "w", encoding="utf-8") as f:
-            json.dump(lista[:500], f, indent=4, ensure_ascii=False)
+        storage.aggiorna_json(FILE_STORICO, _aggiungi, default=[], indent=4)
         return True
     except Exception as e:
         print(f"⚠️ Errore salvataggio storico locale: {e}")
         return False
 
+@profilazione.misurata("disco")
 def leggi_storico_locale():
     """Ritorna la lista delle spedizioni salvate localmente."""
-    if not os.path.exists(FILE_STORICO):
-        return []
     try:
-        with open(FILE_STORICO, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except:
+        lista = storage.leggi_json(FILE_STORICO, [])
+    except ValueError as e:
+        print(f"⚠️ Storico locale illeggibile ({FILE_STORICO}): {e}")
         return []
+    return lista if isinstance(lista, list) else []
 
+def versione_storico():
+    """Cambia a ogni scrittura dello storico (anche da un'altra postazione)."""
+    try:
+        return os.stat(FILE_STORICO).st_mtime_ns
+    except OSError:
+        return None
+
+@profilazione.misurata("disco")
 def leggi_stato_dashboard():
     if not os.path.exists(FILE_DASHBOARD_STATE):
         return {}
@@ -61,12 +72,71 @@ def leggi_stato_dashboard():
     except Exception:
         return {}
 
-def salva_stato_dashboard(stato):
+@profilazione.misurata("disco")
+def salva_stato_dashboard(stato, base=None):
+    """
+    base: lo stato come era stato letto. Se indicato vengono scritte solo le
+    differenze rispetto a base, sopra il file attuale (le altre postazioni non si
+    cancellano a vicenda gli ordini); senza base il file viene sostituito.
+    """
+    def _unisci(su_disco):
+        if base is None:
+            return stato
+        return storage.unisci_dict(base, stato, su_disco if isinstance(su_disco, dict) else {})
+
     try:
-        with open(FILE_DASHBOARD_STATE, "w", encoding="utf-8") as f:
-            json.dump(stato, f, indent=2, ensure_ascii=False)
+        storage.aggiorna_json(FILE_DASHBOARD_STATE, _unisci, default={}, indent=2)
         return True
     except Exception as e:
         print(f"Errore salvataggio stato dashboard: {e}")
         return False
 
+def _percorso_snapshot(nome):
+    return os.path.join(CARTELLA_SNAPSHOT, f"{nome}.json")
+
+@profilazione.misurata("disco")
+def salva_snapshot(nome, dati):
+    """Salva dati JSON in cache/<nome>.json insieme all'orario di salvataggio."""
+    try:
+        contenuto = {"ts": datetime.now().isoformat(timespec="seconds"), "dati": dati}
+        # Solo atomico, senza lock: è una cache, vince l'ultimo che scrive
+        storage.scrivi_json(_percorso_snapshot(nome), contenuto)
+        return True
+    except Exception as e:
+        utils.stampa_avanzamento(f"⚠️ Errore salvataggio snapshot {nome}: {e}")
+        return False
+
+@profilazione.misurata("disco")
+def aggiorna_snapshot(nome, modifica):
+    """
+    Modifica sotto lock i dati di uno snapshot esistente (modifica(dati) li cambia sul
+    posto), lasciando l'orario dello scaricamento. False se lo snapshot non c'è.
+    """
+    percorso = _percorso_snapshot(nome)
+    if not os.path.exists(percorso):
+        return False
+
+    def _modifica(contenuto):
+        if isinstance(contenuto, dict) and isinstance(contenuto.get("dati"), dict):
+            modifica(contenuto["dati"])
+        return contenuto
+
+    try:
+        storage.aggiorna_json(percorso, _modifica)
+        return True
+    except Exception as e:
+        utils.stampa_avanzamento(f"⚠️ Errore aggiornamento snapshot {nome}: {e}")
+        return False
+
+@profilazione.misurata("disco")
+def leggi_snapshot(nome):
+    """Ritorna (dati, datetime_salvataggio) oppure (None, None) se assente o illeggibile."""
+    percorso = _percorso_snapshot(nome)
+    if not os.path.exists(percorso):
+        return None, None
+    try:
+        with open(percorso, "r", encoding="utf-8") as f:
+            contenuto = json.load(f)
+        return contenuto["dati"], datetime.fromisoformat(contenuto["ts"])
+    except Exception:
+        return None, None
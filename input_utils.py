@@ -1,8 +1,13 @@
 import re
-import ebay
+import logger
+import memoria
+import metrics
+import mittenti
+import rubrica
 import utils
 
 _MITTENTE_CACHE = None
+_MITTENTE_FUTURO = None  # Preriscaldamento in corso (vedi avvia_preriscaldamento_mittente)
 
 _LIMITI_TRONCAMENTO = {
     'name': 40,
@@ -20,10 +25,11 @@ _LABEL_CAMPI = {
 
 # --- FUNZIONI DI INPUT ---
 
-def chiedi_peso() -> float:
+def chiedi_peso(etichetta: str = "") -> float:
+    prompt = f"Peso (kg) - {etichetta}: " if etichetta else "Peso (kg): "
     while True:
         try:
-            valore = input("Peso (kg): ").replace(",", ".")
+            valore = input(prompt).replace(",", ".")
             return utils.arrotonda_peso_per_eccesso(float(valore))
         except ValueError as e:
             print(f"❌ Errore peso: {e}")
@@ -123,54 +129,159 @@ def chiedi_indirizzo_libero():
         righe.append(r)
     return parse_indirizzo_blocco("\n".join(righe))
 
-def chiedi_destinatario():
+def _lettere(n):
+    return "abcdefghi"[:n]
+
+def chiedi_destinatario(cerca=None):
+    """
+    cerca(testo): destinatari già usati (rubrica). Se c'è, i più frequenti sono
+    elencati con una lettera (un tasto per sceglierli) e un testo di almeno due
+    caratteri (nome, telefono o CAP) cerca nella rubrica.
+    """
+    trovati = []
+    if cerca is not None:
+        try:
+            trovati = cerca("")[:5]  # I più frequenti: gli altri si cercano
+        except Exception as e:
+            print(f"⚠️  Rubrica non disponibile: {e}")
+            cerca = None
     while True:
         print("\n--- DESTINATARIO ---")
+        for lettera, indirizzo in zip(_lettere(len(trovati)), trovati):
+            print(f" {lettera}) {rubrica.descrizione(indirizzo)}")
         print("1) Incolla indirizzo\n2) Inserimento guidato")
-        scelta = input("Scelta (1/2): ").strip()
+        if cerca is None:
+            scelta = input("Scelta (1/2): ").strip()
+        else:
+            lettere = f", {_lettere(len(trovati))[0]}-{_lettere(len(trovati))[-1]}" if trovati else ""
+            scelta = input(f"Scelta (1/2{lettere}) o cerca (nome, telefono, CAP): ").strip()
         try:
             if scelta == "1":
                 return chiedi_indirizzo_libero()
             elif scelta == "2":
                 return chiedi_indirizzo_guidato()
+            elif len(scelta) == 1 and scelta.lower() in _lettere(len(trovati)):
+                indirizzo = trovati[_lettere(len(trovati)).index(scelta.lower())]
+                print("✅ Dalla rubrica:")
+                _stampa_indirizzo(indirizzo)
+                return indirizzo
+            elif cerca is not None and len(scelta) >= 2:
+                trovati = cerca(scelta)
+                if not trovati:
+                    print(f"Nessun destinatario in rubrica per '{scelta}'.")
             else:
                 print("Scelta non valida.")
         except Exception as e:
             print(f"❌ Errore nell'inserimento: {e}")
 
-def carica_mittente():
-    """Scarica mittente da eBay (o fallback manuale)."""
+def _stampa_indirizzo(indirizzo):
+    print(f"   {indirizzo.get('name', 'N.D.')}")
+    print(f"   {indirizzo.get('address', '')}")
+    print(f"   {indirizzo.get('postalCode', '')} {indirizzo.get('city', '')}")
+
+def scegli_profilo_mittente(profili):
+    """
+    Mostra i profili mittente e ritorna l'indirizzo scelto.
+    INVIO = primo profilo, R = riscarica da eBay, M = inserimento manuale.
+    """
+    while True:
+        nomi = list(profili)
+        if nomi:
+            print("✓ Profili mittente:")
+            for i, nome in enumerate(nomi, 1):
+                profilo = profili[nome]
+                ind = profilo["indirizzo"]
+                agg = ""
+                if profilo.get("aggiornato"):
+                    agg = f" (eBay, agg. {profilo['aggiornato'][:10]})"
+                print(f" {i}) [{nome}] {ind.get('name', 'N.D.')} - {ind.get('postalCode', '')} {ind.get('city', '')}{agg}")
+            prompt = f"\nScegli (1-{len(nomi)}, INVIO=1), R) Riscarica da eBay, M) Manuale: "
+        else:
+            print("⚠️  Nessun profilo mittente disponibile.")
+            prompt = "\nR) Scarica da eBay, M) Manuale: "
+
+        scelta = input(prompt).strip().lower()
+        if scelta == "" and nomi:
+            scelta = "1"
+        if scelta == "m":
+            return chiedi_indirizzo_guidato()
+        if scelta == "r":
+            profilo = mittenti.aggiorna_da_ebay()
+            if profilo:
+                print("✅ Indirizzo recuperato da eBay:")
+                _stampa_indirizzo(profilo["indirizzo"])
+                profili[mittenti.PROFILO_EBAY] = profilo
+            else:
+                print("⚠️  Impossibile recuperare indirizzo da eBay (o richiesta fallita).")
+            continue
+        if scelta.isdigit() and 1 <= int(scelta) <= len(nomi):
+            return dict(profili[nomi[int(scelta) - 1]]["indirizzo"])
+        print("Scelta non valida.")
+
+def _preriscalda_mittente():
+    global _MITTENTE_CACHE
+    mittente = mittenti.mittente_predefinito()
+    if mittente and not _MITTENTE_CACHE:
+        _MITTENTE_CACHE = mittente
+    return mittente
+
+def avvia_preriscaldamento_mittente():
+    """Carica in background il mittente predefinito (file, cache o GetUser) in _MITTENTE_CACHE."""
+    global _MITTENTE_FUTURO
+    if _MITTENTE_CACHE or _MITTENTE_FUTURO is not None:
+        return _MITTENTE_FUTURO
+    _MITTENTE_FUTURO = utils.esegui_in_background(_preriscalda_mittente, nome="bg-mittente")
+    return _MITTENTE_FUTURO
+
+def _mittente_account(account):
+    """Propone il profilo mittente dell'account eBay dell'ordine. None = scegli tra i profili."""
+    nome_profilo = mittenti.profilo_per_account(account)
+    if not nome_profilo:
+        return None
+    profilo = mittenti.carica_profili(consenti_rete=False).get(nome_profilo)
+    if not profilo:
+        logger.log.warning(f"Profilo mittente '{nome_profilo}' dell'account {account} non trovato.")
+        return None
+    print(f"✓ Mittente dell'account eBay [{account}] (profilo {nome_profilo}):")
+    _stampa_indirizzo(profilo["indirizzo"])
+    scelta = input("\nVuoi usare questo mittente? (S/N): ").strip().lower()
+    if scelta != 'n':
+        return dict(profilo["indirizzo"])
+    return dict(scegli_profilo_mittente(mittenti.carica_profili()))
+
+def carica_mittente(account=None):
+    """
+    Mittente da cache di sessione, profili salvati (config/mittente.txt, cache eBay) o eBay.
+    Con account (ordine eBay) si propone prima il profilo associato all'account.
+    """
     global _MITTENTE_CACHE
     print("\n--- MITTENTE ---")
 
+    mittente = _mittente_account(account) if account else None
+    if mittente:
+        return mittente
+
+    if _MITTENTE_FUTURO is not None and not _MITTENTE_CACHE:
+        try:
+            _MITTENTE_FUTURO.result()
+        except Exception:
+            pass
+
     if _MITTENTE_CACHE:
+        metrics.registra_cache("mittente", "hit")
         print("✓ Mittente in cache:")
-        print(f"   {_MITTENTE_CACHE.get('name', 'N.D.')}")
-        print(f"   {_MITTENTE_CACHE.get('address', '')}")
-        print(f"   {_MITTENTE_CACHE.get('postalCode', '')} {_MITTENTE_CACHE.get('city', '')}")
-        scelta = input("\nVuoi usare questo mittente? (S/N): ").strip().lower()
-        if scelta != 'n':
-            return _MITTENTE_CACHE
-    
-    # Tentativo automatico eBay
-    mittente_ebay = ebay.get_mittente_ebay()
-    
-    if mittente_ebay:
-        # Mostriamo l'indirizzo trovato per conferma
-        print("✅ Indirizzo recuperato da eBay:")
-        print(f"   {mittente_ebay.get('name', 'N.D.')}")
-        print(f"   {mittente_ebay.get('address', '')}")
-        print(f"   {mittente_ebay.get('postalCode', '')} {mittente_ebay.get('city', '')}")
-        
+        _stampa_indirizzo(_MITTENTE_CACHE)
         scelta = input("\nVuoi usare questo mittente? (S/N): ").strip().lower()
         if scelta != 'n':
-            _MITTENTE_CACHE = mittente_ebay
-            return mittente_ebay
+            return dict(_MITTENTE_CACHE)
     else:
-        print("⚠️  Impossibile recuperare indirizzo da eBay (o richiesta fallita).")
+        metrics.registra_cache("mittente", "miss")
 
-    print("⚠️  Passiamo all'inserimento manuale.")
-    return chiedi_indirizzo_guidato()
+    # File locale / profilo salvato; eBay (GetUser) solo se mancano o sono scaduti
+    profili = mittenti.carica_profili()
+    mittente = scegli_profilo_mittente(profili)
+    _MITTENTE_CACHE = dict(mittente)
+    return mittente
 
 def modifica_contatto(contatto, label: str):
     """Permette di modificare solo i campi desiderati di un contatto."""
@@ -314,3 +425,6 @@ def gestisci_modifiche(payload):
         return
     else:
         print("❌ Scelta non valida.")
+
+
+memoria.registra_cache("mittente", lambda: _MITTENTE_CACHE, lambda: 1)
@@ -1,8 +1,15 @@
 import os
+import gzip
 import time
+import shutil
+import reprlib
+import threading
 import functools
+from collections import deque, namedtuple
 from datetime import datetime
 
+import config
+
 # --- BLURRER ---
 
 SENSITIVE_KEYS = {
@@ -12,73 +19,185 @@ SENSITIVE_KEYS = {
     "tracking", "order_id"
 }
 
-def safe_repr(obj):
+MAX_ELEMENTI_REPR = 5   # Elementi mostrati per lista/dizionario
+MAX_PROFONDITA_REPR = 3 # Oltre questo livello di annidamento si riassume
+
+# reprlib limita la lunghezza anche per oggetti sconosciuti (es. Response, bytes)
+_REPR_BREVE = reprlib.Repr()
+_REPR_BREVE.maxstring = 60
+_REPR_BREVE.maxother = 60
+
+def safe_repr(obj, _profondita=0):
     """
     Rappresentazione sicura per i log.
-    Oscura automaticamente i campi sensibili.
+    Oscura automaticamente i campi sensibili e limita la dimensione:
+    liste e dizionari lunghi vengono troncati, le strutture profonde riassunte.
     """
     try:
         if isinstance(obj, dict):
-            return {
-                k: ("***" if k.lower() in SENSITIVE_KEYS else safe_repr(v))
-                for k, v in obj.items()
-            }
+            if _profondita >= MAX_PROFONDITA_REPR:
+                return f"<dict {len(obj)} chiavi>"
+            out = {}
+            for i, (k, v) in enumerate(obj.items()):
+                if i >= MAX_ELEMENTI_REPR:
+                    out["..."] = f"+{len(obj) - MAX_ELEMENTI_REPR} chiavi"
+                    break
+                chiave = k.lower() if isinstance(k, str) else k
+                out[k] = "***" if chiave in SENSITIVE_KEYS else safe_repr(v, _profondita + 1)
+            return out
         elif isinstance(obj, (list, tuple)):
-            return [safe_repr(x) for x in obj]
+            if _profondita >= MAX_PROFONDITA_REPR:
+                return f"<{type(obj).__name__} {len(obj)} elementi>"
+            out = [safe_repr(x, _profondita + 1) for x in obj[:MAX_ELEMENTI_REPR]]
+            if len(obj) > MAX_ELEMENTI_REPR:
+                out.append(f"... +{len(obj) - MAX_ELEMENTI_REPR} elementi")
+            return out
         elif isinstance(obj, str):
             if len(obj) > 60:
                 return obj[:20] + "..." + obj[-10:]
             return obj
-        return obj
+        elif isinstance(obj, (int, float, bool)) or obj is None:
+            return obj
+        return _REPR_BREVE.repr(obj)
     except Exception:
         return "***"
 
+def _riassumi_output(risultato):
+    """Riassunto compatto (e già oscurato) del valore di ritorno di una funzione."""
+    if isinstance(risultato, list):
+        return f"Lista di {len(risultato)} elementi"
+    if isinstance(risultato, tuple):
+        parti = ", ".join(
+            f"Lista di {len(x)} elementi" if isinstance(x, list) else str(safe_repr(x))
+            for x in risultato[:MAX_ELEMENTI_REPR]
+        )
+        return f"Tupla ({len(risultato)}): [{parti}]"
+    if isinstance(risultato, dict):
+        if len(risultato) > MAX_ELEMENTI_REPR:
+            return f"Dizionario con {len(risultato)} chiavi"
+        return str(safe_repr(risultato))
+    out_log = str(safe_repr(risultato))
+    if len(out_log) > 100:
+        out_log = out_log[:100] + "..."
+    return out_log
+
 # --- CONFIGURAZIONE ---
-K = 30                  # I log più vecchi di questi giorni verranno cancellati
+K = config.LOG_GIORNI_COMPRESSIONE  # I log più vecchi di questi giorni vengono compressi
 CARTELLA_LOG = "logs"   # Nome della cartella
+SPAN_MAX = 500          # Ultime durate di funzione tenute in memoria
+
+# Ordine di gravità dei livelli (il nome è quello scritto nel file)
+LIVELLI = {"DEBUG": 10, "INFO": 20, "OK": 25, "WARN": 30, "ERROR": 40}
 
 class GestoreLog:
-    def __init__(self, cartella_output=CARTELLA_LOG, giorni_conservazione=K):
+    def __init__(self, cartella_output=CARTELLA_LOG, giorni_conservazione=K, livello_minimo=None,
+                 max_mb=None):
         self.cartella = cartella_output
         self.giorni_conservazione = giorni_conservazione
+        self.max_bytes = int((config.LOG_MAX_MB if max_mb is None else max_mb) * 1024 * 1024)
+        self.imposta_livello(livello_minimo or config.LOG_LEVEL)
+        self._thread_manutenzione = None
         
-        # 1. Crea la cartella se non esiste
-        if not os.path.exists(self.cartella):
-            try:
-                os.makedirs(self.cartella)
-                print(f"[Sistema] Cartella '{self.cartella}' creata.")
-            except OSError as e:
-                print(f"[Sistema] Errore creazione cartella log: {e}")
+        # La cartella viene creata alla prima scrittura e la pulizia NON gira qui
+        # (vedi avvia_manutenzione): importare il logger non tocca il disco.
+        self._cartella_pronta = False
 
-        # 2. Esegue la pulizia automatica all'avvio
-        self._pulizia_automatica()
+    def avvia_manutenzione(self):
+        """Avvia compressione e pulizia dei log in un thread daemon (una volta per processo)."""
+        if self._thread_manutenzione is not None:
+            return self._thread_manutenzione
+        self._thread_manutenzione = threading.Thread(
+            target=self._pulizia_automatica, name="manutenzione-log", daemon=True
+        )
+        self._thread_manutenzione.start()
+        return self._thread_manutenzione
 
     def _pulizia_automatica(self):
-        #Elimina i file .txt più vecchi di K giorni
+        # 1. Comprime i .txt più vecchi di K giorni  2. Rispetta il tetto di dimensione
         try:
-            adesso = time.time()
-            limite_tempo = adesso - (self.giorni_conservazione * 86400) # 86400 sec = 1 giorno
-            count = 0
-            
-            if os.path.exists(self.cartella):
-                for nome_file in os.listdir(self.cartella):
-                    percorso = os.path.join(self.cartella, nome_file)
-                    # Controlla che sia un file .txt
-                    if os.path.isfile(percorso) and nome_file.endswith(".txt"):
-                        if os.path.getmtime(percorso) < limite_tempo:
-                            os.remove(percorso)
-                            count += 1
-            if count > 0:
-                print(f"[Sistema] Pulizia completata: rimossi {count} file vecchi.")
+            if not os.path.exists(self.cartella):
+                return
+            compressi = self._comprimi_vecchi()
+            rimossi = self._applica_tetto_dimensione()
+            if compressi or rimossi:
+                self.info(f"[Sistema] Manutenzione log: compressi {compressi}, rimossi {rimossi} file.")
         except Exception as e:
-            print(f"[Sistema] Errore pulizia log: {e}")
+            self.warning(f"[Sistema] Errore manutenzione log: {e}")
+
+    def _comprimi_vecchi(self):
+        limite_tempo = time.time() - (self.giorni_conservazione * 86400) # 86400 sec = 1 giorno
+        count = 0
+        for nome_file in os.listdir(self.cartella):
+            percorso = os.path.join(self.cartella, nome_file)
+            if not (nome_file.endswith(".txt") and os.path.isfile(percorso)):
+                continue
+            mtime = os.path.getmtime(percorso)
+            if mtime >= limite_tempo:
+                continue
+            destinazione = percorso + ".gz"
+            try:
+                with open(percorso, "rb") as src, gzip.open(destinazione, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                # Manteniamo la data originale: il tetto di dimensione elimina i più vecchi
+                os.utime(destinazione, (mtime, mtime))
+                os.remove(percorso)
+                count += 1
+            except OSError as e:
+                self.warning(f"[Sistema] Compressione log fallita ({nome_file}): {e}")
+                if os.path.exists(destinazione) and os.path.exists(percorso):
+                    os.remove(destinazione)
+        return count
+
+    def _applica_tetto_dimensione(self):
+        if self.max_bytes <= 0:
+            return 0
+        file_log = []
+        for nome_file in os.listdir(self.cartella):
+            percorso = os.path.join(self.cartella, nome_file)
+            if os.path.isfile(percorso) and nome_file.endswith((".txt", ".gz")):
+                st = os.stat(percorso)
+                file_log.append((st.st_mtime, st.st_size, percorso))
+
+        totale = sum(size for _, size, _ in file_log)
+        oggi = self._percorso_oggi()
+        count = 0
+        for _, size, percorso in sorted(file_log):
+            if totale <= self.max_bytes:
+                break
+            if percorso == oggi:
+                continue  # Il file in scrittura non si tocca
+            try:
+                os.remove(percorso)
+                totale -= size
+                count += 1
+            except OSError:
+                pass
+        return count
+
+    def _percorso_oggi(self):
+        # Nome file rotativo: log_YYYY-mm-dd.txt
+        return os.path.join(self.cartella, f"log_{datetime.now().strftime('%Y-%m-%d')}.txt")
+
+    def imposta_livello(self, livello):
+        """Imposta il livello minimo (nome sconosciuto -> INFO)."""
+        self.livello_minimo = LIVELLI.get(str(livello).upper(), LIVELLI["INFO"])
+
+    def abilitato(self, livello):
+        """True se un messaggio di quel livello verrebbe scritto."""
+        return LIVELLI.get(livello, 0) >= self.livello_minimo
 
     def _scrivi(self, livello, icona, messaggio):
         #Scrive fisicamente nel file giornaliero.
+        if not self.abilitato(livello):
+            return
         adesso = datetime.now()
-        # Nome file rotativo: log_YYYY-mm-dd.txt
-        nome_file = f"log_{adesso.strftime('%Y-%m-%d')}.txt"
-        percorso = os.path.join(self.cartella, nome_file)
+        percorso = self._percorso_oggi()
+        if not self._cartella_pronta:
+            try:
+                os.makedirs(self.cartella, exist_ok=True)
+                self._cartella_pronta = True
+            except OSError as e:
+                print(f"[Sistema] Errore creazione cartella log: {e}")
         
         # Formato: [ORA] | ICONA LIVELLO | MESSAGGIO
         riga = f"[{adesso.strftime('%H:%M:%S')}] | {icona} {livello:<7} | {messaggio}\n"
@@ -101,37 +220,62 @@ class GestoreLog:
 log = GestoreLog()
 
 
+# --- SPAN (DURATE DELLE FUNZIONI TRACCIATE) ---
+Span = namedtuple("Span", ["funzione", "inizio", "durata_ms", "esito"])
+
+_SPANS = deque(maxlen=SPAN_MAX)
+_OSSERVATORI_SPAN = []
+
+def aggiungi_osservatore_span(callback):
+    """Registra una funzione chiamata con ogni Span completato."""
+    if callback not in _OSSERVATORI_SPAN:
+        _OSSERVATORI_SPAN.append(callback)
+
+def ultimi_span(nome_funzione=None):
+    """Ritorna gli ultimi span registrati (opzionalmente filtrati per funzione)."""
+    spans = list(_SPANS)
+    if nome_funzione:
+        spans = [s for s in spans if s.funzione == nome_funzione]
+    return spans
+
+def _registra_span(span):
+    _SPANS.append(span)
+    for callback in list(_OSSERVATORI_SPAN):
+        try:
+            callback(span)
+        except Exception:
+            pass
+
+
 # --- IL DECORATORE PER TRACCIARE LE FUNZIONI ---
 def traccia(func):
     """
-    Versione 2.0: Logga Input, Output (riassunto) ed Errori.
+    Versione 3.0: Logga Input, Output (riassunto), Errori e durata.
+    La formattazione di input/output avviene solo se il livello DEBUG è attivo;
+    la durata viene sempre registrata come Span.
     """
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
         nome_func = func.__name__
-        # Log Input
-        log.debug(f"▶️ START: {nome_func} | Input: {safe_repr(args)} {safe_repr(kwargs)}")
+        debug_attivo = log.abilitato("DEBUG")
+        if debug_attivo:
+            log.debug(f"▶️ START: {nome_func} | Input: {safe_repr(args)} {safe_repr(kwargs)}")
 
+        inizio = datetime.now()
+        t0 = time.perf_counter()
         try:
             risultato = func(*args, **kwargs)
-            
-            # --- NOVITÀ: Log Output (intelligente) ---
-            out_log = str(risultato)
-            # Se è troppo lungo (es. file binario o lista enorme), lo tagliamo
-            if len(out_log) > 100:
-                if isinstance(risultato, list):
-                    out_log = f"Lista di {len(risultato)} elementi"
-                elif isinstance(risultato, dict):
-                    out_log = f"Dizionario con {len(risultato)} chiavi"
-                else:
-                    out_log = out_log[:100] + "..."
-            
-            log.debug(f"⏹️ END:   {nome_func} | Output: {out_log}")
-            return risultato
-            
         except Exception as e:
-            log.errore(f"💥 CRASH: {nome_func} fallita! Motivo: {e}")
-            raise e 
+            durata_ms = (time.perf_counter() - t0) * 1000
+            _registra_span(Span(nome_func, inizio, durata_ms, "errore"))
+            log.errore(f"💥 CRASH: {nome_func} fallita dopo {durata_ms:.1f} ms! Motivo: {e}")
+            raise
+
+        durata_ms = (time.perf_counter() - t0) * 1000
+        _registra_span(Span(nome_func, inizio, durata_ms, "ok"))
+        if debug_attivo:
+            log.debug(f"⏹️ END:   {nome_func} | {durata_ms:.1f} ms | Output: {_riassumi_output(risultato)}")
+        return risultato
     return wrapper
 
 if __name__ == "__main__":
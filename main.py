@@ -1,4 +1,8 @@
 import time
+_AVVIO_T0 = time.perf_counter()  # Prima degli import: serve al report --startup-profile
+
+import os
+from concurrent.futures import TimeoutError as FuturoInRitardo
 from datetime import datetime
 import sys
 import io
@@ -7,17 +11,185 @@ import io
 import app_logic
 import check_token
 import config
+import connessione
 import ebay
 import history
 import input_utils
 import logger
+import memoria
+import metrics
+import profilazione
 import services
 import shipitalia
 import ui
 import utils
 
 
-def main():
+class ProfiloAvvio:
+    """Tempi delle fasi di avvio (attivo con --startup-profile)."""
+
+    def __init__(self, attivo=False):
+        self.attivo = attivo
+        self.fasi = []
+        self._ultimo = _AVVIO_T0
+
+    def segna(self, fase):
+        adesso = time.perf_counter()
+        self.fasi.append((fase, (adesso - self._ultimo) * 1000))
+        self._ultimo = adesso
+
+    def totale_ms(self):
+        return (self._ultimo - _AVVIO_T0) * 1000
+
+
+class ControlloToken:
+    """Esito del controllo token eBay in background, letto senza bloccare il menu."""
+
+    def __init__(self, futuro):
+        self._futuro = futuro
+        self.avviso = None
+
+    def aggiorna(self, attesa=0):
+        """Legge l'esito se è pronto, aspettandolo al massimo attesa secondi. Ritorna l'avviso."""
+        if self._futuro is None:
+            return self.avviso
+        try:
+            self.avviso = self._futuro.result(timeout=attesa)
+        except FuturoInRitardo:
+            return self.avviso
+        except Exception as e:
+            logger.log.warning(f"Check token fallito (ignorato): {e}")
+        self._futuro = None
+        return self.avviso
+
+    def scaduto(self, attesa=0):
+        return _token_scaduto(self.aggiorna(attesa))
+
+
+# Attesa massima della risposta eBay sul token prima di creare etichette
+TOKEN_ATTESA_ETICHETTA_SECONDS = 2
+
+# Nome dell'azione profilata per ogni voce del menu (profilazione.py)
+AZIONI_MENU = {
+    "1": "dashboard",
+    "2": "lista ebay",
+    "3": "etichetta rapida",
+    "4": "storico shipitalia",
+    "5": "storico locale",
+    "6": "statistiche",
+    "7": "coda ebay",
+}
+
+
+def _token_scaduto(avviso):
+    return bool(avviso) and "TOKEN EBAY" in avviso and "SCADUTO" in avviso
+
+
+def _chiedi_peso_comune():
+    """Peso uguale per tutti gli ordini, oppure None per chiederlo ordine per ordine."""
+    while True:
+        valore = input("\nPeso comune per tutti (kg, INVIO = un peso per ogni ordine): ").strip()
+        if not valore:
+            return None
+        try:
+            return utils.arrotonda_peso_per_eccesso(float(valore.replace(",", ".")))
+        except ValueError as e:
+            print(f"❌ Errore peso: {e}")
+
+
+def _spedizione_multipla(service, token, ordini):
+    """Più ordini eBay in un colpo: mittente e sconto chiesti una volta, etichette in parallelo."""
+    if not _etichette_possibili(service, token):
+        return
+    print(f"\n📦 Selezionati {len(ordini)} ordini:")
+    for ordine in ordini:
+        print(f"   - {ordine.get('buyer', '')}: {ordine.get('title', '')}")
+
+    peso_comune = _chiedi_peso_comune()
+    pesi = [
+        peso_comune if peso_comune is not None
+        else input_utils.chiedi_peso(f"{ordine.get('buyer', '')} ({ordine.get('title', '')})")
+        for ordine in ordini
+    ]
+    # Un mittente per account eBay (di solito uno solo)
+    mittenti_usati = {}
+    for account in dict.fromkeys(ordine.get("account") for ordine in ordini):
+        mittenti_usati[account] = input_utils.carica_mittente(account)
+    sconto = input_utils.chiedi_codice_sconto()
+
+    lavori = []
+    for ordine, peso in zip(ordini, pesi):
+        payload = app_logic.build_payload(
+            peso, dict(mittenti_usati[ordine.get("account")]), ordine["destinatario"], sconto
+        )
+        input_utils.verifica_troncamenti_payload(payload)
+        lavori.append({"ordine": ordine, "payload": payload})
+
+    ui.stampa_riepilogo_multiplo(lavori, mittenti_usati, sconto)
+    if not input_utils.conferma_operazione():
+        ui.avviso_info("Spedizione multipla annullata (per correggere un ordine spediscilo singolarmente).")
+        input("Premi INVIO per tornare al menu...")
+        return
+
+    print(f"\n⚙️  Generazione di {len(lavori)} etichette in corso...")
+    esiti = service.spedisci_in_blocco(lavori)
+
+    # Storico e cache da un solo thread, nell'ordine della selezione
+    for esito in esiti:
+        ordine = esito["ordine"]
+        if not esito["tracking"]:
+            logger.log.errore(f"Spedizione multipla: etichetta non creata per {ordine.get('order_id')}: {esito['errore']}")
+            continue
+        logger.log.successo(f"Creata etichetta: {esito['tracking']}")
+        service.salva_storico(
+            tipo="EBAY",
+            destinatario=ordine["destinatario"].get("name", "N.D."),
+            tracking=esito["tracking"],
+            order_id=ordine.get("order_id"),
+            titolo=ordine.get("title"),
+            indirizzo=ordine["destinatario"],
+        )
+        service.registra_spedizione(ordine.get("order_id"), esito["tracking"], esito["labelUrl"])
+
+    ui.stampa_esito_multiplo(esiti)
+    print("💾 PDF salvati in etichette/, spedizioni salvate nello storico locale.")
+    input("Premi INVIO per tornare al menu...")
+
+
+def _etichette_possibili(service, token):
+    """
+    Con ShipItalia offline l'etichetta non si crea: meglio dirlo prima di chiedere i dati.
+    Con il token eBay scaduto neanche: si torna al menu, che avvisa ed esce.
+    """
+    if token.scaduto(attesa=TOKEN_ATTESA_ETICHETTA_SECONDS):
+        return False
+    if service.puo_creare_etichette():
+        return True
+    ui.avviso_errore("ShipItalia non raggiungibile: etichette sospese finché non torna la connessione.")
+    input("Premi INVIO per tornare al menu...")
+    return False
+
+def _ordini_da_selezione(righe, testo, risolvi):
+    """Ordini DA SPEDIRE di una selezione multipla ("1-5,8"); None se la selezione non è valida."""
+    try:
+        indici = app_logic.parse_selezione_multipla(testo, len(righe))
+    except ValueError as e:
+        ui.avviso_errore(str(e))
+        time.sleep(1)
+        return None
+    ordini = []
+    for idx in indici:
+        action = risolvi(righe, idx)
+        if action["action"] == "order":
+            ordini.append(action["order"])
+        else:
+            ui.avviso_info(f"#{idx} non è da spedire: ignorato.")
+    return ordini
+
+
+def main(profilo_avvio=False):
+    profilo = ProfiloAvvio(profilo_avvio)
+    profilo.segna("import moduli")
     logger.log.info("--- Avvio Applicazione ---")
 
     try:
@@ -25,38 +197,98 @@ def main():
     except RuntimeError as e:
         ui.avviso_errore(f"CONFIG ERROR: {e}")
         return
-
-    print("🔑 Controllo token...")
-    avviso_token = check_token.check_scadenza_token_silenzioso()
-    if avviso_token:
-        print("\n" + "!" * 60)
-        print(avviso_token)
-        print("!" * 60 + "\n")
-        if "TOKEN EBAY" in avviso_token and "SCADUTO" in avviso_token:
-            input("Premi INVIO per uscire...")
+    profilo.segna("configurazione")
+
+    # Il controllo token (chiamata eBay fino a 5 s) gira in background:
+    # l'avviso compare in cima al menu appena la risposta è pronta.
+    token = ControlloToken(
+        utils.esegui_in_background(check_token.check_scadenza_token_silenzioso, nome="check-token")
+    )
+
+    if config.DEMONE_URL:
+        # Postazione collegata al demone del negozio (demone.py): cache condivisa
+        import demone
+        service = demone.ClientDemone()
+        try:
+            service.salute()
+        except RuntimeError as e:
+            ui.avviso_errore(str(e))
             return
-        time.sleep(3)
-
-    service = services.SpedizioniService(ebay, shipitalia, history)
+        logger.log.info(f"Backend: demone {config.DEMONE_URL}")
+    else:
+        # Sonda veloce dei servizi: senza rete si parte subito in modalità offline
+        connessione.avvia_sonda()
+        service = services.SpedizioniService(ebay, shipitalia, history)
+    # Preriscaldamento: ordini, storico ShipItalia e mittente arrivano in parallelo
+    # mentre l'operatore legge il menu; le voci di menu aspettano quei risultati.
+    service.avvia_preriscaldamento(giorni=30, limit_spedizioni=15)
+    input_utils.avvia_preriscaldamento_mittente()
+    # Worker dell'outbox eBay: riprende anche i tracking rimasti dalla sessione precedente
+    service.avvia_outbox()
+    profilo.segna("servizio")
+
+    # Compressione/pulizia log in background: l'avvio non aspetta la manutenzione
+    logger.log.avvia_manutenzione()
+    # Dimensioni delle cache nel log e tetti MEMORIA_MAX_MB_* (sessioni di un'intera giornata)
+    memoria.avvia_monitor()
 
     while True:
+        # Il tempo passato nel menu principale non appartiene a nessuna azione
+        profilazione.chiudi_azione()
         ui.stampa_header()
+
+        avviso_token = token.aggiorna()
+        if avviso_token:
+            ui.stampa_avviso_token(avviso_token)
+        if _token_scaduto(avviso_token):
+            input("Premi INVIO per uscire...")
+            return
         
-        cache_ts = service.get_cache_last_update()
+        # Una sola richiesta al demone per ridisegno (con il servizio locale: niente rete)
+        stato_menu = service.stato_menu()
+        cache_ts = stato_menu["ordini_aggiornati"]
         if cache_ts:
             ora_str = cache_ts.strftime('%H:%M:%S')
             print(f"⚡ Dati in memoria (Aggiornati alle {ora_str})")
+        ui.stampa_avviso_outbox(stato_menu["outbox"])
+        ui.stampa_avviso_offline(stato_menu["offline"])
         
         ui.stampa_menu_principale()
-        scelta = ui.chiedi_scelta_range(5, label_zero="Uscire")
+        if profilazione.attivo():
+            print("P) ⏱️  Profila con cProfile la prossima azione")
+        if profilo.attivo and profilo.fasi[-1][0] != "primo menu":
+            profilo.segna("primo menu")
+            ui.stampa_profilo_avvio(profilo.fasi, profilo.totale_ms())
+            logger.log.info(
+                "Profilo avvio: " + ", ".join(f"{f}={ms:.0f}ms" for f, ms in profilo.fasi)
+                + f" | totale={profilo.totale_ms():.0f}ms"
+            )
+        scelta = ui.chiedi_scelta_range(7, label_zero="Uscire")
         
         order_id = ""
         titolo_oggetto = ""
         tipo_operazione = "MANUALE"
         destinatario_auto = None
+        account_ordine = None
         skip_creazione = False
 
+        if scelta.upper() == "P" and profilazione.attivo():
+            profilazione.profila_prossima_azione()
+            ui.avviso_info("cProfile attivo per la prossima azione (file .pstats in logs/).")
+            time.sleep(1)
+            continue
+        if scelta.upper() == "M":
+            # Voce nascosta (diagnostica): non compare nel menu
+            ui.stampa_memoria(memoria.stato_cache(), memoria.memoria_processo(), *memoria.istantanea())
+            input("\nPremi INVIO per tornare al menu...")
+            continue
+        if scelta in AZIONI_MENU:
+            profilazione.inizia_azione(AZIONI_MENU[scelta])
+
         if scelta == "0":
+            esito_profilo = profilazione.chiudi_sessione()
+            if esito_profilo:
+                ui.stampa_riepilogo_profilazione(*esito_profilo)
             ui.messaggio_uscita()
             break
 
@@ -69,21 +301,45 @@ def main():
                 input("\nPremi INVIO...")
                 continue
 
-            totale = len(ordini_dashboard)
+            filtro = ""
+            ordinamento = None
+            vista = ordini_dashboard
             
             while True:
                 # 1. Pulizia e Stampa Dashboard (dentro il ciclo per il refresh)
                 ui.stampa_header()
-                ui.stampa_dashboard_ebay(ordini_dashboard, cambiamenti)
+                ui.stampa_dashboard_ebay(vista, cambiamenti if not filtro else [])
+                ui.stampa_avviso_offline(service.stato_offline())
+                ui.stampa_comandi_dashboard(filtro, ordinamento, len(vista), len(ordini_dashboard))
 
-                sel = ui.chiedi_scelta_range(totale)
+                sel = ui.chiedi_scelta_range(len(vista)).lower()
                 if sel == '0':
                     skip_creazione = True
                     break
 
+                # Filtri e ordinamenti leggono l'indice della dashboard (niente ricalcolo)
+                if sel in ('f', 'o', 'x'):
+                    if sel == 'f':
+                        filtro = ui.chiedi_filtro_dashboard()
+                    elif sel == 'o':
+                        pos = ui.ORDINAMENTI_DASHBOARD.index(ordinamento)
+                        ordinamento = ui.ORDINAMENTI_DASHBOARD[(pos + 1) % len(ui.ORDINAMENTI_DASHBOARD)]
+                    else:
+                        filtro, ordinamento = "", None
+                    vista = service.filtra_dashboard(filtro, ordinamento)
+                    continue
+
+                if app_logic.e_selezione_multipla(sel):
+                    ordini_scelti = _ordini_da_selezione(vista, sel, service.resolve_dashboard)
+                    if ordini_scelti:
+                        _spedizione_multipla(service, token, ordini_scelti)
+                        skip_creazione = True
+                        break
+                    continue
+
                 try:
                     idx = int(sel)
-                    action = service.resolve_dashboard(ordini_dashboard, idx)
+                    action = service.resolve_dashboard(vista, idx)
                     
                     # CASO A: Ordine da spedire
                     if action["action"] == "order":
@@ -91,6 +347,7 @@ def main():
                         order_id = ordine['order_id']
                         destinatario_auto = ordine['destinatario']
                         titolo_oggetto = ordine['title']
+                        account_ordine = ordine.get('account')
                         tipo_operazione = "EBAY"
                         print(f"\n📦 Selezionato: {titolo_oggetto}")
                         break # Esce dal ciclo dashboard e va alla creazione etichetta
@@ -109,10 +366,13 @@ def main():
 
                         # --- Tracking Standard (Poste Italiane) ---
                         print(f"\n🔎 Analisi tracking {code}...")
-                        dati_poste = utils.get_stato_tracking_poste_cached(code)
+                        dati_poste = service.stato_tracking(code)
+                        aggiornato = None
+                        if "poste" in service.stato_offline()["servizi"]:
+                            aggiornato = service.aggiornamento_tracking(code)
 
                         if dati_poste:
-                            ui.stampa_dettagli_poste_completi(code, dati_poste)
+                            ui.stampa_dettagli_poste_completi(code, dati_poste, aggiornato)
                         else:
                             print("Info API non disponibili.")
 
@@ -153,12 +413,21 @@ def main():
                     continue
             else:
                 ui.stampa_lista_selezione_ebay(da_spedire)
+                ui.stampa_avviso_offline(service.stato_offline())
                 
                 while True:
                     sel = ui.chiedi_scelta_range(len(da_spedire))
                     if sel == '0':
                         skip_creazione = True
                         break
+
+                    if app_logic.e_selezione_multipla(sel):
+                        ordini_scelti = _ordini_da_selezione(da_spedire, sel, service.resolve_lista_spedire)
+                        if ordini_scelti:
+                            _spedizione_multipla(service, token, ordini_scelti)
+                            skip_creazione = True
+                            break
+                        continue
                     
                     try:
                         idx = int(sel)
@@ -168,6 +437,7 @@ def main():
                             order_id = ordine['order_id']
                             destinatario_auto = ordine['destinatario']
                             titolo_oggetto = ordine['title']
+                            account_ordine = ordine.get('account')
                             tipo_operazione = "EBAY"
                             print(f"\n📦 Selezionato: {titolo_oggetto}")
                             break
@@ -194,6 +464,7 @@ def main():
                 continue
 
             ui.stampa_storico_api(lista)
+            ui.stampa_avviso_offline(service.stato_offline())
             
             while True:
                 sel = ui.chiedi_scelta_range(len(lista))
@@ -212,7 +483,7 @@ def main():
 
         # --- STORICO LOCALE ---
         elif scelta == "5":
-            storico = history.leggi_storico_locale()
+            storico = service.leggi_storico_locale()
             if not storico:
                 ui.avviso_errore("Nessuno storico locale.")
                 time.sleep(2)
@@ -222,16 +493,55 @@ def main():
             input("\nPremi INVIO per tornare al menu...")
             continue
 
+        # --- STATISTICHE (METRICHE DI SESSIONE) ---
+        elif scelta == "6":
+            ui.stampa_header()
+            ui.stampa_statistiche(
+                metrics.riepilogo_http(),
+                metrics.riepilogo_cache(),
+                metrics.riepilogo_funzioni(),
+                avvio=metrics.registro.avvio,
+            )
+            formato = input("\nEsporta: 1) JSON  2) Prometheus  INVIO) Torna al menu: ").strip()
+            if formato in ("1", "2"):
+                estensione = "json" if formato == "1" else "prom"
+                nome = f"metriche_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{estensione}"
+                percorso = metrics.registro.esporta(
+                    os.path.join(logger.CARTELLA_LOG, nome),
+                    formato="json" if formato == "1" else "prometheus",
+                )
+                print(f"💾 Metriche esportate in {percorso}")
+                input("\nPremi INVIO per tornare al menu...")
+            continue
+
+        # --- CODA EBAY (OUTBOX TRACKING) ---
+        elif scelta == "7":
+            while True:
+                ui.stampa_header()
+                ui.stampa_outbox_ebay(service.voci_outbox())
+                comando = input("\nScelta: ").strip().upper()
+                if comando == "R":
+                    n = service.riprova_outbox()
+                    print(f"🔄 {n} tracking rimessi in coda: invio in background.")
+                    time.sleep(1)
+                    continue
+                break
+            continue
+
         else:
             ui.avviso_errore("Scelta non valida.")
             time.sleep(1)
             continue
 
-        # Flusso creazione etichetta
+        if not _etichette_possibili(service, token):
+            continue
+
+        # Flusso creazione etichetta (azione a parte: la scelta dell'ordine resta all'azione di menu)
+        profilazione.inizia_azione("etichetta")
         try:
             peso = input_utils.chiedi_peso()
-            mittente = input_utils.carica_mittente()
-            destinatario = destinatario_auto if destinatario_auto else input_utils.chiedi_destinatario()
+            mittente = input_utils.carica_mittente(account_ordine)
+            destinatario = destinatario_auto if destinatario_auto else input_utils.chiedi_destinatario(service.cerca_rubrica)
             sconto = input_utils.chiedi_codice_sconto()
 
             payload = app_logic.build_payload(peso, mittente, destinatario, sconto)
@@ -255,21 +565,22 @@ def main():
                 destinatario=destinatario.get("name", "N.D."),
                 tracking=tracking,
                 order_id=order_id,
-                titolo=titolo_oggetto
+                titolo=titolo_oggetto,
+                indirizzo=destinatario,
             )
             print("💾 Salvato nello storico locale.")
 
-            service.invalida_ship_cache()
             if order_id and utils.valido_order_id(order_id):
                 service.aggiorna_tracking_ebay(order_id, tracking)
-                
-                # IMPORTANTE: Invalidiamo la cache dopo aver spedito un ordine eBay.
-                service.invalida_cache()
-                print("🔄 Lista ordini invalidata per aggiornamento automatico.")
-
+                print("📮 Tracking in coda per eBay (invio in background).")
             elif order_id == "MANUALE":
                 print("ℹ️  Nessun aggiornamento eBay (Manuale).")
 
+            # Niente invalidazione: le liste in memoria vengono corrette subito
+            # e verificate con le API in background.
+            service.registra_spedizione(order_id, tracking, result.get("labelUrl"))
+            print("🔄 Liste aggiornate (verifica con eBay in background).")
+
             print("\n✨ Operazione conclusa!")
             input("Premi INVIO per tornare al menu...")
     
@@ -279,4 +590,19 @@ def main():
             input("Premi INVIO...")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    argv = sys.argv[1:]
+    profilo_avvio = "--startup-profile" in argv
+    if profilo_avvio:
+        argv.remove("--startup-profile")
+    for arg in [a for a in argv if a == "--profile" or a.startswith("--profile=")]:
+        argv.remove(arg)
+        profilazione.attiva(arg.partition("=")[2] or "1")
+    if config.PROFILE_MODE:
+        profilazione.attiva(config.PROFILE_MODE)
+    if config.MEMORIA_TRACEMALLOC:
+        memoria.avvia_tracemalloc()
+    if argv:
+        # Modalità non interattiva (es. python main.py sync-orders)
+        import cli
+        sys.exit(cli.main(argv))
+    main(profilo_avvio=profilo_avvio)
\ No newline at end of file
@@ -0,0 +1,204 @@
+"""
+Misura e contenimento della memoria per le sessioni lunghe (programma aperto tutto il giorno).
+
+Ogni cache in memoria si registra con registra_cache(): nome, oggetto da misurare,
+numero di voci e, se si può svuotare in parte, una funzione che toglie le voci
+più vecchie. Il monitor in background (avvia_monitor) scrive ogni
+MEMORIA_LOG_INTERVAL_SECONDS una riga di log con voci e byte di ogni cache e
+riporta sotto il tetto (MEMORIA_MAX_MB_<CACHE>) quelle che lo superano.
+Dal menu, il tasto nascosto "M" mostra le stesse misure più le righe di codice
+che allocano di più (tracemalloc, attivato alla prima richiesta).
+"""
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+import config
+import logger
+
+_lock = threading.Lock()
+_cache = {}             # nome -> _CacheMonitorata
+_istantanea_prec = None  # Ultimo snapshot tracemalloc, per mostrare la differenza
+_monitor = None
+
+
+class _CacheMonitorata:
+    __slots__ = ("nome", "oggetto", "voci", "riduci", "limite_mb")
+
+    def __init__(self, nome, oggetto, voci, riduci, limite_mb):
+        self.nome = nome
+        self.oggetto = oggetto
+        self.voci = voci
+        self.riduci = riduci
+        self.limite_mb = limite_mb
+
+
+def registra_cache(nome, oggetto, voci, riduci=None, limite_mb=None):
+    """
+    oggetto(): ciò che la cache tiene in memoria (None = cache vuota/non più esistente).
+    voci(): numero di voci. riduci(n): toglie le n voci più vecchie e ritorna quante ne ha tolte.
+    limite_mb: tetto in MB (None = solo misura). Un nome già registrato viene sostituito.
+    """
+    with _lock:
+        _cache[nome] = _CacheMonitorata(nome, oggetto, voci, riduci, limite_mb)
+
+def limite_mb(nome_cache, default):
+    """Tetto configurabile per cache: MEMORIA_MAX_MB_TRACKING_POSTE=20 ecc. (0 = nessun tetto)."""
+    valore = float(os.getenv(f"MEMORIA_MAX_MB_{nome_cache.upper()}", default))
+    return valore or None
+
+# --- MISURA ---
+
+def dimensione_profonda(obj, _visti=None):
+    """Byte occupati da obj e da tutto ciò che contiene (dict, liste, record con __slots__...)."""
+    visti = set() if _visti is None else _visti
+    da_visitare = [obj]
+    totale = 0
+    while da_visitare:
+        o = da_visitare.pop()
+        if id(o) in visti:
+            continue
+        visti.add(id(o))
+        totale += sys.getsizeof(o, 0)
+        if isinstance(o, (str, bytes, int, float, bool, type(None))):
+            continue
+        if isinstance(o, dict):
+            da_visitare.extend(o.keys())
+            da_visitare.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            da_visitare.extend(o)
+        else:
+            if hasattr(o, "__dict__"):
+                da_visitare.append(vars(o))
+            for classe in type(o).__mro__:
+                for slot in getattr(classe, "__slots__", ()):
+                    if hasattr(o, slot):
+                        da_visitare.append(getattr(o, slot))
+    return totale
+
+def _misura(cache):
+    try:
+        oggetto = cache.oggetto()
+        return (cache.voci() if oggetto is not None else 0), (dimensione_profonda(oggetto) if oggetto is not None else 0)
+    except Exception as e:
+        logger.log.debug(f"Misura memoria {cache.nome} fallita: {e}")
+        return 0, 0
+
+def stato_cache():
+    """
+    [{"nome", "voci", "byte", "limite_byte"}] per ogni cache registrata.
+    I byte includono gli oggetti condivisi (es. gli ordini visti dalla dashboard).
+    """
+    with _lock:
+        registrate = list(_cache.values())
+    righe = []
+    for cache in registrate:
+        voci, byte = _misura(cache)
+        righe.append({
+            "nome": cache.nome,
+            "voci": voci,
+            "byte": byte,
+            "limite_byte": int(cache.limite_mb * 1024 * 1024) if cache.limite_mb else None,
+        })
+    return righe
+
+def memoria_processo():
+    """Picco di memoria del processo in byte (None dove non disponibile, es. Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    picco = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return picco if sys.platform == "darwin" else picco * 1024  # Linux: KB
+
+# --- LIMITI ---
+
+def applica_limiti():
+    """Riporta sotto il tetto le cache che lo superano (toglie un quarto delle voci alla volta)."""
+    with _lock:
+        registrate = [c for c in _cache.values() if c.riduci and c.limite_mb]
+    ridotte = {}
+    for cache in registrate:
+        limite = cache.limite_mb * 1024 * 1024
+        voci, byte = _misura(cache)
+        tolte = 0
+        while byte > limite and voci > 0:
+            rimosse = cache.riduci(max(1, voci // 4))
+            if not rimosse:
+                break
+            tolte += rimosse
+            voci, byte = _misura(cache)
+        if tolte:
+            ridotte[cache.nome] = tolte
+            logger.log.warning(
+                f"Cache {cache.nome} oltre il tetto di {cache.limite_mb:g} MB: tolte {tolte} voci "
+                f"(ora {voci} voci, {byte / 1024:.0f} KB)"
+            )
+    return ridotte
+
+def riga_log(righe=None):
+    righe = stato_cache() if righe is None else righe
+    parti = [f"{r['nome']}={r['voci']} voci/{r['byte'] / 1024:.0f}KB" for r in righe]
+    processo = memoria_processo()
+    if processo:
+        parti.append(f"picco processo={processo / 1024 / 1024:.0f}MB")
+    return "Memoria cache: " + ", ".join(parti)
+
+def avvia_monitor(intervallo=None):
+    """Thread daemon: ogni intervallo applica i tetti e scrive la riga di log delle dimensioni."""
+    global _monitor
+    intervallo = intervallo or config.MEMORIA_LOG_INTERVAL_SECONDS
+    if _monitor is not None or intervallo <= 0:
+        return _monitor
+
+    def _ciclo():
+        while True:
+            time.sleep(intervallo)
+            try:
+                applica_limiti()
+                logger.log.info(riga_log())
+            except Exception as e:
+                logger.log.warning(f"Monitor memoria: {e}")
+
+    _monitor = threading.Thread(target=_ciclo, name="monitor-memoria", daemon=True)
+    _monitor.start()
+    return _monitor
+
+# --- TRACEMALLOC ---
+
+def avvia_tracemalloc():
+    """Dall'avvio (MEMORIA_TRACEMALLOC=1) le istantanee vedono anche le allocazioni iniziali."""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(10)
+
+def istantanea(limite=15):
+    """
+    Righe di codice che allocano di più, e differenza dall'istantanea precedente.
+    Alla prima chiamata avvia tracemalloc: vede solo ciò che viene allocato da lì in poi.
+    Ritorna (appena_avviato, top, differenze) con top/differenze = [(posizione, byte, blocchi)].
+    """
+    global _istantanea_prec
+    appena_avviato = not tracemalloc.is_tracing()
+    avvia_tracemalloc()
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    top = [
+        (str(stat.traceback[0]), stat.size, stat.count)
+        for stat in snapshot.statistics("lineno")[:limite]
+    ]
+    differenze = []
+    if _istantanea_prec is not None:
+        differenze = [
+            (str(stat.traceback[0]), stat.size_diff, stat.count_diff)
+            for stat in snapshot.compare_to(_istantanea_prec, "lineno")[:limite]
+            if stat.size_diff
+        ]
+    _istantanea_prec = snapshot
+    return appena_avviato, top, differenze
+
+
+registra_cache("span_log", lambda: logger._SPANS, lambda: len(logger._SPANS))
@@ -0,0 +1,277 @@
+import json
+import os
+import threading
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import logger
+
+# Limiti superiori (secondi) dei bucket degli istogrammi di latenza
+BUCKET_LATENZA = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Ultimo segmento del path -> servizio (vale anche con URL sovrascritti)
+_ENDPOINT_NOTI = {
+    "generate-label": "shipitalia",
+    "shipments": "shipitalia",
+    "ricercasemplice": "poste",
+}
+
+
+class _Istogramma:
+    __slots__ = ("conteggio", "somma", "minimo", "massimo", "bucket")
+
+    def __init__(self):
+        self.conteggio = 0
+        self.somma = 0.0
+        self.minimo = None
+        self.massimo = None
+        self.bucket = [0] * (len(BUCKET_LATENZA) + 1)  # ultimo = +Inf
+
+    def osserva(self, valore):
+        self.conteggio += 1
+        self.somma += valore
+        self.minimo = valore if self.minimo is None else min(self.minimo, valore)
+        self.massimo = valore if self.massimo is None else max(self.massimo, valore)
+        for i, limite in enumerate(BUCKET_LATENZA):
+            if valore <= limite:
+                self.bucket[i] += 1
+                return
+        self.bucket[-1] += 1
+
+    def percentile(self, q):
+        """Stima del percentile dal limite superiore del bucket."""
+        if not self.conteggio:
+            return None
+        soglia = q * self.conteggio
+        cumulato = 0
+        for i, n in enumerate(self.bucket):
+            cumulato += n
+            if cumulato >= soglia:
+                return min(BUCKET_LATENZA[i], self.massimo) if i < len(BUCKET_LATENZA) else self.massimo
+        return self.massimo
+
+
+def _escape_etichetta(valore):
+    return str(valore).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _chiave(nome, etichette):
+    return nome, tuple(sorted(etichette.items()))
+
+
+class RegistroMetriche:
+    """Contatori e istogrammi in memoria, thread-safe (i worker del tracking scrivono in parallelo)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contatori = {}
+        self._istogrammi = {}
+        self.avvio = datetime.now()
+
+    def incrementa(self, nome, valore=1, **etichette):
+        chiave = _chiave(nome, etichette)
+        with self._lock:
+            self._contatori[chiave] = self._contatori.get(chiave, 0) + valore
+
+    def osserva(self, nome, valore, **etichette):
+        chiave = _chiave(nome, etichette)
+        with self._lock:
+            ist = self._istogrammi.get(chiave)
+            if ist is None:
+                ist = self._istogrammi[chiave] = _Istogramma()
+            ist.osserva(valore)
+
+    def valore(self, nome, **etichette):
+        with self._lock:
+            return self._contatori.get(_chiave(nome, etichette), 0)
+
+    def totale(self, nome):
+        """Somma di un contatore su tutte le etichette."""
+        with self._lock:
+            return sum(v for (n, _), v in self._contatori.items() if n == nome)
+
+    def azzera(self):
+        with self._lock:
+            self._contatori.clear()
+            self._istogrammi.clear()
+            self.avvio = datetime.now()
+
+    def snapshot(self):
+        with self._lock:
+            contatori = [
+                {"nome": nome, "etichette": dict(et), "valore": v}
+                for (nome, et), v in sorted(self._contatori.items())
+            ]
+            istogrammi = []
+            for (nome, et), ist in sorted(self._istogrammi.items(), key=lambda x: x[0]):
+                istogrammi.append({
+                    "nome": nome,
+                    "etichette": dict(et),
+                    "conteggio": ist.conteggio,
+                    "somma": round(ist.somma, 6),
+                    "min": ist.minimo,
+                    "max": ist.massimo,
+                    "p50": ist.percentile(0.5),
+                    "p95": ist.percentile(0.95),
+                    "bucket": dict(zip([str(b) for b in BUCKET_LATENZA] + ["+Inf"], ist.bucket)),
+                })
+        return {
+            "generato": datetime.now().isoformat(timespec="seconds"),
+            "avvio": self.avvio.isoformat(timespec="seconds"),
+            "contatori": contatori,
+            "istogrammi": istogrammi,
+        }
+
+    def testo_prometheus(self):
+        """Formato di esposizione testuale Prometheus."""
+        snap = self.snapshot()
+        righe = []
+
+        def _et(etichette, extra=None):
+            coppie = dict(etichette)
+            if extra:
+                coppie.update(extra)
+            if not coppie:
+                return ""
+            corpo = ",".join(f'{k}="{_escape_etichetta(v)}"' for k, v in coppie.items())
+            return "{" + corpo + "}"
+
+        visti = set()
+        for c in snap["contatori"]:
+            nome = f"spedizioni_{c['nome']}"
+            if nome not in visti:
+                righe.append(f"# TYPE {nome} counter")
+                visti.add(nome)
+            righe.append(f"{nome}{_et(c['etichette'])} {c['valore']}")
+
+        for h in snap["istogrammi"]:
+            nome = f"spedizioni_{h['nome']}"
+            if nome not in visti:
+                righe.append(f"# TYPE {nome} histogram")
+                visti.add(nome)
+            cumulato = 0
+            for le, n in h["bucket"].items():
+                cumulato += n
+                righe.append(f"{nome}_bucket{_et(h['etichette'], {'le': le})} {cumulato}")
+            righe.append(f"{nome}_sum{_et(h['etichette'])} {h['somma']}")
+            righe.append(f"{nome}_count{_et(h['etichette'])} {h['conteggio']}")
+        return "\n".join(righe) + "\n"
+
+    def esporta(self, percorso, formato="json"):
+        """Scrive le metriche su file ('json' o 'prometheus'). Ritorna il percorso."""
+        cartella = os.path.dirname(percorso)
+        if cartella:
+            os.makedirs(cartella, exist_ok=True)
+        with open(percorso, "w", encoding="utf-8") as f:
+            if formato == "prometheus":
+                f.write(self.testo_prometheus())
+            else:
+                json.dump(self.snapshot(), f, indent=2, ensure_ascii=False)
+        return percorso
+
+
+registro = RegistroMetriche()
+
+
+# --- SCORCIATOIE ---
+
+def incrementa(nome, valore=1, **etichette):
+    registro.incrementa(nome, valore, **etichette)
+
+def osserva(nome, valore, **etichette):
+    registro.osserva(nome, valore, **etichette)
+
+def registra_cache(cache, esito):
+    """esito: 'hit', 'miss' o 'stale' (dato scaduto usato come fallback)."""
+    registro.incrementa("cache_accessi_totale", cache=cache, esito=esito)
+
+def nome_endpoint(url, headers=None):
+    """Etichetta stabile per una chiamata HTTP (es. 'ebay:GetOrders', 'poste:ricercasemplice')."""
+    call_name = (headers or {}).get("X-EBAY-API-CALL-NAME")
+    if call_name:
+        return f"ebay:{call_name}"
+    parti = urlsplit(url or "")
+    segmenti = [s for s in parti.path.split("/") if s]
+    if segmenti and segmenti[-1] in _ENDPOINT_NOTI:
+        return f"{_ENDPOINT_NOTI[segmenti[-1]]}:{segmenti[-1]}"
+    return parti.hostname or "sconosciuto"
+
+def registra_chiamata_http(endpoint, durata, status=None, retry=0, byte_ricevuti=None):
+    """Registra latenza, retry e fallimenti di una chiamata (status None = eccezione di rete)."""
+    registro.osserva("http_durata_secondi", durata, endpoint=endpoint)
+    registro.incrementa("http_richieste_totale", endpoint=endpoint)
+    if byte_ricevuti:
+        registro.incrementa("http_byte_ricevuti_totale", byte_ricevuti, endpoint=endpoint)
+    if retry:
+        registro.incrementa("http_retry_totale", retry, endpoint=endpoint)
+    if status is None or status >= 400:
+        registro.incrementa("http_fallimenti_totale", endpoint=endpoint)
+
+
+# --- COLLEGAMENTO A @traccia ---
+
+def _osserva_span(span):
+    registro.osserva("funzione_durata_secondi", span.durata_ms / 1000, funzione=span.funzione)
+    if span.esito != "ok":
+        registro.incrementa("funzione_errori_totale", funzione=span.funzione)
+
+logger.aggiungi_osservatore_span(_osserva_span)
+
+
+# --- RIEPILOGHI PER LA SCHERMATA STATISTICHE ---
+
+def riepilogo_http():
+    """Una riga per endpoint: chiamate, fallimenti, retry, latenze."""
+    snap = registro.snapshot()
+    righe = {}
+    for h in snap["istogrammi"]:
+        if h["nome"] != "http_durata_secondi":
+            continue
+        ep = h["etichette"].get("endpoint", "?")
+        righe[ep] = {
+            "endpoint": ep,
+            "chiamate": h["conteggio"],
+            "media_ms": (h["somma"] / h["conteggio"] * 1000) if h["conteggio"] else 0,
+            "p95_ms": (h["p95"] or 0) * 1000,
+            "max_ms": (h["max"] or 0) * 1000,
+            "fallimenti": 0,
+            "retry": 0,
+        }
+    for c in snap["contatori"]:
+        ep = c["etichette"].get("endpoint")
+        if ep not in righe:
+            continue
+        if c["nome"] == "http_fallimenti_totale":
+            righe[ep]["fallimenti"] = c["valore"]
+        elif c["nome"] == "http_retry_totale":
+            righe[ep]["retry"] = c["valore"]
+    return sorted(righe.values(), key=lambda r: r["endpoint"])
+
+def riepilogo_cache():
+    """Una riga per cache: hit, miss, stale e hit rate."""
+    righe = {}
+    for c in registro.snapshot()["contatori"]:
+        if c["nome"] != "cache_accessi_totale":
+            continue
+        nome = c["etichette"].get("cache", "?")
+        riga = righe.setdefault(nome, {"cache": nome, "hit": 0, "miss": 0, "stale": 0})
+        riga[c["etichette"].get("esito", "miss")] = c["valore"]
+    for riga in righe.values():
+        totale = riga["hit"] + riga["miss"] + riga["stale"]
+        riga["hit_rate"] = (riga["hit"] / totale) if totale else 0.0
+    return sorted(righe.values(), key=lambda r: r["cache"])
+
+def riepilogo_funzioni(limite=10):
+    """Le funzioni tracciate con più tempo totale."""
+    righe = []
+    for h in registro.snapshot()["istogrammi"]:
+        if h["nome"] != "funzione_durata_secondi":
+            continue
+        righe.append({
+            "funzione": h["etichette"].get("funzione", "?"),
+            "chiamate": h["conteggio"],
+            "totale_ms": h["somma"] * 1000,
+            "media_ms": (h["somma"] / h["conteggio"] * 1000) if h["conteggio"] else 0,
+        })
+    righe.sort(key=lambda r: r["totale_ms"], reverse=True)
+    return righe[:limite]
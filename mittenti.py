@@ -0,0 +1,125 @@
+import configparser
+import os
+from datetime import datetime
+
+import config
+import ebay
+import history
+import logger
+import utils
+
+# Profilo scaricato da eBay (GetUser), salvato in cache/ con la data di aggiornamento
+NOME_SNAPSHOT_MITTENTI = "mittenti"
+PROFILO_EBAY = "ebay"
+
+# Chiavi accettate in config/mittente.txt -> campo del payload ShipItalia
+_CAMPI_FILE = {
+    "name": "name", "nome": "name",
+    "address": "address", "indirizzo": "address", "via": "address",
+    "postalcode": "postalCode", "cap": "postalCode",
+    "city": "city", "citta": "city", "città": "city",
+    "phone": "phone", "telefono": "phone",
+}
+
+
+def _profili_da_file(percorso=None):
+    """
+    Legge i profili da config/mittente.txt (formato INI, una sezione per profilo):
+
+        [negozio]
+        nome = Mario Rossi
+        indirizzo = Via Roma 1
+        cap = 20100
+        citta = Milano
+        telefono = 3331234567
+
+    Un file senza intestazione [..] vale come profilo unico "predefinito".
+    """
+    percorso = percorso or config.MITTENTE_FILE
+    if not os.path.exists(percorso):
+        return {}
+    try:
+        with open(percorso, "r", encoding="utf-8") as f:
+            testo = f.read()
+        if not testo.lstrip().startswith("["):
+            testo = "[predefinito]\n" + testo
+        parser = configparser.ConfigParser(interpolation=None)
+        parser.read_string(testo)
+    except (OSError, configparser.Error) as e:
+        logger.log.warning(f"File mittente non leggibile ({percorso}): {e}")
+        return {}
+
+    profili = {}
+    for sezione in parser.sections():
+        indirizzo = {"name": "", "address": "", "postalCode": "", "city": "", "phone": ""}
+        for chiave, valore in parser.items(sezione):
+            campo = _CAMPI_FILE.get(chiave.strip().lower())
+            if campo:
+                indirizzo[campo] = valore.strip()
+        indirizzo["phone"] = utils.normalizza_telefono(indirizzo["phone"])
+        if indirizzo["name"] and indirizzo["address"]:
+            profili[sezione] = {"indirizzo": indirizzo, "origine": "file", "aggiornato": None}
+    return profili
+
+def _profili_salvati():
+    dati, _ts = history.leggi_snapshot(NOME_SNAPSHOT_MITTENTI)
+    return dati if isinstance(dati, dict) else {}
+
+def _scaduto(profilo):
+    try:
+        aggiornato = datetime.fromisoformat(profilo.get("aggiornato") or "")
+    except ValueError:
+        return True
+    return (datetime.now() - aggiornato).total_seconds() > config.MITTENTE_MAX_AGE_SECONDS
+
+def aggiorna_da_ebay(nome=PROFILO_EBAY):
+    """Scarica il mittente da eBay (GetUser) e lo salva. Ritorna il profilo o None."""
+    indirizzo = ebay.get_mittente_ebay()
+    if not indirizzo:
+        return None
+    profilo = {
+        "indirizzo": indirizzo,
+        "origine": "ebay",
+        "aggiornato": datetime.now().isoformat(timespec="seconds"),
+    }
+    salvati = _profili_salvati()
+    salvati[nome] = profilo
+    history.salva_snapshot(NOME_SNAPSHOT_MITTENTI, salvati)
+    return profilo
+
+def carica_profili(consenti_rete=True):
+    """
+    Profili mittente disponibili, in ordine di priorità:
+    1. config/mittente.txt (vince sempre, nessuna chiamata eBay)
+    2. profilo eBay salvato in cache/
+    Il profilo eBay viene riscaricato solo se manca il file e il salvato è assente
+    o più vecchio di MITTENTE_MAX_AGE_SECONDS (e consenti_rete=True).
+    """
+    profili = _profili_da_file()
+    salvati = _profili_salvati()
+    profilo_ebay = salvati.get(PROFILO_EBAY)
+
+    if not profili and consenti_rete and (profilo_ebay is None or _scaduto(profilo_ebay)):
+        profilo_ebay = aggiorna_da_ebay() or profilo_ebay
+
+    for nome, profilo in salvati.items():
+        if nome == PROFILO_EBAY:
+            continue
+        profili.setdefault(nome, profilo)
+    if profilo_ebay:
+        profili.setdefault(PROFILO_EBAY, profilo_ebay)
+    return profili
+
+def mittente_predefinito(consenti_rete=True):
+    """Indirizzo del primo profilo disponibile (None se non ce ne sono)."""
+    profili = carica_profili(consenti_rete=consenti_rete)
+    for profilo in profili.values():
+        return dict(profilo["indirizzo"])
+    return None
+
+def profilo_per_account(nome_account):
+    """Nome del profilo mittente associato a un account eBay (EBAY_MITTENTE_<NOME>), se c'è."""
+    for account in config.EBAY_ACCOUNTS:
+        if account.nome == nome_account:
+            return account.mittente or None
+    return None
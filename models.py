@@ -0,0 +1,341 @@
+import sys
+from collections.abc import Mapping, MutableMapping
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+
+class _Record(MutableMapping):
+    """
+    Record a slot che si legge e scrive come un dict (ordine["tracking"], .get, dict(...)),
+    così ui, app_logic e i servizi non devono cambiare. Le chiavi non previste finiscono
+    in _extra, creato solo quando serve.
+    """
+    __slots__ = ("_extra",)
+    # Solo campi con pochi valori ricorrenti (stati, account, città): le stringhe internate
+    # non si liberano più, un campo quasi unico (acquirente, titolo, date) farebbe solo crescere la memoria
+    _INTERNATI: frozenset = frozenset()
+    _CONVERSIONI: Dict[str, Any] = {}     # Campo -> funzione di conversione in scrittura
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._CAMPI = tuple(cls.__slots__)
+        cls._CAMPI_SET = frozenset(cls._CAMPI)
+
+    def __init__(self, dati: Optional[Mapping] = None, **valori):
+        self._extra = None
+        if dati:
+            for chiave, valore in dati.items():
+                self[chiave] = valore
+        for chiave, valore in valori.items():
+            self[chiave] = valore
+
+    @classmethod
+    def from_dict(cls, dati: Mapping):
+        if isinstance(dati, cls):
+            return dati
+        return cls(dati)
+
+    def __getitem__(self, chiave: str) -> Any:
+        if chiave in self._CAMPI_SET:
+            try:
+                return getattr(self, chiave)
+            except AttributeError:
+                raise KeyError(chiave) from None
+        if self._extra is not None and chiave in self._extra:
+            return self._extra[chiave]
+        raise KeyError(chiave)
+
+    def __setitem__(self, chiave: str, valore: Any) -> None:
+        if chiave in self._CAMPI_SET:
+            converti = self._CONVERSIONI.get(chiave)
+            if converti is not None and valore is not None:
+                valore = converti(valore)
+            elif chiave in self._INTERNATI and isinstance(valore, str):
+                valore = sys.intern(valore)
+            setattr(self, chiave, valore)
+            return
+        if self._extra is None:
+            self._extra = {}
+        self._extra[chiave] = valore
+
+    def __delitem__(self, chiave: str) -> None:
+        if chiave in self._CAMPI_SET:
+            try:
+                delattr(self, chiave)
+            except AttributeError:
+                raise KeyError(chiave) from None
+            return
+        if self._extra is None or chiave not in self._extra:
+            raise KeyError(chiave)
+        del self._extra[chiave]
+
+    def __iter__(self) -> Iterator[str]:
+        for campo in self._CAMPI:
+            if hasattr(self, campo):
+                yield campo
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def to_dict(self) -> dict:
+        return {chiave: come_dict(valore) if isinstance(valore, Mapping) else valore
+                for chiave, valore in self.items()}
+
+    def copy(self):
+        return type(self)(self)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class Address(_Record):
+    """Indirizzo di un destinatario eBay (stesse chiavi del payload ShipItalia)."""
+    __slots__ = ("name", "address", "city", "postalCode", "phone")
+    _INTERNATI = frozenset({"city"})
+
+
+class Order(_Record):
+    """Ordine eBay come prodotto da ebay._parse_ordine."""
+    __slots__ = (
+        "order_id", "buyer", "date", "created_at", "title", "destinatario",
+        "shipped_at", "delivered_at", "amount", "tracking", "status_interno", "account",
+    )
+    _INTERNATI = frozenset({"status_interno", "account"})
+    _CONVERSIONI = {"destinatario": Address.from_dict}
+
+
+class DashboardItem(MutableMapping):
+    """
+    Riga della dashboard: punta all'ordine in cache invece di copiarlo e aggiunge
+    solo stato e posizione Poste. Le altre chiavi sono lette/scritte sull'ordine.
+    """
+    __slots__ = ("ordine", "dashboard_status", "dashboard_posizione")
+    _PROPRI = ("dashboard_status", "dashboard_posizione")
+
+    def __init__(self, ordine: Mapping, dashboard_status: str, dashboard_posizione: str = ""):
+        self.ordine = ordine
+        self.dashboard_status = sys.intern(dashboard_status)
+        self.dashboard_posizione = sys.intern(dashboard_posizione or "")
+
+    def __getitem__(self, chiave: str) -> Any:
+        if chiave in self._PROPRI:
+            return getattr(self, chiave)
+        return self.ordine[chiave]
+
+    def __setitem__(self, chiave: str, valore: Any) -> None:
+        if chiave in self._PROPRI:
+            setattr(self, chiave, sys.intern(valore) if isinstance(valore, str) else valore)
+        else:
+            self.ordine[chiave] = valore
+
+    def __delitem__(self, chiave: str) -> None:
+        if chiave in self._PROPRI:
+            raise KeyError(chiave)
+        del self.ordine[chiave]
+
+    def __iter__(self) -> Iterator[str]:
+        for chiave in self.ordine:
+            if chiave not in self._PROPRI:
+                yield chiave
+        yield from self._PROPRI
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def to_dict(self) -> dict:
+        dati = come_dict(self.ordine)
+        dati["dashboard_status"] = self.dashboard_status
+        dati["dashboard_posizione"] = self.dashboard_posizione
+        return dati
+
+    def __repr__(self) -> str:
+        return f"DashboardItem({self.to_dict()!r})"
+
+
+def come_dict(valore: Mapping) -> dict:
+    """Copia in dict semplice (anche annidato), pronta per json/csv."""
+    if hasattr(valore, "to_dict"):
+        return valore.to_dict()
+    return {k: come_dict(v) if isinstance(v, Mapping) else v for k, v in valore.items()}
+
+
+def ordini_da_dict(righe: Iterable[Mapping]) -> List[Order]:
+    """Ricostruisce gli Order da righe JSON (snapshot su disco)."""
+    return [Order.from_dict(r) for r in righe]
+
+
+def ordini_a_dict(ordini: Iterable[Mapping]) -> List[dict]:
+    return [come_dict(o) for o in ordini]
+
+
+# Ordine dei gruppi in dashboard (e della numerazione delle righe)
+STATI_DASHBOARD = ("DA SPEDIRE", "⚠️ ERR. RETE", "ETICHETTA CREATA", "IN TRANSITO")
+
+
+def _chiave_data(riga: Mapping) -> str:
+    """"AAAA-MM-GGTHH:MM" dalla data di creazione eBay (created_at, ISO)."""
+    creato = riga.get("created_at")
+    if creato:
+        return creato[:16]
+    # Snapshot salvati prima di created_at: date è "gg/mm HH:MM", senza anno.
+    # Un giorno dopo oggi è dell'anno scorso (ordini di dicembre visti a gennaio).
+    data = riga.get("date") or ""
+    if len(data) < 11 or not (data[:2] + data[3:5]).isdigit():
+        return ""
+    oggi = datetime.now()
+    anno = oggi.year - 1 if (data[3:5], data[0:2]) > (f"{oggi.month:02d}", f"{oggi.day:02d}") else oggi.year
+    return f"{anno}-{data[3:5]}-{data[0:2]}T{data[6:11]}"
+
+
+_ORDINAMENTI = {
+    "data": _chiave_data,
+    "utente": lambda r: (r.get("buyer") or "").lower(),
+    "titolo": lambda r: (r.get("title") or "").lower(),
+}
+
+
+class DashboardIndex:
+    """
+    Righe della dashboard (DashboardItem) con un bucket per stato e indici hash per
+    order_id, tracking e utente. aggiorna() sposta una singola riga tra i bucket:
+    filtri e ordinamenti non ricostruiscono la lista completa.
+    """
+    __slots__ = ("_per_stato", "_per_id", "_per_tracking", "_per_buyer", "_chiavi", "_ordinati")
+
+    def __init__(self, righe: Iterable[Mapping] = ()):
+        self._per_stato: Dict[str, Dict[str, Mapping]] = {stato: {} for stato in STATI_DASHBOARD}
+        self._per_id: Dict[str, Mapping] = {}
+        self._per_tracking: Dict[str, Mapping] = {}
+        self._per_buyer: Dict[str, Dict[str, Mapping]] = {}
+        self._chiavi: Dict[str, tuple] = {}      # order_id -> (stato, tracking, buyer) indicizzati
+        self._ordinati: Dict[tuple, List[Mapping]] = {}  # (stato, ordinamento) -> lista ordinata
+        for riga in righe:
+            self.aggiorna(riga)
+
+    @staticmethod
+    def _chiave_buyer(buyer: Optional[str]) -> str:
+        return (buyer or "").strip().lower()
+
+    def aggiorna(self, riga: Mapping) -> Optional[str]:
+        """Inserisce o reindicizza una riga. Ritorna lo stato precedente (None se nuova)."""
+        order_id = riga["order_id"]
+        stato = riga["dashboard_status"]
+        tracking = riga.get("tracking")
+        if not tracking or tracking == "N.D.":
+            tracking = None
+        buyer = self._chiave_buyer(riga.get("buyer"))
+
+        prima = self._chiavi.get(order_id)
+        stato_prima = None
+        if prima is not None:
+            stato_prima, tracking_prima, buyer_prima = prima
+            if stato_prima != stato:
+                self._per_stato[stato_prima].pop(order_id, None)
+                self._scarta_ordinati(stato_prima)
+            if tracking_prima and tracking_prima != tracking:
+                self._per_tracking.pop(tracking_prima, None)
+            if buyer_prima != buyer:
+                self._togli_buyer(buyer_prima, order_id)
+
+        self._per_id[order_id] = riga
+        self._per_stato.setdefault(stato, {})[order_id] = riga
+        if tracking:
+            self._per_tracking[tracking] = riga
+        self._per_buyer.setdefault(buyer, {})[order_id] = riga
+        self._chiavi[order_id] = (stato, tracking, buyer)
+        self._scarta_ordinati(stato)
+        return stato_prima
+
+    def rimuovi(self, order_id: str) -> Optional[Mapping]:
+        prima = self._chiavi.pop(order_id, None)
+        if prima is None:
+            return None
+        stato, tracking, buyer = prima
+        self._per_stato[stato].pop(order_id, None)
+        self._scarta_ordinati(stato)
+        if tracking:
+            self._per_tracking.pop(tracking, None)
+        self._togli_buyer(buyer, order_id)
+        return self._per_id.pop(order_id)
+
+    def _togli_buyer(self, buyer: str, order_id: str) -> None:
+        bucket = self._per_buyer.get(buyer)
+        if bucket is not None:
+            bucket.pop(order_id, None)
+            if not bucket:
+                del self._per_buyer[buyer]
+
+    def _scarta_ordinati(self, stato: str) -> None:
+        for chiave in [k for k in self._ordinati if k[0] == stato]:
+            del self._ordinati[chiave]
+
+    # --- RICERCHE ---
+
+    def per_id(self, order_id: str) -> Optional[Mapping]:
+        return self._per_id.get(order_id)
+
+    def per_tracking(self, tracking: str) -> Optional[Mapping]:
+        return self._per_tracking.get((tracking or "").strip())
+
+    def per_buyer(self, buyer: str) -> List[Mapping]:
+        return list(self._per_buyer.get(self._chiave_buyer(buyer), {}).values())
+
+    def per_stato(self, stato: str, ordinamento: Optional[str] = None) -> List[Mapping]:
+        bucket = self._per_stato.get(stato)
+        if not bucket:
+            return []
+        if ordinamento not in _ORDINAMENTI:
+            return list(bucket.values())
+        chiave = (stato, ordinamento)
+        ordinati = self._ordinati.get(chiave)
+        if ordinati is None:
+            ordinati = self._ordinati[chiave] = sorted(bucket.values(), key=_ORDINAMENTI[ordinamento])
+        return list(ordinati)
+
+    def conteggi(self) -> Dict[str, int]:
+        return {stato: len(bucket) for stato, bucket in self._per_stato.items() if bucket}
+
+    def lista(self, stati: Optional[Iterable[str]] = None, ordinamento: Optional[str] = None) -> List[Mapping]:
+        """Righe nell'ordine della dashboard (per stato), eventualmente ordinate dentro ogni stato."""
+        righe = []
+        for stato in (stati if stati is not None else self._per_stato):
+            righe.extend(self.per_stato(stato, ordinamento))
+        return righe
+
+    def filtra(self, testo: str, ordinamento: Optional[str] = None) -> List[Mapping]:
+        """
+        Filtro libero della dashboard: nome (o parte) di uno stato ("transito"),
+        tracking, Order ID o utente eBay (esatto, altrimenti per prefisso).
+        """
+        testo = (testo or "").strip()
+        if not testo:
+            return self.lista(ordinamento=ordinamento)
+        cerca = testo.lower()
+        stati = [s for s in self._per_stato
+                 if s.lower().startswith(cerca) or any(p.startswith(cerca) for p in s.lower().split())]
+        if stati:
+            return self.lista(stati, ordinamento)
+        riga = self.per_tracking(testo.upper()) or self.per_id(testo)
+        if riga is not None:
+            return [riga]
+        if cerca in self._per_buyer:
+            righe = list(self._per_buyer[cerca].values())
+        else:
+            righe = [r for buyer, bucket in self._per_buyer.items()
+                     if buyer.startswith(cerca) for r in bucket.values()]
+        # Manteniamo l'ordine della dashboard (per stato)
+        posizione = {stato: i for i, stato in enumerate(self._per_stato)}
+        per_riga = _ORDINAMENTI.get(ordinamento, lambda r: ())
+        righe.sort(key=lambda r: (posizione.get(r["dashboard_status"], len(posizione)), per_riga(r)))
+        return righe
+
+    def __len__(self) -> int:
+        return len(self._per_id)
+
+    def __contains__(self, order_id: str) -> bool:
+        return order_id in self._per_id
+
+    def __iter__(self) -> Iterator[Mapping]:
+        return iter(self.lista())
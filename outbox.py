@@ -0,0 +1,206 @@
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+import config
+import connessione
+import logger
+import memoria
+import metrics
+import profilazione
+import storage
+
+# Tracking da caricare su eBay: resta su disco finché CompleteSale non riesce
+FILE_OUTBOX = "outbox_ebay.json"
+
+STATO_IN_ATTESA = "in_attesa"
+STATO_FALLITO = "fallito"   # Tentativi automatici esauriti: serve un "riprova" dal menu
+
+
+def _ora():
+    return datetime.now().isoformat(timespec="seconds")
+
+def attesa_backoff(tentativi):
+    """Secondi prima del prossimo tentativo: base, 2x base, 4x base... fino al massimo."""
+    secondi = config.OUTBOX_BACKOFF_BASE_SECONDS * (2 ** max(0, tentativi - 1))
+    return min(secondi, config.OUTBOX_BACKOFF_MAX_SECONDS)
+
+
+class OutboxEbay:
+    """
+    Coda persistente dei caricamenti tracking su eBay.
+    accoda() scrive subito su file e sveglia il worker, che invia in background
+    con backoff esponenziale: l'etichetta non aspetta eBay e un crash o un
+    riavvio non perdono nulla (al prossimo avvio si riparte dal file).
+    Il file è la fonte di verità: più processi (postazioni, comandi cli) possono
+    usarlo insieme, ogni modifica è un leggi-modifica-scrivi sotto blocco_file.
+    """
+
+    def __init__(self, percorso=FILE_OUTBOX):
+        self.percorso = percorso
+        self._lock = threading.RLock()
+        self._sveglia = threading.Event()
+        self._voci = None  # Ultima copia letta dal file (solo per il monitor della memoria)
+        self._worker = None
+
+    # --- PERSISTENZA ---
+
+    @profilazione.misurata("disco")
+    def _carica(self):
+        """Voci attuali sul file (anche quelle scritte da un altro processo)."""
+        try:
+            dati = storage.leggi_json(self.percorso, [])
+        except ValueError as e:
+            # Niente riscrittura qui: la prossima modifica mette da parte il file (aggiorna_json)
+            logger.log.errore(f"Outbox eBay illeggibile ({self.percorso}): {e}")
+            dati = []
+        self._voci = dati if isinstance(dati, list) else []
+        return self._voci
+
+    def _modifica(self, modifica):
+        """modifica(voci) cambia la lista letta sotto lock dal file; ritorna il suo risultato."""
+        esito = []
+
+        def _applica(voci):
+            voci = voci if isinstance(voci, list) else []
+            esito.append(modifica(voci))
+            return voci
+
+        with self._lock:
+            self._voci = storage.aggiorna_json(self.percorso, _applica, default=[], indent=2)
+        return esito[0]
+
+    # --- API ---
+
+    def accoda(self, order_id, tracking, account=None):
+        """Aggiunge (o aggiorna, se l'ordine è già in coda) un tracking da caricare."""
+        def _accoda(voci):
+            voce = next((v for v in voci if v["order_id"] == order_id), None)
+            if voce is None:
+                voce = {"id": uuid.uuid4().hex[:12], "order_id": order_id, "creato": _ora()}
+                voci.append(voce)
+            voce.update({
+                "tracking": tracking,
+                "account": account,
+                "stato": STATO_IN_ATTESA,
+                "tentativi": 0,
+                "prossimo_tentativo": _ora(),
+                "ultimo_errore": None,
+            })
+            return voce["id"]
+
+        id_voce = self._modifica(_accoda)
+        metrics.incrementa("outbox_accodati_totale")
+        logger.log.info(f"Outbox eBay: accodato {order_id} -> {tracking}")
+        self._sveglia.set()
+        return id_voce
+
+    def voci(self, stato=None):
+        with self._lock:
+            return [dict(v) for v in self._carica() if stato is None or v["stato"] == stato]
+
+    def conteggi(self):
+        conteggi = {STATO_IN_ATTESA: 0, STATO_FALLITO: 0}
+        for voce in self.voci():
+            conteggi[voce["stato"]] = conteggi.get(voce["stato"], 0) + 1
+        return conteggi
+
+    def riprova_tutti(self):
+        """Rimette in coda subito tutte le voci (anche quelle fallite). Ritorna quante."""
+        def _riprova(voci):
+            for voce in voci:
+                voce["stato"] = STATO_IN_ATTESA
+                voce["tentativi"] = 0
+                voce["prossimo_tentativo"] = _ora()
+            return len(voci)
+
+        rimesse = self._modifica(_riprova)
+        self._sveglia.set()
+        return rimesse
+
+    # --- INVIO ---
+
+    def _da_inviare(self, adesso):
+        with self._lock:
+            return [
+                dict(v) for v in self._carica()
+                if v["stato"] == STATO_IN_ATTESA and datetime.fromisoformat(v["prossimo_tentativo"]) <= adesso
+            ]
+
+    def _registra_esito(self, voce, errore=None):
+        def _registra(voci):
+            attuale = next((v for v in voci if v["id"] == voce["id"]), None)
+            # Riaccodata nel frattempo (anche da un altro processo) con un altro tracking: l'esito non vale più
+            if attuale is None or attuale["tracking"] != voce["tracking"]:
+                return
+            if errore is None:
+                voci.remove(attuale)
+            else:
+                attuale["tentativi"] += 1
+                attuale["ultimo_errore"] = str(errore)[:300]
+                if attuale["tentativi"] >= config.OUTBOX_MAX_TENTATIVI:
+                    attuale["stato"] = STATO_FALLITO
+                else:
+                    prossimo = datetime.now() + timedelta(seconds=attesa_backoff(attuale["tentativi"]))
+                    attuale["prossimo_tentativo"] = prossimo.isoformat(timespec="seconds")
+
+        self._modifica(_registra)
+
+    def svuota(self, invia):
+        """
+        Invia le voci scadute con invia(voce) (solleva in caso di errore).
+        Ritorna (inviate, errori).
+        """
+        inviate = errori = 0
+        for voce in self._da_inviare(datetime.now()):
+            if not connessione.disponibile("ebay"):
+                break  # eBay offline: le voci aspettano senza consumare tentativi
+            try:
+                invia(voce)
+            except Exception as e:
+                errori += 1
+                metrics.incrementa("outbox_errori_totale")
+                logger.log.warning(
+                    f"Outbox eBay: {voce['order_id']} non caricato (tentativo {voce['tentativi'] + 1}): {e}"
+                )
+                self._registra_esito(voce, e)
+            else:
+                inviate += 1
+                metrics.incrementa("outbox_inviati_totale")
+                self._registra_esito(voce)
+        return inviate, errori
+
+    def _secondi_al_prossimo(self):
+        with self._lock:
+            prossimi = [
+                datetime.fromisoformat(v["prossimo_tentativo"])
+                for v in self._carica() if v["stato"] == STATO_IN_ATTESA
+            ]
+        if not prossimi:
+            return None  # Niente da fare: si dorme fino al prossimo accoda()
+        return max(0.0, (min(prossimi) - datetime.now()).total_seconds())
+
+    def avvia_worker(self, invia):
+        """Avvia (una volta) il thread che svuota la coda."""
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return self._worker
+            self._worker = threading.Thread(target=self._ciclo, args=(invia,), name="outbox-ebay", daemon=True)
+            self._worker.start()
+            return self._worker
+
+    def _ciclo(self, invia):
+        while True:
+            try:
+                self.svuota(invia)
+            except Exception as e:
+                logger.log.errore(f"Outbox eBay: errore del worker: {e}")
+            attesa = self._secondi_al_prossimo()
+            if attesa is not None and not connessione.disponibile("ebay"):
+                attesa = max(attesa, connessione.secondi_alla_prova("ebay"))
+            self._sveglia.wait(timeout=attesa)
+            self._sveglia.clear()
+
+
+outbox = OutboxEbay()
+memoria.registra_cache("outbox_ebay", lambda: outbox._voci, lambda: len(outbox._voci))
@@ -0,0 +1,193 @@
+"""
+Profilazione opzionale delle azioni del menu (python main.py --profile, oppure PROFILE_MODE=1).
+
+Per ogni azione (dashboard, lista, etichetta, storici...) misura il tempo totale e
+lo divide in: rete (chiamate HTTP), parse (XML/JSON), disco (storico, snapshot,
+PDF), utente (attesa di input) e calcolo (il resto). Il tempo di rete/disco dei
+thread in background (Poste in parallelo, preriscaldamento, coda eBay) è sommato a
+parte in "background": si sovrappone al tempo dell'azione, non ne fa parte.
+
+Con --profile=cprofile (o "P" dal menu, solo per l'azione successiva) l'azione
+viene anche profilata con cProfile: il file .pstats finisce in logs/.
+All'uscita il riepilogo della sessione viene stampato e salvato in logs/.
+"""
+import atexit
+import builtins
+import functools
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+import logger
+
+CATEGORIE = ("rete", "parse", "disco", "utente")
+
+_attivo = False
+_cprofile_sempre = False
+_cprofile_prossima = False
+_lock = threading.Lock()
+_locale = threading.local()  # Misure annidate (es. disco dentro parse): conta solo la più esterna
+_azione = None                # Azione in corso (una alla volta, dal thread principale)
+_riepilogo = {}               # nome azione -> totali della sessione
+_sessione_chiusa = False
+_input_originale = None
+
+
+class _Azione:
+    def __init__(self, nome):
+        self.nome = nome
+        self.t0 = time.perf_counter()
+        self.tempi = dict.fromkeys(CATEGORIE, 0.0)
+        self.background = dict.fromkeys(CATEGORIE, 0.0)
+        self.profiler = None
+
+
+def attivo():
+    return _attivo
+
+def attiva(modalita="1"):
+    """Accende la profilazione (idempotente). modalita "cprofile" profila ogni azione."""
+    global _attivo, _cprofile_sempre, _input_originale
+    with _lock:
+        _cprofile_sempre = _cprofile_sempre or modalita == "cprofile"
+        if _attivo:
+            return
+        _attivo = True
+        # Tutte le attese di input passano da qui: è il tempo "utente" di ogni azione
+        _input_originale = builtins.input
+        builtins.input = _input_misurato
+    atexit.register(chiudi_sessione)
+    logger.log.info(f"Profilazione attiva (modalità {modalita})")
+
+def _input_misurato(*args, **kwargs):
+    t0 = time.perf_counter()
+    try:
+        return _input_originale(*args, **kwargs)
+    finally:
+        registra("utente", time.perf_counter() - t0)
+
+def profila_prossima_azione():
+    """Arma cProfile per la prossima azione del menu."""
+    global _cprofile_prossima
+    _cprofile_prossima = True
+
+# --- MISURE ---
+
+def registra(categoria, secondi):
+    """Aggiunge secondi alla categoria dell'azione in corso (no-op se nessuna azione è aperta)."""
+    azione = _azione
+    if azione is None or getattr(_locale, "dentro", False):
+        return  # Già coperto dalla misura più esterna (es. rete dentro _classifica_trackings)
+    principale = threading.current_thread() is threading.main_thread()
+    with _lock:
+        (azione.tempi if principale else azione.background)[categoria] += secondi
+
+def misurata(categoria):
+    """Decoratore: il tempo della funzione va nella categoria (se la profilazione è attiva)."""
+    def decoratore(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _azione is None or getattr(_locale, "dentro", False):
+                return func(*args, **kwargs)
+            _locale.dentro = True
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _locale.dentro = False
+                registra(categoria, time.perf_counter() - t0)
+        return wrapper
+    return decoratore
+
+# --- AZIONI ---
+
+def inizia_azione(nome):
+    """Chiude l'azione precedente (se aperta) e inizia a misurare la nuova."""
+    global _azione, _cprofile_prossima
+    if not _attivo:
+        return
+    chiudi_azione()
+    azione = _Azione(nome)
+    if _cprofile_sempre or _cprofile_prossima:
+        import cProfile
+        azione.profiler = cProfile.Profile()
+        azione.profiler.enable()
+        _cprofile_prossima = False
+    _azione = azione
+
+def chiudi_azione():
+    """Chiude l'azione in corso: aggiorna il riepilogo, scrive il log ed eventualmente il .pstats."""
+    global _azione
+    azione = _azione
+    if azione is None:
+        return None
+    _azione = None
+    totale = time.perf_counter() - azione.t0
+    pstats_file = None
+    if azione.profiler is not None:
+        azione.profiler.disable()
+        pstats_file = _salva_pstats(azione)
+
+    misurato = sum(azione.tempi.values())
+    voce = {k: v * 1000 for k, v in azione.tempi.items()}
+    voce["calcolo"] = max(0.0, totale - misurato) * 1000
+    voce["totale"] = totale * 1000
+    with _lock:
+        cumulato = _riepilogo.setdefault(azione.nome, {"conteggio": 0, "max_ms": 0.0, "ms": {}, "background_ms": {}})
+        cumulato["conteggio"] += 1
+        cumulato["max_ms"] = max(cumulato["max_ms"], voce["totale"])
+        for k, v in voce.items():
+            cumulato["ms"][k] = cumulato["ms"].get(k, 0.0) + v
+        for k, v in azione.background.items():
+            cumulato["background_ms"][k] = cumulato["background_ms"].get(k, 0.0) + v * 1000
+
+    dettaglio = " ".join(f"{k}={voce[k]:.0f}ms" for k in (*CATEGORIE, "calcolo"))
+    extra = f" | pstats={pstats_file}" if pstats_file else ""
+    logger.log.info(f"Profilo azione '{azione.nome}': totale={voce['totale']:.0f}ms {dettaglio}{extra}")
+    return voce
+
+def _salva_pstats(azione):
+    try:
+        os.makedirs(logger.CARTELLA_LOG, exist_ok=True)
+        nome = re.sub(r"[^A-Za-z0-9_-]+", "_", azione.nome).strip("_")
+        percorso = os.path.join(
+            logger.CARTELLA_LOG, f"profilo_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{nome}.pstats"
+        )
+        azione.profiler.dump_stats(percorso)
+        return percorso
+    except Exception as e:
+        logger.log.warning(f"Impossibile salvare il profilo cProfile di '{azione.nome}': {e}")
+        return None
+
+# --- RIEPILOGO ---
+
+def riepilogo():
+    """{azione: {"conteggio", "max_ms", "ms": {categoria: totale}, "background_ms": {...}}}"""
+    with _lock:
+        return json.loads(json.dumps(_riepilogo))
+
+def chiudi_sessione():
+    """Chiude l'ultima azione, salva il riepilogo in logs/ e lo ritorna (una volta sola)."""
+    global _sessione_chiusa
+    if not _attivo or _sessione_chiusa:
+        return None
+    _sessione_chiusa = True
+    chiudi_azione()
+    dati = riepilogo()
+    if not dati:
+        return None
+    try:
+        os.makedirs(logger.CARTELLA_LOG, exist_ok=True)
+        percorso = os.path.join(
+            logger.CARTELLA_LOG, f"profilo_sessione_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        )
+        with open(percorso, "w", encoding="utf-8") as f:
+            json.dump(dati, f, indent=2, ensure_ascii=False)
+        logger.log.info(f"Riepilogo profilazione salvato in {percorso}")
+    except Exception as e:
+        logger.log.warning(f"Riepilogo profilazione non salvato: {e}")
+        percorso = None
+    return percorso, dati
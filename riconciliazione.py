@@ -0,0 +1,135 @@
+"""
+Riconciliazione tra ordini eBay, etichette ShipItalia e storico locale.
+
+Le tre fonti vengono indicizzate per tracking e per Order ID (un passaggio
+ciascuna, dict come tabelle hash) e confrontate senza cicli annidati: il tempo
+cresce in modo lineare con ordini, etichette e righe di storico.
+
+Anomalie riportate:
+    etichetta_senza_upload       etichetta creata per un ordine, ma su eBay il tracking non c'è
+    tracking_ebay_senza_storico  ordine eBay con tracking che non compare nello storico locale
+    etichetta_senza_ordine       etichetta ShipItalia senza riga di storico né ordine eBay
+    etichette_doppie             più etichette nello storico per lo stesso ordine
+
+Solo la prima si corregge in automatico (caricando il tracking su eBay): le altre
+chiedono di guardare l'ordine.
+"""
+from datetime import datetime, timedelta
+
+import utils
+
+ETICHETTA_SENZA_UPLOAD = "etichetta_senza_upload"
+TRACKING_EBAY_SENZA_STORICO = "tracking_ebay_senza_storico"
+ETICHETTA_SENZA_ORDINE = "etichetta_senza_ordine"
+ETICHETTE_DOPPIE = "etichette_doppie"
+TIPI = (ETICHETTA_SENZA_UPLOAD, TRACKING_EBAY_SENZA_STORICO, ETICHETTA_SENZA_ORDINE, ETICHETTE_DOPPIE)
+
+
+def _tracking(valore):
+    valore = (valore or "").strip()
+    return valore if valore and valore != "N.D." else None
+
+def _data_spedizione(spedizione):
+    try:
+        return datetime.fromisoformat(spedizione.get("createdAt", "")[:19])
+    except ValueError:
+        return None
+
+def _anomalia(tipo, order_id=None, tracking=None, **dettagli):
+    return {"tipo": tipo, "order_id": order_id, "tracking": tracking, **dettagli}
+
+
+def riconcilia(ordini, spedizioni, storico, giorni=30, in_coda=(), adesso=None):
+    """
+    ordini: ordini eBay degli ultimi giorni (da_spedire + in_viaggio).
+    spedizioni: etichette ShipItalia ({"trackingCode", "createdAt", ...}).
+    storico: righe di storico_spedizioni.json (la più recente per prima).
+    in_coda: coppie (order_id, tracking) già nell'outbox eBay, da non segnalare.
+
+    Ritorna {"anomalie": [...], "conteggi": {tipo: n}, "fonti": {...}, "fuori_periodo": n}.
+    Le righe più vecchie del periodo eBay non sono confrontabili con gli ordini:
+    vengono solo contate in fuori_periodo.
+    """
+    adesso = adesso or datetime.now()
+    inizio = adesso - timedelta(days=giorni)
+    in_coda = set(in_coda)
+
+    # --- Indici (un passaggio per fonte) ---
+    ordini_per_id = {}
+    ordini_per_tracking = {}
+    for ordine in ordini:
+        ordini_per_id[ordine.get("order_id")] = ordine
+        tracking = _tracking(ordine.get("tracking"))
+        if tracking:
+            ordini_per_tracking[tracking] = ordine
+
+    storico_per_tracking = {}
+    etichette_per_ordine = {}  # order_id -> tracking distinti, dal più recente
+    for riga in storico:
+        tracking = _tracking(riga.get("tracking"))
+        if not tracking:
+            continue
+        storico_per_tracking.setdefault(tracking, riga)  # La più recente
+        order_id = riga.get("order_id") or ""
+        if utils.valido_order_id(order_id):
+            trackings = etichette_per_ordine.setdefault(order_id, [])
+            if tracking not in trackings:
+                trackings.append(tracking)
+
+    anomalie = []
+    fuori_periodo = 0
+
+    # --- Storico -> eBay: etichette non caricate e doppie ---
+    for order_id, trackings in etichette_per_ordine.items():
+        ordine = ordini_per_id.get(order_id)
+        if ordine is None:
+            fuori_periodo += 1  # Ordine più vecchio del periodo scaricato (o di un altro account)
+            continue
+        su_ebay = _tracking(ordine.get("tracking"))
+        if len(trackings) > 1:
+            anomalie.append(_anomalia(
+                ETICHETTE_DOPPIE, order_id, trackings[0],
+                etichette=trackings, tracking_ebay=su_ebay, buyer=ordine.get("buyer", ""),
+            ))
+        if su_ebay is None and (order_id, trackings[0]) not in in_coda:
+            anomalie.append(_anomalia(
+                ETICHETTA_SENZA_UPLOAD, order_id, trackings[0],
+                account=ordine.get("account"), buyer=ordine.get("buyer", ""), title=ordine.get("title", ""),
+                creata=storico_per_tracking[trackings[0]].get("data"),
+            ))
+
+    # --- eBay -> storico: tracking caricati senza etichetta registrata qui ---
+    for tracking, ordine in ordini_per_tracking.items():
+        if tracking not in storico_per_tracking:
+            anomalie.append(_anomalia(
+                TRACKING_EBAY_SENZA_STORICO, ordine.get("order_id"), tracking,
+                buyer=ordine.get("buyer", ""), shipped_at=ordine.get("shipped_at"),
+            ))
+
+    # --- ShipItalia -> storico/eBay: etichette orfane ---
+    for spedizione in spedizioni:
+        tracking = _tracking(spedizione.get("trackingCode"))
+        if not tracking or tracking in storico_per_tracking or tracking in ordini_per_tracking:
+            continue
+        creata = _data_spedizione(spedizione)
+        if creata is not None and creata < inizio:
+            fuori_periodo += 1
+            continue
+        anomalie.append(_anomalia(
+            ETICHETTA_SENZA_ORDINE, None, tracking,
+            creata=spedizione.get("createdAt"), stato=spedizione.get("status"),
+        ))
+
+    conteggi = dict.fromkeys(TIPI, 0)
+    for anomalia in anomalie:
+        conteggi[anomalia["tipo"]] += 1
+    return {
+        "anomalie": anomalie,
+        "conteggi": conteggi,
+        "fonti": {"ordini": len(ordini), "spedizioni": len(spedizioni), "storico": len(storico)},
+        "fuori_periodo": fuori_periodo,
+    }
+
+def correggibili(report):
+    """Anomalie che si correggono caricando il tracking su eBay."""
+    return [a for a in report["anomalie"] if a["tipo"] == ETICHETTA_SENZA_UPLOAD]
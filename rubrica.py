@@ -0,0 +1,154 @@
+"""
+Rubrica dei destinatari: chi ha già ricevuto un pacco si ritrova con un tasto.
+
+Le voci vengono dallo storico locale (righe con l'indirizzo completo) e dai
+destinatari degli ordini eBay in cache. Due indirizzi quasi uguali ("MARIO ROSSI,
+V. Roma n. 1" e "Mario Rossi, via Roma 1") hanno la stessa chiave normalizzata
+(nome + CAP + via) e diventano una voce sola, con l'indirizzo più recente.
+
+La ricerca per prefisso usa una lista ordinata di termini (parole del nome,
+telefono, CAP) con bisect: costa log(n) più le voci trovate, non una scansione
+di tutta la rubrica. Più parole = tutte devono trovare un termine.
+"""
+import bisect
+import re
+import unicodedata
+from datetime import datetime
+
+import utils
+
+MAX_RISULTATI = 9
+
+# Abbreviazioni comuni negli indirizzi incollati -> forma estesa (per la chiave)
+_ABBREVIAZIONI = {
+    "v": "via", "vle": "viale", "cso": "corso", "pza": "piazza", "pzza": "piazza",
+    "p": "piazza", "pzle": "piazzale", "lgo": "largo", "str": "strada", "loc": "localita",
+    "n": "", "nr": "", "num": "",
+}
+_CAMPI = ("name", "address", "postalCode", "city", "phone")
+
+
+def normalizza(testo):
+    """Minuscolo, senza accenti né punteggiatura, spazi singoli."""
+    testo = unicodedata.normalize("NFKD", str(testo or ""))
+    testo = "".join(c for c in testo if not unicodedata.combining(c)).lower()
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", testo.replace(".", "")).split())
+
+def _via(indirizzo):
+    parole = [_ABBREVIAZIONI.get(p, p) for p in normalizza(indirizzo).split()]
+    return " ".join(p for p in parole if p)
+
+def chiave(indirizzo):
+    """Chiave di deduplica: nome (parole in ordine sparso) + CAP + via normalizzata."""
+    nome = " ".join(sorted(normalizza(indirizzo.get("name")).split()))
+    return f"{nome}|{(indirizzo.get('postalCode') or '').strip()}|{_via(indirizzo.get('address'))}"
+
+def _termini(indirizzo):
+    termini = set(normalizza(indirizzo.get("name")).split())
+    for campo in ("postalCode", "phone"):
+        valore = "".join(filter(str.isdigit, indirizzo.get(campo) or ""))
+        if valore:
+            termini.add(valore)
+    return termini
+
+def _quando(testo):
+    """Data dello storico ("%d/%m/%Y %H:%M") in forma ordinabile; "" se manca."""
+    try:
+        return datetime.strptime(testo or "", "%d/%m/%Y %H:%M").isoformat(timespec="minutes")
+    except ValueError:
+        return ""
+
+def _valido(indirizzo):
+    return bool(
+        indirizzo and (indirizzo.get("name") or "").strip() not in ("", "N.D.")
+        and (indirizzo.get("address") or "").strip() and (indirizzo.get("postalCode") or "").strip()
+    )
+
+
+class Rubrica:
+    """Destinatari deduplicati, con indice dei prefissi per nome, telefono e CAP."""
+
+    def __init__(self):
+        self._voci = {}      # chiave -> {"indirizzo", "usi", "ultimo"}
+        self._termini = []   # (termine, chiave) ordinati: ricerca per prefisso con bisect
+
+    def __len__(self):
+        return len(self._voci)
+
+    def aggiungi(self, indirizzo, quando=""):
+        """Aggiunge (o unisce a una voce quasi uguale) un destinatario. Ritorna la chiave."""
+        if not _valido(indirizzo):
+            return None
+        nuovo = {campo: (indirizzo.get(campo) or "").strip() for campo in _CAMPI}
+        nuovo["phone"] = utils.normalizza_telefono(nuovo["phone"])
+        k = chiave(nuovo)
+        voce = self._voci.get(k)
+        if voce is None:
+            voce = self._voci[k] = {"indirizzo": nuovo, "usi": 0, "ultimo": ""}
+            self._metti_termini(k, nuovo)
+        elif quando >= voce["ultimo"]:
+            # Vince l'indirizzo più recente, ma un telefono noto non si perde
+            nuovo["phone"] = nuovo["phone"] or voce["indirizzo"]["phone"]
+            self._togli_termini(k, voce["indirizzo"])
+            voce["indirizzo"] = nuovo
+            self._metti_termini(k, nuovo)
+        voce["usi"] += 1
+        voce["ultimo"] = max(voce["ultimo"], quando)
+        return k
+
+    def _metti_termini(self, k, indirizzo):
+        for termine in _termini(indirizzo):
+            bisect.insort(self._termini, (termine, k))
+
+    def _togli_termini(self, k, indirizzo):
+        for termine in _termini(indirizzo):
+            i = bisect.bisect_left(self._termini, (termine, k))
+            if i < len(self._termini) and self._termini[i] == (termine, k):
+                del self._termini[i]
+
+    def _con_prefisso(self, prefisso):
+        trovate = set()
+        i = bisect.bisect_left(self._termini, (prefisso, ""))
+        while i < len(self._termini) and self._termini[i][0].startswith(prefisso):
+            trovate.add(self._termini[i][1])
+            i += 1
+        return trovate
+
+    def cerca(self, testo="", limite=MAX_RISULTATI):
+        """
+        Indirizzi (copie) i cui termini iniziano con ogni parola di testo, i più usati
+        e recenti per primi. Testo vuoto: i destinatari più frequenti.
+        """
+        parole = normalizza(testo).split()
+        # Il telefono si scrive anche a gruppi ("333 123 4567"): le cifre vanno cercate unite
+        if parole and all(p.isdigit() for p in parole):
+            parole = ["".join(parole)]
+        if parole:
+            chiavi = self._con_prefisso(parole[0])
+            for parola in parole[1:]:
+                chiavi &= self._con_prefisso(parola)
+        else:
+            chiavi = self._voci.keys()
+        voci = sorted((self._voci[k] for k in chiavi), key=lambda v: (v["usi"], v["ultimo"]), reverse=True)
+        return [dict(v["indirizzo"]) for v in voci[:limite]]
+
+
+def costruisci(storico, ordini=()):
+    """Rubrica da righe di storico (con "indirizzo") e ordini eBay (con "destinatario")."""
+    rubrica = Rubrica()
+    for ordine in ordini:
+        rubrica.aggiungi(ordine.get("destinatario"))
+    # Dal più vecchio: l'indirizzo più recente di ogni destinatario vince
+    for riga in reversed(storico):
+        indirizzo = riga.get("indirizzo")
+        if isinstance(indirizzo, dict):
+            rubrica.aggiungi(indirizzo, _quando(riga.get("data")))
+    return rubrica
+
+def descrizione(indirizzo):
+    """Una riga per la scelta: nome, via, CAP città e telefono."""
+    telefono = f" ({indirizzo['phone']})" if indirizzo.get("phone") else ""
+    return (
+        f"{indirizzo.get('name', '')} - {indirizzo.get('address', '')}, "
+        f"{indirizzo.get('postalCode', '')} {indirizzo.get('city', '')}{telefono}"
+    )
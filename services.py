@@ -1,7 +1,18 @@
+import threading
+import weakref
 import app_logic
 import config
+import connessione
+import memoria
+import metrics
+import models
+import outbox
+import profilazione
+import riconciliazione
+import rubrica
 import utils
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 
 
 class SpedizioniService:
@@ -11,6 +22,120 @@ class SpedizioniService:
         self.history = history_mod
         self.cache_state = app_logic.CacheState()
         self.ship_cache_state = app_logic.ListCacheState()
+        self._snapshot_tracking_importato = False
+        # Scaricamenti in corso in background (nome -> Future): chi ha bisogno
+        # degli stessi dati aspetta quello invece di lanciare una nuova richiesta.
+        self._lock_in_volo = threading.Lock()
+        self._in_volo = {}
+        # Spedizioni applicate localmente alla cache, in attesa che eBay le confermi
+        # (order_id -> tracking): un riscaricamento non deve "annullarle".
+        self._lock_cache = threading.RLock()
+        self._spedizioni_locali = {}
+        self._timer_riconcilia = None
+        self._limit_spedizioni = 15
+        # Dashboard materializzata: order_id -> ((tracking, ts voce Poste), DashboardItem)
+        self.indice_dashboard = models.DashboardIndex()
+        self._vista_dashboard = {}
+        self._vista_versione = None
+        self._vista_scadenza = datetime.min
+        self._stato_dashboard = None
+        self._stato_dashboard_base = None  # Come letto/scritto l'ultima volta (fusione con le altre postazioni)
+        # Rubrica destinatari: si ricostruisce quando cambiano ordini in cache o storico
+        self._rubrica = None
+        self._rubrica_versione = None
+        # Snapshot ordini di un altro periodo usato da offline: (giorni dello snapshot, giorni richiesti)
+        self._finestra_ordini = None
+        self._registra_cache_memoria()
+
+    def _registra_cache_memoria(self):
+        # Riferimento debole: il monitor della memoria non deve tenere in vita il servizio
+        rif = weakref.ref(self)
+
+        def _attributo(*nomi):
+            servizio = rif()
+            if servizio is None:
+                return None
+            valori = tuple(getattr(servizio, n) for n in nomi)
+            return valori if len(valori) > 1 else valori[0]
+
+        def _conta(oggetto):
+            return len(oggetto) if oggetto is not None else 0
+
+        # memoria misura solo se oggetto() non è None: voci() può contare sul servizio vivo
+        # Gli ordini seguono la finestra di 30 giorni di eBay: solo misura, niente tetto
+        memoria.registra_cache(
+            "ordini_ebay",
+            lambda: getattr(_attributo("cache_state"), "ordini", None),
+            lambda: sum(len(l) for l in app_logic.get_cached_lists(_attributo("cache_state"))),
+        )
+        memoria.registra_cache(
+            "spedizioni_shipitalia",
+            lambda: getattr(_attributo("ship_cache_state"), "items", None),
+            lambda: _conta(_attributo("ship_cache_state").items),
+            riduci=lambda n: rif()._riduci_spedizioni(n) if rif() is not None else 0,
+            limite_mb=memoria.limite_mb("spedizioni_shipitalia", 5),
+        )
+        memoria.registra_cache(
+            "dashboard",
+            lambda: _attributo("indice_dashboard", "_vista_dashboard"),
+            lambda: _conta(_attributo("_vista_dashboard")),
+        )
+        memoria.registra_cache(
+            "rubrica",
+            lambda: _attributo("_rubrica"),
+            lambda: _conta(_attributo("_rubrica")),
+        )
+        memoria.registra_cache(
+            "spedizioni_locali",
+            lambda: _attributo("_spedizioni_locali"),
+            lambda: _conta(_attributo("_spedizioni_locali")),
+        )
+
+    def _riduci_spedizioni(self, n):
+        """Toglie le n spedizioni più vecchie (in coda) dalla lista in cache."""
+        with self._lock_cache:
+            items = self.ship_cache_state.items or []
+            n = min(n, len(items))
+            del items[len(items) - n:]
+            return n
+
+# ------------------------------------
+
+    def _avvia_in_background(self, nome, funzione, *args):
+        """Avvia funzione in background se non c'è già lo stesso scaricamento in corso."""
+        with self._lock_in_volo:
+            futuro = self._in_volo.get(nome)
+            if futuro is not None and not futuro.done():
+                return futuro
+            futuro = utils.esegui_in_background(funzione, *args, nome=f"bg-{nome}")
+            self._in_volo[nome] = futuro
+            return futuro
+
+    # Attese del thread principale su lavoro di rete fatto da altri thread: per la
+    # profilazione sono tempo di rete dell'azione, non calcolo
+    @profilazione.misurata("rete")
+    def _attendi_in_volo(self, nome):
+        """Se lo scaricamento 'nome' è in corso, ne attende la fine (gli errori sono già gestiti)."""
+        with self._lock_in_volo:
+            futuro = self._in_volo.get(nome)
+        if futuro is None:
+            return
+        if not futuro.done():
+            utils.stampa_avanzamento("   ⏳ Attendo i dati già in arrivo...")
+        try:
+            futuro.result()
+        except Exception:
+            pass
+
+    def avvia_preriscaldamento(self, giorni=30, limit_spedizioni=15):
+        """
+        Avvia in parallelo, in background, lo scaricamento di ordini eBay e storico
+        ShipItalia, così le voci di menu trovano i dati già in cache.
+        """
+        if self.cache_state.ordini is None:
+            self._avvia_in_background("ordini", self._riempi_cache_ordini, giorni)
+        if self.ship_cache_state.items is None:
+            self._avvia_in_background("spedizioni", self._riempi_cache_spedizioni, limit_spedizioni)
 
 # ------------------------------------
 
@@ -25,11 +150,94 @@ class SpedizioniService:
 # ------------------------------------
 
     def carica_ordini_cached(self, giorni=30):
+        self._attendi_in_volo("ordini")
         if self.cache_state.ordini is None:
-            da_spedire, in_viaggio = self.ebay.scarica_lista_ordini(giorni)
-            app_logic.set_cache(self.cache_state, da_spedire, in_viaggio)
+            metrics.registra_cache("ordini_ebay", "miss")
+            self._riempi_cache_ordini(giorni)
+        else:
+            metrics.registra_cache("ordini_ebay", "hit")
         return app_logic.get_cached_lists(self.cache_state)
 
+    def _riempi_cache_ordini(self, giorni):
+        if self._carica_snapshot_ordini(giorni):
+            return
+        try:
+            self.sincronizza_ordini(giorni)
+        except Exception:
+            # Errore già segnalato da ebay: meglio lo snapshot vecchio (con la sua data) che niente
+            if not self._carica_snapshot_ordini(giorni, qualsiasi_eta=True):
+                app_logic.set_cache(self.cache_state, [], [])
+
+# ------------------------------------
+
+    def sincronizza_ordini(self, giorni=30):
+        """
+        Scarica sempre da eBay (ignora la cache), aggiorna cache e snapshot su disco.
+        Solleva eccezione se eBay non risponde, così lo snapshot buono non viene sovrascritto.
+        """
+        da_spedire, in_viaggio = self.ebay.scarica_lista_ordini(giorni, solleva_errori=True)
+        with self._lock_cache:
+            app_logic.set_cache(self.cache_state, da_spedire, in_viaggio)
+            self._riapplica_spedizioni_locali()
+            self._finestra_ordini = None
+        self.history.salva_snapshot("ordini", {
+            "giorni": giorni,
+            "da_spedire": models.ordini_a_dict(da_spedire),
+            "in_viaggio": models.ordini_a_dict(in_viaggio),
+        })
+        return da_spedire, in_viaggio
+
+# ------------------------------------
+
+    def _snapshot_valido(self, nome, qualsiasi_eta=False):
+        """qualsiasi_eta: servizio offline, va bene anche uno snapshot scaduto."""
+        dati, ts = self.history.leggi_snapshot(nome)
+        if dati is None:
+            return None, None
+        if not qualsiasi_eta and (datetime.now() - ts).total_seconds() > config.SNAPSHOT_MAX_AGE_SECONDS:
+            return None, None
+        return dati, ts
+
+    def _carica_snapshot_ordini(self, giorni, qualsiasi_eta=False):
+        dati, ts = self._snapshot_valido("ordini", qualsiasi_eta)
+        if not dati or (dati.get("giorni") != giorni and not qualsiasi_eta):
+            metrics.registra_cache("snapshot_ordini", "miss")
+            return False
+        metrics.registra_cache("snapshot_ordini", "hit")
+        app_logic.set_cache(
+            self.cache_state,
+            models.ordini_da_dict(dati.get("da_spedire", [])),
+            models.ordini_da_dict(dati.get("in_viaggio", [])),
+        )
+        # L'orario mostrato nel menu è quello dello scaricamento, non del caricamento
+        self.cache_state.last_update = ts
+        # Etichette fatte dopo lo snapshot (anche da un'altra postazione o prima di un riavvio)
+        with self._lock_cache:
+            self._riapplica_spedizioni_locali()
+            # Solo in offline passa uno snapshot di un altro periodo: va segnalato, non nascosto
+            self._finestra_ordini = None if dati.get("giorni") == giorni else (dati.get("giorni"), giorni)
+        return True
+
+    def _importa_snapshot_tracking(self):
+        if self._snapshot_tracking_importato:
+            return
+        self._snapshot_tracking_importato = True
+        dati, _ts = self.history.leggi_snapshot("tracking")
+        if dati:
+            utils.importa_cache_tracking(dati)
+
+# ------------------------------------
+
+    def aggiorna_tracking(self, giorni=30, salva_stato=True):
+        """
+        Ricalcola la dashboard (interroga Poste dove la cache è scaduta) e salva lo snapshot tracking.
+        salva_stato=False (cron senza operatore): i cambi di stato restano da mostrare
+        alla prossima sessione interattiva, dashboard_state.json non viene toccato.
+        """
+        dashboard, cambiamenti = self.prepara_dashboard_poste(giorni, salva_stato=salva_stato)
+        self.history.salva_snapshot("tracking", utils.esporta_cache_tracking())
+        return dashboard, cambiamenti
+
 # ------------------------------------
 
     def _classifica_tracking_poste(self, tracking):
@@ -62,77 +270,143 @@ class SpedizioniService:
 
 # ------------------------------------
 
-    def prepara_dashboard_poste(self, giorni=30):
+    @profilazione.misurata("rete")
+    def _classifica_trackings(self, trackings):
+        stato_tracking = {}
+        if not trackings:
+            return stato_tracking
+        max_workers = max(1, min(len(trackings), config.TRACKING_MAX_WORKERS))
+        if max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                future_map = {executor.submit(self._classifica_tracking_poste, t): t for t in trackings}
+                for future in as_completed(future_map):
+                    t = future_map[future]
+                    try:
+                        stato_tracking[t] = future.result()
+                    except Exception:
+                        # Fallback estremo in caso di crash nel thread
+                        stato_tracking[t] = ("⚠️ ERR. RETE", "")
+        else:
+            for t in trackings:
+                stato_tracking[t] = self._classifica_tracking_poste(t)
+        return stato_tracking
+
+    def _riga_da_ricalcolare(self, riga, tracking, ts, adesso):
+        if riga is None:
+            return True
+        impronta, item = riga
+        if impronta != (tracking, ts) or item.dashboard_status == "⚠️ ERR. RETE":
+            return True
+        if tracking and tracking != "N.D.":
+            # Voce Poste assente o oltre il TTL: va richiesta di nuovo
+            return ts is None or (adesso - ts).total_seconds() > config.TRACKING_CACHE_TTL_SECONDS
+        return False
+
+    def prepara_dashboard_poste(self, giorni=30, salva_stato=True):
+        """
+        Dashboard come vista materializzata: vengono riclassificati solo gli ordini
+        nuovi o cambiati (tracking diverso, voce Poste aggiornata o scaduta, errore di
+        rete precedente). Se ordini e cache tracking non sono cambiati dall'ultima
+        volta la vista è ritornata così com'è.
+        salva_stato=False: i cambiamenti vengono calcolati ma non registrati come visti.
+        """
+        self._importa_snapshot_tracking()
         da_spedire, in_viaggio = self.carica_ordini_cached(giorni)
-        ordini = da_spedire + in_viaggio
-        trackings = []
-        for ordine in ordini:
+        adesso = datetime.now()
+        if (self.cache_state.versione, utils.versione_cache_tracking()) == self._vista_versione \
+                and adesso < self._vista_scadenza:
+            metrics.registra_cache("dashboard", "hit")
+            return self.indice_dashboard.lista(), []
+        metrics.registra_cache("dashboard", "miss")
+
+        vista = {}
+        sporchi = []
+        for ordine in da_spedire + in_viaggio:
+            order_id = ordine.get("order_id")
             tracking = ordine.get("tracking")
-            if tracking and tracking != "N.D.":
-                trackings.append(tracking)
-
-        stato_tracking = {}
-        if trackings:
-            max_workers = max(1, min(len(set(trackings)), config.TRACKING_MAX_WORKERS))
-            if max_workers > 1:
-                with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                    future_map = {executor.submit(self._classifica_tracking_poste, t): t for t in set(trackings)}
-                    for future in as_completed(future_map):
-                        t = future_map[future]
-                        try:
-                            stato_tracking[t] = future.result()
-                        except Exception:
-                            # Fallback estremo in caso di crash nel thread
-                            stato_tracking[t] = ("⚠️ ERR. RETE", "")
+            riga = self._vista_dashboard.get(order_id)
+            if self._riga_da_ricalcolare(riga, tracking, utils.ts_cache_tracking(tracking), adesso):
+                sporchi.append(ordine)
             else:
-                t = trackings[0]
-                stato_tracking[t] = self._classifica_tracking_poste(t)
-        stato_precedente = self.history.leggi_stato_dashboard()
+                riga[1].ordine = ordine  # Dopo un riscaricamento l'Order può essere un nuovo oggetto
+                vista[order_id] = riga
+
+        stato_tracking = self._classifica_trackings({
+            o.get("tracking") for o in sporchi if o.get("tracking") and o.get("tracking") != "N.D."
+        })
+        if self._stato_dashboard is None:
+            self._stato_dashboard = self.history.leggi_stato_dashboard()
+            self._stato_dashboard_base = dict(self._stato_dashboard)
+        stato_salvato = self._stato_dashboard if salva_stato else dict(self._stato_dashboard)
+        modificato = False
         cambiamenti = []
-        stato_corrente = {}
-        dashboard = []
-        for ordine in ordini:
+        for ordine in sporchi:
             order_id = ordine.get("order_id")
             tracking = ordine.get("tracking")
             if tracking and tracking != "N.D.":
                 stato, posizione = stato_tracking.get(tracking, ("ETICHETTA CREATA", ""))
             else:
                 stato, posizione = self._classifica_tracking_poste(tracking)
-            if order_id:
-                stato_corrente[order_id] = {
-                    "status": stato,
-                    "tracking": tracking,
-                }
-                prev = stato_precedente.get(order_id)
-                prev_status = prev.get("status") if isinstance(prev, dict) else prev
-                if prev_status and prev_status != stato:
-                    cambiamenti.append({
-                        "order_id": order_id,
-                        "buyer": ordine.get("buyer", ""),
-                        "title": ordine.get("title", ""),
-                        "from_status": prev_status,
-                        "to_status": stato,
-                    })
-            item = dict(ordine)
-            item["dashboard_status"] = stato
-            item["dashboard_posizione"] = posizione
-            if stato != "CONSEGNATO":
-                dashboard.append(item)
-        self.history.salva_stato_dashboard(stato_corrente)
-        ordine_stati = ["DA SPEDIRE", "⚠️ ERR. RETE", "ETICHETTA CREATA", "IN TRANSITO"]
-
-# ------------------------------------
-        
-        ordinati = []
-        for stato in ordine_stati:
-            ordinati.extend([item for item in dashboard if item.get("dashboard_status") == stato])
-        return ordinati, cambiamenti
+            # Vista sull'ordine in cache: niente copia per ogni riga
+            item = models.DashboardItem(ordine, stato, posizione)
+            vista[order_id] = ((tracking, utils.ts_cache_tracking(tracking)), item)
+            if stato == "CONSEGNATO":
+                self.indice_dashboard.rimuovi(order_id)
+            else:
+                self.indice_dashboard.aggiorna(item)
+            if not order_id:
+                continue
+            corrente = {"status": stato, "tracking": tracking}
+            prev = stato_salvato.get(order_id)
+            prev_status = prev.get("status") if isinstance(prev, dict) else prev
+            if prev_status and prev_status != stato:
+                cambiamenti.append({
+                    "order_id": order_id,
+                    "buyer": ordine.get("buyer", ""),
+                    "title": ordine.get("title", ""),
+                    "from_status": prev_status,
+                    "to_status": stato,
+                })
+            if prev != corrente:
+                stato_salvato[order_id] = corrente
+                modificato = True
+
+        # Ordini usciti dalla cache (consegnati su eBay, fuori dal periodo)
+        for order_id in set(self._vista_dashboard) - set(vista):
+            self.indice_dashboard.rimuovi(order_id)
+        for order_id in set(stato_salvato) - set(vista):
+            del stato_salvato[order_id]
+            modificato = True
+        if modificato and salva_stato:
+            self.history.salva_stato_dashboard(stato_salvato, base=self._stato_dashboard_base)
+            self._stato_dashboard_base = dict(stato_salvato)
+
+        self._vista_dashboard = vista
+        self._vista_versione = (self.cache_state.versione, utils.versione_cache_tracking())
+        self._vista_scadenza = self._prossima_scadenza_vista(adesso)
+        return self.indice_dashboard.lista(), cambiamenti
+
+    def _prossima_scadenza_vista(self, adesso):
+        """Primo momento in cui una voce Poste della vista scade (subito se c'è un errore di rete)."""
+        scadenza = datetime.max
+        for (tracking, ts), item in self._vista_dashboard.values():
+            if item.dashboard_status == "⚠️ ERR. RETE":
+                return adesso
+            if ts is not None and tracking and tracking != "N.D.":
+                scadenza = min(scadenza, ts + timedelta(seconds=config.TRACKING_CACHE_TTL_SECONDS))
+        return scadenza
 
 # ------------------------------------
 
     def invalida_cache(self):
         app_logic.invalidate_cache(self.cache_state)
 
+# ------------------------------------
+
+    def filtra_dashboard(self, testo="", ordinamento=None):
+        """Righe della dashboard per stato, utente, tracking o Order ID (dall'indice, senza scansioni)."""
+        return self.indice_dashboard.filtra(testo, ordinamento)
+
 # ------------------------------------
 
     def resolve_dashboard(self, ordini, selection_index):
@@ -156,8 +430,36 @@ class SpedizioniService:
 
 # ------------------------------------
 
-    def crea_etichetta(self, payload):
-        return self.ship.genera_etichetta(payload)
+    def crea_etichetta(self, payload, apri_pdf=True):
+        return self.ship.genera_etichetta(payload, apri_pdf=apri_pdf)
+
+    def _spedisci_ordine(self, lavoro):
+        esito = {"ordine": lavoro["ordine"], "tracking": None, "labelUrl": None, "ebay": None, "errore": None}
+        try:
+            result = self.crea_etichetta(lavoro["payload"], apri_pdf=False)
+        except Exception as e:
+            esito["errore"] = str(e)
+            return esito
+        esito["tracking"] = result["trackingCode"]
+        esito["labelUrl"] = result.get("labelUrl")
+        order_id = lavoro["ordine"].get("order_id")
+        if order_id and utils.valido_order_id(order_id):
+            esito["ebay"] = self.aggiorna_tracking_ebay(order_id, esito["tracking"])
+        return esito
+
+    @profilazione.misurata("rete")
+    def spedisci_in_blocco(self, lavori, max_workers=None):
+        """
+        Genera in parallelo le etichette e aggiorna eBay per più ordini.
+        lavori: [{"ordine": ..., "payload": ...}]. Ritorna un esito per lavoro, nello stesso
+        ordine: {"ordine", "tracking", "labelUrl", "ebay" ("coda"/None), "errore"}.
+        Storico e cache vanno aggiornati dal chiamante (un thread solo).
+        """
+        if not lavori:
+            return []
+        max_workers = max(1, min(len(lavori), max_workers or config.SPEDIZIONI_MAX_WORKERS))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self._spedisci_ordine, lavori))
 
 # ------------------------------------
 
@@ -172,11 +474,43 @@ class SpedizioniService:
 # ------------------------------------
 
     def lista_spedizioni_cached(self, limit=15):
+        self._limit_spedizioni = limit
+        self._attendi_in_volo("spedizioni")
         if self.ship_cache_state.items is None:
-            lista = self.ship.get_lista_spedizioni(limit=limit)
-            app_logic.set_list_cache(self.ship_cache_state, lista)
+            metrics.registra_cache("spedizioni_shipitalia", "miss")
+            self._riempi_cache_spedizioni(limit)
+        else:
+            metrics.registra_cache("spedizioni_shipitalia", "hit")
         return app_logic.get_cached_list(self.ship_cache_state)
 
+    def _riempi_cache_spedizioni(self, limit):
+        if self._carica_snapshot_spedizioni(limit):
+            return
+        try:
+            self.sincronizza_spedizioni(limit)
+        except Exception:
+            if not self._carica_snapshot_spedizioni(limit, qualsiasi_eta=True):
+                app_logic.set_list_cache(self.ship_cache_state, [])
+
+# ------------------------------------
+
+    def sincronizza_spedizioni(self, limit=15):
+        """Scarica sempre da ShipItalia, aggiorna cache e snapshot (solleva eccezione se fallisce)."""
+        lista = self.ship.get_lista_spedizioni(limit=limit, solleva_errori=True)
+        app_logic.set_list_cache(self.ship_cache_state, lista)
+        self.history.salva_snapshot("spedizioni", {"limit": limit, "items": lista})
+        return lista
+
+    def _carica_snapshot_spedizioni(self, limit, qualsiasi_eta=False):
+        dati, ts = self._snapshot_valido("spedizioni", qualsiasi_eta)
+        if not dati or (dati.get("limit", 0) < limit and not qualsiasi_eta):
+            metrics.registra_cache("snapshot_spedizioni", "miss")
+            return False
+        metrics.registra_cache("snapshot_spedizioni", "hit")
+        app_logic.set_list_cache(self.ship_cache_state, dati.get("items", [])[:limit])
+        self.ship_cache_state.last_update = ts
+        return True
+
 # ------------------------------------
 
     def invalida_ship_cache(self):
@@ -184,10 +518,203 @@ class SpedizioniService:
 
 # ------------------------------------
 
+    def registra_spedizione(self, order_id, tracking, label_url=None):
+        """
+        Aggiorna le cache dopo un'etichetta senza riscaricare nulla:
+        l'ordine passa da DA SPEDIRE a IN VIAGGIO col nuovo tracking e la spedizione
+        va in testa allo storico ShipItalia. Una verifica con le API parte in background
+        RICONCILIA_DELAY_SECONDS dopo l'ultima spedizione.
+        """
+        adesso = datetime.now()
+        with self._lock_cache:
+            if order_id and utils.valido_order_id(order_id):
+                self._spedizioni_locali[order_id] = tracking
+                app_logic.segna_ordine_spedito(
+                    self.cache_state, order_id, tracking, shipped_at=adesso.strftime("%d/%m %H:%M")
+                )
+                riga = self.indice_dashboard.per_id(order_id)
+                if riga is not None:
+                    riga["dashboard_status"] = "ETICHETTA CREATA"
+                    riga["dashboard_posizione"] = ""
+                    self.indice_dashboard.aggiorna(riga)
+            app_logic.prepend_list_cache(self.ship_cache_state, {
+                "trackingCode": tracking,
+                "labelUrl": label_url,
+                "createdAt": adesso.isoformat(timespec="seconds"),
+                "status": "creata",
+            }, massimo=self._limit_spedizioni)
+        if order_id and utils.valido_order_id(order_id):
+            # Anche sul disco: un riavvio o un'altra postazione non devono rivedere l'ordine DA SPEDIRE
+            self._segna_spedito_snapshot(order_id, tracking, adesso.strftime("%d/%m %H:%M"))
+        self._pianifica_riconciliazione()
+
+    def _segna_spedito_snapshot(self, order_id, tracking, shipped_at):
+        def _segna(dati):
+            stato = app_logic.CacheState(ordini={
+                "da_spedire": dati.get("da_spedire", []),
+                "in_viaggio": dati.get("in_viaggio", []),
+            })
+            app_logic.segna_ordine_spedito(stato, order_id, tracking, shipped_at=shipped_at)
+
+        self.history.aggiorna_snapshot("ordini", _segna)
+
+    def _riapplica_spedizioni_locali(self):
+        """
+        Dopo un riscaricamento o uno snapshot: toglie le spedizioni confermate da eBay,
+        riapplica le altre. Valgono anche i tracking ancora nell'outbox (file condiviso):
+        l'etichetta c'è, eBay non lo sa ancora.
+        """
+        for voce in outbox.outbox.voci():
+            self._spedizioni_locali.setdefault(voce["order_id"], voce["tracking"])
+        _da_spedire, in_viaggio = app_logic.get_cached_lists(self.cache_state)
+        confermati = {o.get("order_id"): o.get("tracking") for o in in_viaggio}
+        for order_id, tracking in list(self._spedizioni_locali.items()):
+            if confermati.get(order_id) == tracking:
+                del self._spedizioni_locali[order_id]
+            elif not app_logic.segna_ordine_spedito(self.cache_state, order_id, tracking):
+                # Uscito dalla finestra degli ordini scaricati: non c'è più nulla da riapplicare
+                del self._spedizioni_locali[order_id]
+
+    def _pianifica_riconciliazione(self):
+        if self._timer_riconcilia is not None:
+            self._timer_riconcilia.cancel()
+        self._timer_riconcilia = threading.Timer(config.RICONCILIA_DELAY_SECONDS, self.riconcilia)
+        self._timer_riconcilia.daemon = True
+        self._timer_riconcilia.start()
+
+    def riconcilia(self, giorni=30):
+        """Riscarica ordini e storico ShipItalia per confermare le modifiche locali."""
+        self._timer_riconcilia = None
+        try:
+            self.sincronizza_ordini(giorni)
+        except Exception as e:
+            utils.stampa_avanzamento(f"⚠️ Verifica ordini non riuscita: {e}")
+        try:
+            self.sincronizza_spedizioni(self._limit_spedizioni)
+        except Exception as e:
+            utils.stampa_avanzamento(f"⚠️ Verifica storico ShipItalia non riuscita: {e}")
+
+# ------------------------------------
+
+    def account_ordine(self, order_id):
+        """Account eBay dell'ordine in cache (None se non trovato: eBay proverà tutti gli account)."""
+        da_spedire, in_viaggio = app_logic.get_cached_lists(self.cache_state)
+        for ordine in da_spedire + in_viaggio:
+            if ordine.get("order_id") == order_id:
+                return ordine.get("account")
+        return None
+
     def aggiorna_tracking_ebay(self, order_id, tracking):
-        self.ebay.gestisci_ordine_ebay(order_id, tracking)
+        """
+        Accoda il tracking nell'outbox eBay (persistente) e ritorna subito "coda":
+        l'invio vero lo fa il worker avviato da avvia_outbox, con retry e backoff.
+        """
+        outbox.outbox.accoda(order_id, tracking, account=self.account_ordine(order_id))
+        return "coda"
+
+    def _invia_voce_outbox(self, voce):
+        self.ebay.carica_tracking(voce["order_id"], voce["tracking"], account=voce.get("account"))
+
+    def avvia_outbox(self):
+        """Avvia il worker che svuota l'outbox eBay (anche le voci rimaste dall'ultima sessione)."""
+        return outbox.outbox.avvia_worker(self._invia_voce_outbox)
+
+    def svuota_outbox(self):
+        """Invio sincrono delle voci scadute; ritorna (inviate, errori)."""
+        return outbox.outbox.svuota(self._invia_voce_outbox)
+
+    def stato_outbox(self):
+        return outbox.outbox.conteggi()
+
+    def stato_menu(self):
+        """Quello che il menu mostra a ogni ridisegno: orario degli ordini, coda eBay, servizi offline."""
+        return {
+            "ordini_aggiornati": self.get_cache_last_update(),
+            "outbox": self.stato_outbox(),
+            "offline": self.stato_offline(),
+        }
+
+    def voci_outbox(self):
+        return outbox.outbox.voci()
+
+    def riprova_outbox(self):
+        return outbox.outbox.riprova_tutti()
 
 # ------------------------------------
 
     def salva_storico(self, **kwargs):
-        return self.history.salva_in_storico(**kwargs)
\ No newline at end of file
+        if kwargs.get("indirizzo") is not None:
+            kwargs["indirizzo"] = models.come_dict(kwargs["indirizzo"])  # Address -> dict per il JSON
+        return self.history.salva_in_storico(**kwargs)
+
+    def cerca_rubrica(self, testo="", limite=rubrica.MAX_RISULTATI):
+        """Destinatari già usati (storico locale e ordini eBay in cache) che iniziano con testo."""
+        with self._lock_cache:
+            versione = (self.cache_state.versione, self.history.versione_storico())
+            if self._rubrica is None or versione != self._rubrica_versione:
+                da_spedire, in_viaggio = app_logic.get_cached_lists(self.cache_state)
+                self._rubrica = rubrica.costruisci(
+                    self.history.leggi_storico_locale(), list(da_spedire) + list(in_viaggio),
+                )
+                self._rubrica_versione = versione
+            return self._rubrica.cerca(testo, limite)
+
+    def verifica_riconciliazione(self, giorni=30, limit=500):
+        """
+        Riscarica ordini eBay ed etichette ShipItalia e li confronta con lo storico locale.
+        Gli ordini non passano dalla cache: il periodo (fino a 90 giorni) non è quello
+        della dashboard e lo snapshot ordini condiviso non va sovrascritto.
+        """
+        da_spedire, in_viaggio = self.ebay.scarica_lista_ordini(giorni, solleva_errori=True)
+        spedizioni = self.ship.get_lista_spedizioni(limit=limit, solleva_errori=True)
+        in_coda = {(v["order_id"], v["tracking"]) for v in outbox.outbox.voci()}
+        return riconciliazione.riconcilia(
+            list(da_spedire) + list(in_viaggio),
+            spedizioni,
+            self.history.leggi_storico_locale(),
+            giorni=giorni,
+            in_coda=in_coda,
+        )
+
+    def correggi_riconciliazione(self, anomalie):
+        """Mette nell'outbox eBay il tracking delle etichette non caricate; ritorna quante."""
+        for anomalia in anomalie:
+            outbox.outbox.accoda(anomalia["order_id"], anomalia["tracking"], account=anomalia.get("account"))
+        return len(anomalie)
+
+    def leggi_storico_locale(self):
+        return self.history.leggi_storico_locale()
+
+    def stato_tracking(self, tracking):
+        """Dati Poste del tracking (dalla cache se ancora validi)."""
+        return utils.get_stato_tracking_poste_cached(tracking)
+
+    def aggiornamento_tracking(self, tracking):
+        """Quando sono stati scaricati i dati Poste del tracking (None se mai)."""
+        return utils.ts_cache_tracking(tracking)
+
+# ------------------------------------
+
+    def stato_offline(self):
+        """
+        Servizi in modalità offline e, per ciascuno, da quando sono i dati mostrati
+        al posto di quelli in tempo reale ({"servizi": [...], "dati": {vista: datetime}}).
+        Con "finestra_ordini" se gli ordini mostrati sono di un periodo diverso da quello chiesto.
+        """
+        servizi = connessione.servizi_offline()
+        dati = {}
+        stato = {"servizi": servizi, "dati": dati}
+        if "ebay" in servizi:
+            dati["ordini"] = self.cache_state.last_update
+            if self._finestra_ordini:
+                stato["finestra_ordini"] = {"giorni": self._finestra_ordini[0], "richiesti": self._finestra_ordini[1]}
+        if "shipitalia" in servizi:
+            dati["spedizioni"] = self.ship_cache_state.last_update
+        if "poste" in servizi:
+            ts = [chiave[1] for chiave, _ in self._vista_dashboard.values() if chiave[1] is not None]
+            dati["tracking"] = min(ts) if ts else None
+        return stato
+
+    def puo_creare_etichette(self):
+        """L'etichetta non si può rimandare (il tracking va sul pacco): serve ShipItalia online."""
+        return connessione.disponibile("shipitalia")
\ No newline at end of file
@@ -1,9 +1,9 @@
 import os
 import re
-import webbrowser
 import copy
 import config
 import logger
+import profilazione
 import utils
 
 def _prepara_payload_sicuro(payload):
@@ -25,13 +25,14 @@ def _prepara_payload_sicuro(payload):
     return p
 
 @logger.traccia
-def get_lista_spedizioni(limit=10):
+def get_lista_spedizioni(limit=10, solleva_errori=False):
     """
     Scarica la lista delle ultime spedizioni.
     Gestisce la struttura {data: {shipments: [...]}} scoperta col test.
+    Con solleva_errori=True un errore HTTP/rete diventa RuntimeError invece di [].
     """
     session = utils.get_robust_session()
-    url = f"https://shipitalia.com/api/shipments?page=1&limit={limit}"
+    url = f"{config.API_URL_SHIPITALIA_SPEDIZIONI}?page=1&limit={limit}"
 
     try:
         response = session.get(
@@ -41,7 +42,9 @@ def get_lista_spedizioni(limit=10):
         )
         
         if response.status_code != 200:
-            print(f"⚠️ Errore HTTP API: {response.status_code}")
+            utils.stampa_avanzamento(f"⚠️ Errore HTTP API: {response.status_code}")
+            if solleva_errori:
+                raise RuntimeError(f"ShipItalia HTTP {response.status_code}")
             return []
 
         json_data = response.json()
@@ -64,41 +67,47 @@ def get_lista_spedizioni(limit=10):
 
     except Exception as e:
         logger.log.errore(f"Errore recupero lista spedizioni: {e}")
+        if solleva_errori:
+            raise
         return []
 
-def scarica_pdf(url_pdf, tracking):
+@profilazione.misurata("disco")
+def _scrivi_pdf(nome_file, contenuto):
+    os.makedirs("etichette", exist_ok=True)
+    with open(nome_file, "wb") as f:
+        f.write(contenuto)
+
+def scarica_pdf(url_pdf, tracking, apri=True):
     session = utils.get_robust_session()
     try:
-        print(f"   ⬇️  Scaricamento etichetta in corso...")
+        utils.stampa_avanzamento(f"   ⬇️  Scaricamento etichetta in corso...")
         response = session.get(url_pdf, timeout=30)
         response.raise_for_status()
         
-        os.makedirs("etichette", exist_ok=True)
-
         # 🔐 Sanitizzazione tracking per nome file
         safe_tracking = re.sub(r"[^A-Za-z0-9_-]", "_", tracking)
 
         nome_file = os.path.join("etichette", f"{safe_tracking}.pdf")
+        _scrivi_pdf(nome_file, response.content)
 
-        with open(nome_file, "wb") as f:
-            f.write(response.content)
-
-            
-        print(f"   💾 PDF Salvato: {nome_file}")
+        utils.stampa_avanzamento(f"   💾 PDF Salvato: {nome_file}")
         logger.log.info(f"PDF salvato in: {nome_file}")
         
-        try:
-            webbrowser.open(os.path.abspath(nome_file))
-        except: pass 
+        if apri:
+            try:
+                import webbrowser  # caricato solo quando serve davvero
+                webbrowser.open(os.path.abspath(nome_file))
+            except: pass 
             
         return nome_file
     except Exception as e:
         logger.log.errore(f"Impossibile scaricare PDF da {url_pdf}: {e}")
-        print(f"⚠️ Impossibile scaricare il PDF: {e}")
+        utils.stampa_avanzamento(f"⚠️ Impossibile scaricare il PDF: {e}")
         return None
 
 @logger.traccia
-def genera_etichetta(payload_originale):
+def genera_etichetta(payload_originale, apri_pdf=True):
+    """Crea l'etichetta e salva il PDF in etichette/ (apri_pdf=False per le spedizioni multiple)."""
     session = utils.get_robust_session()
     
     # 1. Pulizia dati
@@ -123,7 +132,7 @@ def genera_etichetta(payload_originale):
             raise ValueError("L'API non ha restituito un Tracking Code!")
 
         if pdf_url:
-            scarica_pdf(pdf_url, tracking)
+            scarica_pdf(pdf_url, tracking, apri=apri_pdf)
         
         return {
             "trackingCode": tracking,
@@ -134,5 +143,5 @@ def genera_etichetta(payload_originale):
         logger.log.errore(f"Errore API ShipItalia: {e}")
         logger.log.debug(f"Payload fallito: {payload_clean}")
         if hasattr(e, 'response') and e.response is not None:
-            print(f"🔍 Dettagli errore server: {e.response.text}")
+            utils.stampa_avanzamento(f"🔍 Dettagli errore server: {e.response.text}")
         raise RuntimeError("Errore generazione etichetta") from e
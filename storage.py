@@ -0,0 +1,164 @@
+"""
+Scritture su file sicure con più processi (più postazioni sulla stessa cartella).
+
+- scrivi_json: file temporaneo nella stessa cartella + fsync + os.replace, così un
+  crash a metà scrittura lascia il file precedente intatto invece di troncarlo.
+- blocco_file: lock consultivo su <file>.lock (fcntl su Linux/macOS, msvcrt su
+  Windows), condiviso tra processi e tra thread.
+- aggiorna_json: leggi-modifica-scrivi sotto lock, la modifica parte sempre dal
+  contenuto attuale del file (chi aggiunge in parallelo non perde le righe altrui).
+- unisci_dict: fusione a tre vie per chi ha in memoria una copia del file da tempo.
+"""
+import contextlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import logger
+import profilazione
+
+BLOCCO_TIMEOUT_SECONDS = 10
+
+_MANCANTE = object()
+# Stesso processo: flock/msvcrt bastano tra processi, il lock Python evita attese attive tra thread
+_lock_locali = {}
+_lock_locali_guardia = threading.Lock()
+
+
+def _lock_locale(percorso):
+    with _lock_locali_guardia:
+        return _lock_locali.setdefault(os.path.abspath(percorso), threading.Lock())
+
+def _blocca(f):
+    if os.name == "nt":
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+def _sblocca(f):
+    if os.name == "nt":
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+@contextlib.contextmanager
+def blocco_file(percorso, timeout=BLOCCO_TIMEOUT_SECONDS):
+    """Lock esclusivo su percorso (tra processi e thread). RuntimeError se non arriva entro timeout."""
+    locale = _lock_locale(percorso)
+    if not locale.acquire(timeout=timeout):
+        raise RuntimeError(f"File {percorso} occupato da un'altra operazione")
+    try:
+        scadenza = time.monotonic() + timeout
+        with open(percorso + ".lock", "a+b") as f:
+            while True:
+                try:
+                    _blocca(f)
+                    break
+                except OSError:
+                    if time.monotonic() >= scadenza:
+                        raise RuntimeError(f"File {percorso} bloccato da un'altra postazione da oltre {timeout} s") from None
+                    time.sleep(0.05)
+            try:
+                yield
+            finally:
+                _sblocca(f)
+    finally:
+        locale.release()
+
+# --- LETTURA / SCRITTURA ---
+
+def leggi_json(percorso, default=None):
+    """
+    Contenuto JSON del file, oppure default se il file non c'è.
+    Solleva ValueError se il file esiste ma non è JSON valido.
+    """
+    try:
+        with open(percorso, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+def _sincronizza_cartella(cartella):
+    # Rende persistente anche il rename (POSIX); su Windows le cartelle non si aprono
+    if os.name == "nt":
+        return
+    try:
+        fd = os.open(cartella, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+@profilazione.misurata("disco")
+def scrivi_json(percorso, dati, indent=None):
+    """Scrittura atomica: o il file nuovo completo o quello vecchio, mai uno troncato."""
+    cartella = os.path.dirname(os.path.abspath(percorso))
+    os.makedirs(cartella, exist_ok=True)
+    fd, temporaneo = tempfile.mkstemp(prefix=f".{os.path.basename(percorso)}.", suffix=".tmp", dir=cartella)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(dati, f, indent=indent, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporaneo, percorso)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temporaneo)
+        raise
+    _sincronizza_cartella(cartella)
+
+def _metti_da_parte(percorso, errore):
+    """Copia un file illeggibile accanto all'originale prima che venga riscritto."""
+    copia = f"{percorso}.corrotto-{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    with contextlib.suppress(OSError):
+        shutil.copy2(percorso, copia)
+    logger.log.errore(f"{percorso} illeggibile ({errore}): copia salvata in {copia}, riparto da vuoto")
+
+def aggiorna_json(percorso, modifica, default=None, indent=None):
+    """
+    Leggi-modifica-scrivi sotto blocco_file: modifica(contenuto_attuale) ritorna il
+    nuovo contenuto, che viene scritto in modo atomico e ritornato. Un file illeggibile
+    viene copiato a parte (mai sovrascritto in silenzio) e si riparte da default.
+    """
+    with blocco_file(percorso):
+        try:
+            attuale = leggi_json(percorso, default)
+        except ValueError as e:
+            _metti_da_parte(percorso, e)
+            attuale = default
+        nuovo = modifica(attuale)
+        scrivi_json(percorso, nuovo, indent=indent)
+        return nuovo
+
+# --- FUSIONE ---
+
+def unisci_dict(base, nostro, disco):
+    """
+    Fusione a tre vie di dict: base è la copia letta in origine, nostro quella
+    modificata in memoria, disco quella attuale sul file. Valgono le nostre modifiche
+    (chiavi cambiate o tolte rispetto a base); il resto resta come sul disco.
+    """
+    risultato = dict(disco)
+    for chiave in set(base) | set(nostro):
+        valore = nostro.get(chiave, _MANCANTE)
+        if valore == base.get(chiave, _MANCANTE):
+            continue
+        if valore is _MANCANTE:
+            risultato.pop(chiave, None)
+        else:
+            risultato[chiave] = valore
+    return risultato
@@ -0,0 +1,294 @@
+"""
+Server HTTP locale che imita eBay (Trading API XML), ShipItalia e Poste con dati sintetici.
+
+    python stub_server.py --ordini 500 --latenza-poste-ms 300 --errori-poste 0.05
+    API_STUB_URL=http://127.0.0.1:8765 python main.py
+
+Serve per benchmark e prove di carico senza credenziali né chiamate alle API di
+produzione (i token possono essere qualsiasi valore non vuoto). I dati sono
+deterministici (--seed) e lo stato è in memoria: CompleteSale marca l'ordine come
+spedito, generate-label aggiunge una spedizione allo storico.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import escape
+
+NS_EBAY = "urn:ebay:apis:eBLBaseComponents"
+PDF_FINTO = b"%PDF-1.4\n% etichetta stub\n1 0 obj << /Type /Catalog >> endobj\ntrailer << /Root 1 0 R >>\n%%EOF\n"
+
+_CITTA = ["Milano", "Roma", "Napoli", "Torino", "Bologna", "Firenze", "Bari", "Palermo", "Genova", "Verona"]
+_OGGETTI = ["Cover iPhone", "Libro usato", "Scheda madre", "Giacca invernale", "Lego Technic",
+            "Cuffie bluetooth", "Vinile anni 80", "Caricatore USB-C", "Lampada da tavolo", "Tazza vintage"]
+
+
+def _iso(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+class StatoStub:
+    """Dati sintetici e stato mutabile (spedizioni, tracking caricati) condivisi tra i thread."""
+
+    def __init__(self, ordini=50, quota_spediti=0.5, spedizioni=30, latenza_ms=0,
+                 latenza_poste_ms=0, errori_poste=0.0, seed=1):
+        self.latenza_ms = latenza_ms
+        self.latenza_poste_ms = latenza_poste_ms
+        self.errori_poste = errori_poste
+        self._casuale = random.Random(seed)
+        self._lock = threading.Lock()
+        self._contatore_etichette = 0
+        adesso = datetime.now(timezone.utc)
+        self.ordini = [self._crea_ordine(i, adesso, quota_spediti, seed) for i in range(ordini)]
+        self.spedizioni = [self._crea_spedizione(adesso - timedelta(hours=i)) for i in range(spedizioni)]
+
+    def _crea_ordine(self, i, adesso, quota_spediti, seed):
+        rnd = random.Random(seed * 1_000_003 + i)
+        creato = adesso - timedelta(hours=i * 3 + 1)
+        spedito = rnd.random() < quota_spediti
+        return {
+            "order_id": f"{10 + i % 90:02d}-{10000 + i % 90000:05d}-{20000 + (i * 7) % 80000:05d}",
+            "buyer": f"utente_{i:05d}",
+            "creato": creato,
+            "spedito": creato + timedelta(hours=20) if spedito else None,
+            "tracking": f"STB{seed:02d}{i:08d}IT" if spedito else None,
+            "titolo": f"{rnd.choice(_OGGETTI)} #{i}",
+            "importo": f"{rnd.randint(5, 150)}.{rnd.randint(0, 99):02d}",
+            "nome": f"Cliente {i}",
+            "via": f"Via Roma {rnd.randint(1, 200)}",
+            "citta": rnd.choice(_CITTA),
+            "cap": f"{rnd.randint(10, 98)}{rnd.randint(100, 999)}",
+            "telefono": f"+39 3{rnd.randint(10, 99)} {rnd.randint(1000000, 9999999)}",
+        }
+
+    def _crea_spedizione(self, quando, tracking=None):
+        self._contatore_etichette += 1
+        tracking = tracking or f"STL{self._contatore_etichette:010d}"
+        return {
+            "trackingCode": tracking,
+            "createdAt": quando.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            "status": "CREATED",
+            "labelUrl": None,  # Impostato dal server (serve l'indirizzo di ascolto)
+        }
+
+    def nuova_etichetta(self, base_url):
+        with self._lock:
+            spedizione = self._crea_spedizione(datetime.now(timezone.utc))
+            spedizione["labelUrl"] = f"{base_url}/etichette/{spedizione['trackingCode']}.pdf"
+            self.spedizioni.insert(0, spedizione)
+            return dict(spedizione)
+
+    def carica_tracking(self, order_id, tracking):
+        with self._lock:
+            for ordine in self.ordini:
+                if ordine["order_id"] == order_id:
+                    ordine["tracking"] = tracking
+                    ordine["spedito"] = ordine["spedito"] or datetime.now(timezone.utc)
+                    return True
+        return False
+
+    def stato_poste(self, tracking):
+        """Esito deterministico per tracking: senza movimenti, in transito o consegnato."""
+        caso = random.Random(tracking).random()
+        if caso < 0.2:
+            return {"esitoRicerca": "2", "listaMovimenti": []}
+        adesso_ms = int(time.time() * 1000)
+        citta = _CITTA[int(caso * 1000) % len(_CITTA)]
+        movimenti = [
+            {"dataOra": adesso_ms - 86_400_000, "statoLavorazione": "Presa in carico", "luogo": "CENTRO MECCANIZZATO"},
+            {"dataOra": adesso_ms - 3_600_000, "statoLavorazione": "In transito", "luogo": citta.upper()},
+        ]
+        if caso > 0.8:
+            movimenti.append({"dataOra": adesso_ms, "statoLavorazione": "Consegnata", "luogo": citta.upper()})
+        return {"esitoRicerca": "1", "stato": movimenti[-1]["statoLavorazione"], "listaMovimenti": movimenti}
+
+
+# --- RISPOSTE EBAY ---
+
+def _xml_indirizzo(tag, o):
+    return (
+        f"<{tag}><Name>{escape(o['nome'])}</Name><Street1>{escape(o['via'])}</Street1><Street2></Street2>"
+        f"<CityName>{o['citta']}</CityName><PostalCode>{o['cap']}</PostalCode><Phone>{o['telefono']}</Phone></{tag}>"
+    )
+
+def _xml_ordine(o):
+    spedizione = ""
+    if o["spedito"]:
+        spedizione = (
+            f"<ShippedTime>{_iso(o['spedito'])}</ShippedTime>"
+            "<ShippingDetails><ShipmentTrackingDetails>"
+            f"<ShipmentTrackingNumber>{o['tracking']}</ShipmentTrackingNumber>"
+            "<ShippingCarrierUsed>Poste Italiane</ShippingCarrierUsed>"
+            "</ShipmentTrackingDetails></ShippingDetails>"
+        )
+    return (
+        f"<Order><OrderID>{o['order_id']}</OrderID><OrderStatus>Completed</OrderStatus>"
+        f"<AmountPaid currencyID=\"EUR\">{o['importo']}</AmountPaid>"
+        f"<CreatedTime>{_iso(o['creato'])}</CreatedTime><PaidTime>{_iso(o['creato'] + timedelta(minutes=5))}</PaidTime>"
+        f"{spedizione}<BuyerUserID>{o['buyer']}</BuyerUserID>{_xml_indirizzo('ShippingAddress', o)}"
+        f"<TransactionArray><Transaction><Item><Title>{escape(o['titolo'])}</Title></Item></Transaction></TransactionArray>"
+        "</Order>"
+    )
+
+def _xml_risposta(chiamata, corpo, ack="Success"):
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?>\n<{chiamata}Response xmlns="{NS_EBAY}">'
+        f"<Timestamp>{_iso(datetime.now(timezone.utc))}</Timestamp><Ack>{ack}</Ack>{corpo}</{chiamata}Response>"
+    )
+
+def _tag(testo, nome, default=""):
+    m = re.search(rf"<{nome}>([^<]*)</{nome}>", testo)
+    return m.group(1).strip() if m else default
+
+def risposta_ebay(stato, chiamata, richiesta):
+    if chiamata == "GetOrders":
+        per_pagina = int(_tag(richiesta, "EntriesPerPage", "100"))
+        pagina = int(_tag(richiesta, "PageNumber", "1"))
+        inizio = (pagina - 1) * per_pagina
+        with stato._lock:
+            blocco = [_xml_ordine(o) for o in stato.ordini[inizio:inizio + per_pagina]]
+            altre = inizio + per_pagina < len(stato.ordini)
+        return _xml_risposta("GetOrders", (
+            f"<PaginationResult><TotalNumberOfEntries>{len(stato.ordini)}</TotalNumberOfEntries></PaginationResult>"
+            f"<HasMoreOrders>{'true' if altre else 'false'}</HasMoreOrders>"
+            f"<OrderArray>{''.join(blocco)}</OrderArray>"
+        ))
+    if chiamata == "CompleteSale":
+        if stato.carica_tracking(_tag(richiesta, "OrderID"), _tag(richiesta, "ShipmentTrackingNumber")):
+            return _xml_risposta("CompleteSale", "")
+        return _xml_risposta("CompleteSale", (
+            "<Errors><ShortMessage>Ordine non trovato</ShortMessage>"
+            "<LongMessage>OrderID sconosciuto allo stub.</LongMessage><SeverityCode>Error</SeverityCode></Errors>"
+        ), ack="Failure")
+    if chiamata == "GetUser":
+        venditore = {"nome": "Venditore Stub", "via": "Via Garibaldi 1", "citta": "Milano",
+                     "cap": "20121", "telefono": "+39 333 1234567"}
+        return _xml_risposta("GetUser", f"<User><UserID>venditore_stub</UserID>{_xml_indirizzo('RegistrationAddress', venditore)}</User>")
+    if chiamata == "GetTokenStatus":
+        scadenza = datetime.now(timezone.utc) + timedelta(days=200)
+        return _xml_risposta("GetTokenStatus", f"<TokenStatus><Status>Active</Status><ExpirationTime>{_iso(scadenza)}</ExpirationTime></TokenStatus>")
+    return _xml_risposta(chiamata, f"<Errors><LongMessage>Chiamata {escape(chiamata)} non simulata.</LongMessage></Errors>", ack="Failure")
+
+
+# --- SERVER ---
+
+class _Gestore(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, come le API vere
+    server_version = "StubSpedizioni/1.0"
+
+    @property
+    def stato(self):
+        return self.server.stato
+
+    def log_message(self, formato, *args):
+        if self.server.verboso:
+            super().log_message(formato, *args)
+
+    def _rispondi(self, status, corpo, tipo="application/json"):
+        if isinstance(corpo, (dict, list)):
+            corpo = json.dumps(corpo, ensure_ascii=False)
+        if isinstance(corpo, str):
+            corpo = corpo.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def _attendi(self, ms):
+        if ms:
+            time.sleep(ms / 1000)
+
+    def _corpo(self):
+        lunghezza = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(lunghezza).decode("utf-8", errors="replace") if lunghezza else ""
+
+    def do_GET(self):
+        parti = urlsplit(self.path)
+        self._attendi(self.stato.latenza_ms)
+        if parti.path == "/api/shipments":
+            limite = int(parse_qs(parti.query).get("limit", ["15"])[0])
+            with self.stato._lock:
+                spedizioni = [dict(s) for s in self.stato.spedizioni[:limite]]
+            return self._rispondi(200, {"data": {"shipments": spedizioni, "pagination": {"page": 1, "limit": limite}}})
+        if parti.path.startswith("/etichette/"):
+            return self._rispondi(200, PDF_FINTO, tipo="application/pdf")
+        self._rispondi(404, {"error": f"percorso sconosciuto: {parti.path}"})
+
+    def do_POST(self):
+        parti = urlsplit(self.path)
+        corpo = self._corpo()
+        if parti.path.endswith("/ws/api.dll"):
+            self._attendi(self.stato.latenza_ms)
+            chiamata = self.headers.get("X-EBAY-API-CALL-NAME", "")
+            return self._rispondi(200, risposta_ebay(self.stato, chiamata, corpo), tipo="text/xml")
+        if parti.path == "/api/generate-label":
+            self._attendi(self.stato.latenza_ms)
+            if not self.headers.get("x-api-key"):
+                return self._rispondi(401, {"error": "x-api-key mancante"})
+            return self._rispondi(200, {"data": self.stato.nuova_etichetta(self.server.base_url)})
+        if parti.path.endswith("/ricercasemplice"):
+            self._attendi(self.stato.latenza_poste_ms)
+            if self.stato.errori_poste and self.stato._casuale.random() < self.stato.errori_poste:
+                return self._rispondi(503, {"errore": "servizio non disponibile (stub)"})
+            try:
+                tracking = json.loads(corpo or "{}").get("codiceSpedizione", "")
+            except ValueError:
+                return self._rispondi(400, {"errore": "JSON non valido"})
+            return self._rispondi(200, self.stato.stato_poste(tracking))
+        self._rispondi(404, {"error": f"percorso sconosciuto: {parti.path}"})
+
+
+def crea_server(host="127.0.0.1", porta=8765, verboso=False, **opzioni):
+    """Server pronto (non avviato); porta=0 sceglie una porta libera. opzioni: vedi StatoStub."""
+    server = ThreadingHTTPServer((host, porta), _Gestore)
+    server.daemon_threads = True
+    server.stato = StatoStub(**opzioni)
+    server.verboso = verboso
+    server.base_url = f"http://{host}:{server.server_address[1]}"
+    return server
+
+def avvia_in_background(**opzioni):
+    """Avvia lo stub in un thread daemon e ritorna il server (server.base_url per API_STUB_URL)."""
+    server = crea_server(**opzioni)
+    threading.Thread(target=server.serve_forever, name="stub-server", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stub locale delle API eBay, ShipItalia e Poste.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8765)
+    parser.add_argument("--ordini", type=int, default=50, help="Ordini restituiti da GetOrders.")
+    parser.add_argument("--quota-spediti", type=float, default=0.5, help="Frazione di ordini già spediti (0-1).")
+    parser.add_argument("--spedizioni", type=int, default=30, help="Spedizioni nello storico ShipItalia.")
+    parser.add_argument("--latenza-ms", type=int, default=0, help="Latenza di eBay e ShipItalia.")
+    parser.add_argument("--latenza-poste-ms", type=int, default=0)
+    parser.add_argument("--errori-poste", type=float, default=0.0, help="Frazione di risposte Poste HTTP 503 (0-1).")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verboso", action="store_true", help="Stampa ogni richiesta.")
+    args = parser.parse_args(argv)
+
+    server = crea_server(
+        host=args.host, porta=args.porta, verboso=args.verboso,
+        ordini=args.ordini, quota_spediti=args.quota_spediti, spedizioni=args.spedizioni,
+        latenza_ms=args.latenza_ms, latenza_poste_ms=args.latenza_poste_ms,
+        errori_poste=args.errori_poste, seed=args.seed,
+    )
+    print(f"Stub API in ascolto su {server.base_url} ({args.ordini} ordini)")
+    print(f"Avvia il programma con API_STUB_URL={server.base_url}  (CTRL+C per fermare)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import os
 import sys
+import connessione
 import utils
 
 # ------------------------------------
@@ -22,6 +23,8 @@ def stampa_menu_principale():
     print("3) ⚡ Etichetta rapida")
     print("4) 📚 Storico ShipItalia (PDF e API)")
     print("5) 🗂️  Storico Locale (Dettagliato)")
+    print("6) 📊 Statistiche (API e Cache)")
+    print("7) 📮 Coda eBay (tracking da caricare)")
     print("0) ❌ Esci")
 
 # ------------------------------------
@@ -55,6 +58,9 @@ def stampa_dashboard_ebay(ordini, cambiamenti=None):
     w_stato = 18
     w_pos = 18
     w_titolo = 40
+    w_account = 10
+    # Colonna ACCOUNT solo se la dashboard unisce ordini di più account eBay
+    multi_account = len({o.get('account') for o in ordini}) > 1
 
     def _trunca(val, max_len):
         s = str(val) if val is not None else ""
@@ -62,8 +68,9 @@ def stampa_dashboard_ebay(ordini, cambiamenti=None):
             return s[: max_len - 2] + ".."
         return s
 
+    col_account = f"{'ACCOUNT':<{w_account}} | " if multi_account else ""
     header = (
-        f" {'#':<{w_idx}} | {'DATA':<{w_data}} | {'UTENTE':<{w_utente}} | "
+        f" {'#':<{w_idx}} | {'DATA':<{w_data}} | {col_account}{'UTENTE':<{w_utente}} | "
         f"{'STATO':<{w_stato}} | {'POSIZIONE':<{w_pos}} | {'TITOLO':<{w_titolo}}"
     )
     print("\n" + "=" * width)
@@ -71,12 +78,14 @@ def stampa_dashboard_ebay(ordini, cambiamenti=None):
 
     label_stato = {
         'DA SPEDIRE': '📦 DA SPEDIRE',
+        '⚠️ ERR. RETE': '⚠️  ERRORE DI RETE (Poste)',
         'ETICHETTA CREATA': '🏷️  ETICHETTA CREATA',
         'IN TRANSITO': '🚚 IN TRANSITO',
         'CONSEGNATO': '✅ CONSEGNATO',
     }
     label_tabella = {
         'DA SPEDIRE': '📦 DA SPEDIRE',
+        '⚠️ ERR. RETE': '⚠️  ERR. RETE',
         'ETICHETTA CREATA': '🏷️  ETICHETTA',
         'IN TRANSITO': '🚚 IN TRANSITO',
         'CONSEGNATO': '✅ CONSEGNATO',
@@ -94,13 +103,15 @@ def stampa_dashboard_ebay(ordini, cambiamenti=None):
             else:
                 print(f"-> aggiornamento: {titolo_riga} passato da {da} a {a}")
 
+    # Stesso ordine della lista ricevuta: la numerazione deve coincidere con le selezioni
     gruppi = {'DA SPEDIRE': [], 'ETICHETTA CREATA': [], 'IN TRANSITO': []}
     for ordine in ordini:
         stato = ordine.get('dashboard_status', '')
         gruppi.setdefault(stato, []).append(ordine)
+    sequenza = list(dict.fromkeys([o.get('dashboard_status', '') for o in ordini] + list(gruppi)))
 
     idx = 1
-    for stato in ('DA SPEDIRE', 'ETICHETTA CREATA', 'IN TRANSITO'):
+    for stato in sequenza:
         lista = gruppi.get(stato, [])
         cambiamenti_stato = [c for c in cambiamenti if c.get('to_status') == stato]
         if not lista and not cambiamenti_stato:
@@ -118,8 +129,9 @@ def stampa_dashboard_ebay(ordini, cambiamenti=None):
             posizione = _trunca(o.get('dashboard_posizione', ''), w_pos)
             titolo = _trunca(o.get('title', ''), w_titolo)
             stato_cell = label_tabella.get(stato, stato)
+            account = f"{_trunca(o.get('account', ''), w_account):<{w_account}} | " if multi_account else ""
             print(
-                f" {idx:<{w_idx}} | {data:<{w_data}} | {utente:<{w_utente}} | "
+                f" {idx:<{w_idx}} | {data:<{w_data}} | {account}{utente:<{w_utente}} | "
                 f"{stato_cell:<{w_stato}} | {posizione:<{w_pos}} | {titolo:<{w_titolo}}"
             )
             idx += 1
@@ -134,6 +146,140 @@ def stampa_dashboard_ebay(ordini, cambiamenti=None):
 
 # ------------------------------------
 
+ORDINAMENTI_DASHBOARD = (None, "data", "utente", "titolo")
+
+def stampa_comandi_dashboard(filtro="", ordinamento=None, righe=0, totale=0):
+    stato = []
+    if filtro:
+        stato.append(f"filtro '{filtro}': {righe} di {totale}")
+    if ordinamento:
+        stato.append(f"ordinati per {ordinamento}")
+    if stato:
+        print(f"🔎 {' | '.join(stato)}")
+    print("Comandi: F) Filtra (stato, utente, tracking, Order ID)  O) Ordina  X) Togli filtro  1-5,8) Spedizione multipla")
+
+def chiedi_filtro_dashboard():
+    return input("Filtro (es. 'transito', 'da spedire', utente eBay, tracking): ").strip()
+
+# ------------------------------------
+
+def stampa_lista_selezione_ebay(da_spedire):
+    width = 100
+    print("\n" + "=" * width)
+    print(f" {'#':<3} | {'DATA':<11} | {'UTENTE':<15} | {'CITTÀ':<18} | {'TITOLO'}")
+    print("=" * width)
+    for i, ordine in enumerate(da_spedire, 1):
+        dest = ordine.get('destinatario') or {}
+        print(
+            f" {i:<3} | {str(ordine.get('date', ''))[:11]:<11} | {str(ordine.get('buyer', ''))[:15]:<15} | "
+            f"{str(dest.get('city', ''))[:18]:<18} | {str(ordine.get('title', ''))[:40]}"
+        )
+    print("-" * width)
+    print("Più ordini insieme: es. 1-5,8 (spedizione multipla)")
+
+# ------------------------------------
+
+def stampa_riepilogo_multiplo(lavori, mittenti_usati, sconto):
+    width = 100
+    print("\n" + "=" * width)
+    print(f"📦 SPEDIZIONE MULTIPLA: {len(lavori)} ordini")
+    for nome, indirizzo in mittenti_usati.items():
+        print(f"   Mittente{f' [{nome}]' if nome else ''}: {indirizzo.get('name', 'N.D.')} - "
+              f"{indirizzo.get('postalCode', '')} {indirizzo.get('city', '')}")
+    print(f"   Codice sconto: {sconto or 'nessuno'}")
+    print("=" * width)
+    print(f" {'#':<3} | {'UTENTE':<15} | {'DESTINATARIO':<22} | {'CITTÀ':<18} | {'PESO':>6} | {'TITOLO'}")
+    print("-" * width)
+    for i, lavoro in enumerate(lavori, 1):
+        ordine, payload = lavoro["ordine"], lavoro["payload"]
+        dest = payload["recipient"]
+        print(
+            f" {i:<3} | {str(ordine.get('buyer', ''))[:15]:<15} | {str(dest.get('name', ''))[:22]:<22} | "
+            f"{str(dest.get('city', ''))[:18]:<18} | {payload['weight']:>6} | {str(ordine.get('title', ''))[:25]}"
+        )
+    print("=" * width)
+
+def stampa_esito_multiplo(esiti):
+    width = 100
+    ok = sum(1 for e in esiti if e["tracking"])
+    print("\n" + "=" * width)
+    print(f"✅ Etichette create: {ok}/{len(esiti)}")
+    print("=" * width)
+    print(f" {'#':<3} | {'UTENTE':<15} | {'TRACKING':<16} | {'EBAY':<10} | {'NOTE'}")
+    print("-" * width)
+    stato_ebay = {True: "✅ ok", False: "⚠️ errore", "coda": "📮 in coda", None: "-"}
+    for i, esito in enumerate(esiti, 1):
+        ordine = esito["ordine"]
+        tracking = esito["tracking"] or "❌ NESSUNO"
+        nota = esito["errore"] or ""
+        print(
+            f" {i:<3} | {str(ordine.get('buyer', ''))[:15]:<15} | {tracking:<16} | "
+            f"{stato_ebay.get(esito['ebay'], '-'):<10} | {nota[:45]}"
+        )
+    print("=" * width)
+
+# ------------------------------------
+
+def stampa_outbox_ebay(voci):
+    width = 100
+    print("\n" + "=" * width)
+    print(f"📮 CODA EBAY: {len(voci)} tracking da caricare")
+    print("=" * width)
+    if not voci:
+        print(" Nessun tracking in attesa: eBay è allineato.")
+        print("=" * width)
+        return
+    print(f" {'ORDINE':<16} | {'TRACKING':<16} | {'STATO':<12} | {'TENT.':>5} | {'PROSSIMO':<16} | {'ULTIMO ERRORE'}")
+    print("-" * width)
+    for voce in voci:
+        stato = "❌ fallito" if voce["stato"] == "fallito" else "⏳ attesa"
+        prossimo = voce["prossimo_tentativo"][:16].replace("T", " ") if voce["stato"] != "fallito" else "-"
+        errore = (voce.get("ultimo_errore") or "")[:30]
+        print(
+            f" {voce['order_id'][:16]:<16} | {voce['tracking'][:16]:<16} | {stato:<12} | "
+            f"{voce['tentativi']:>5} | {prossimo:<16} | {errore}"
+        )
+    print("=" * width)
+    print("R) Riprova ora tutti  |  0) Menu")
+
+def stampa_avviso_outbox(conteggi):
+    falliti = conteggi.get("fallito", 0)
+    if falliti:
+        print(f"⚠️  {falliti} tracking non caricati su eBay dopo tutti i tentativi: vedi opzione 7.")
+
+# ------------------------------------
+
+_VISTE_OFFLINE = {"ordini": "ordini eBay", "spedizioni": "storico ShipItalia", "tracking": "stati Poste"}
+
+def eta_dati(ts):
+    """'12 min fa', '3 h fa', '2 gg fa' (None: mai scaricati)."""
+    if ts is None:
+        return "mai scaricati"
+    minuti = max(0, int((utils.datetime.now() - ts).total_seconds() // 60))
+    if minuti < 60:
+        return f"{minuti} min fa"
+    if minuti < 24 * 60:
+        return f"{minuti // 60} h fa"
+    return f"{minuti // (24 * 60)} gg fa"
+
+def stampa_avviso_offline(stato):
+    if not stato["servizi"]:
+        return
+    nomi = ", ".join(connessione.NOMI[s] for s in stato["servizi"])
+    verbo = "non raggiungibile" if len(stato["servizi"]) == 1 else "non raggiungibili"
+    print(f"📴 OFFLINE: {nomi} {verbo}, si usano gli ultimi dati salvati.")
+    for vista, ts in stato["dati"].items():
+        quando = f" ({ts.strftime('%d/%m %H:%M')})" if ts else ""
+        print(f"   {_VISTE_OFFLINE.get(vista, vista)}: {eta_dati(ts)}{quando}")
+    finestra = stato.get("finestra_ordini")
+    if finestra:
+        print(
+            f"   ⚠️  ordini eBay degli ultimi {finestra['giorni']} giorni "
+            f"(non {finestra['richiesti']}): la lista può avere ordini in più o in meno."
+        )
+
+# ------------------------------------
+
 def stampa_storico_api(lista):
     print("\n" + "=" * 75)
     print(f" {'#':<3} | {'TRACKING':<15} | {'DATA':<16} | {'STATO':<12} | {'PDF'}")
@@ -174,6 +320,112 @@ def stampa_storico_locale(storico):
 
 # ------------------------------------
 
+def stampa_avviso_token(avviso):
+    print("\n" + "!" * 60)
+    print(avviso)
+    print("!" * 60)
+
+# ------------------------------------
+
+def stampa_profilo_avvio(fasi, totale_ms):
+    print("\n⏱️  PROFILO AVVIO")
+    for fase, ms in fasi:
+        print(f"   {fase:<20} {ms:>8.1f} ms")
+    print(f"   {'TOTALE':<20} {totale_ms:>8.1f} ms")
+
+# ------------------------------------
+
+def stampa_riepilogo_profilazione(percorso, riepilogo):
+    width = 100
+    colonne = ("rete", "parse", "disco", "utente", "calcolo")
+    print("\n" + "=" * width)
+    print("⏱️  PROFILAZIONE SESSIONE (ms totali per azione)")
+    print("=" * width)
+    print(f" {'AZIONE':<20} | {'N':>3} | {'TOTALE':>8} | {'MAX':>8} | " + " | ".join(f"{c.upper():>7}" for c in colonne))
+    print("-" * width)
+    for nome, dati in sorted(riepilogo.items(), key=lambda x: -x[1]["ms"].get("totale", 0)):
+        ms = dati["ms"]
+        print(
+            f" {nome[:20]:<20} | {dati['conteggio']:>3} | {ms.get('totale', 0):>8.0f} | {dati['max_ms']:>8.0f} | "
+            + " | ".join(f"{ms.get(c, 0):>7.0f}" for c in colonne)
+        )
+    print("=" * width)
+    if percorso:
+        print(f"💾 Riepilogo salvato in {percorso}")
+
+# ------------------------------------
+
+def stampa_statistiche(http, cache, funzioni, avvio=None):
+    width = 90
+    print("\n" + "=" * width)
+    titolo = "📊 STATISTICHE SESSIONE"
+    if avvio:
+        titolo += f" (dal {avvio.strftime('%d/%m %H:%M:%S')})"
+    print(titolo)
+
+    print("=" * width)
+    print(f" {'ENDPOINT':<28} | {'CHIAMATE':>8} | {'ERRORI':>6} | {'RETRY':>5} | {'MEDIA ms':>9} | {'P95 ms':>8}")
+    print("-" * width)
+    if not http:
+        print(" Nessuna chiamata API registrata.")
+    for r in http:
+        print(
+            f" {r['endpoint'][:28]:<28} | {r['chiamate']:>8} | {r['fallimenti']:>6} | {r['retry']:>5} | "
+            f"{r['media_ms']:>9.0f} | {r['p95_ms']:>8.0f}"
+        )
+
+    print("=" * width)
+    print(f" {'CACHE':<28} | {'HIT':>8} | {'MISS':>6} | {'STALE':>5} | {'HIT RATE':>9}")
+    print("-" * width)
+    if not cache:
+        print(" Nessun accesso alle cache registrato.")
+    for r in cache:
+        print(
+            f" {r['cache'][:28]:<28} | {r['hit']:>8} | {r['miss']:>6} | {r['stale']:>5} | "
+            f"{r['hit_rate'] * 100:>8.0f}%"
+        )
+
+    print("=" * width)
+    print(f" {'FUNZIONE':<28} | {'CHIAMATE':>8} | {'TOTALE ms':>10} | {'MEDIA ms':>9}")
+    print("-" * width)
+    if not funzioni:
+        print(" Nessuna funzione tracciata.")
+    for r in funzioni:
+        print(f" {r['funzione'][:28]:<28} | {r['chiamate']:>8} | {r['totale_ms']:>10.0f} | {r['media_ms']:>9.0f}")
+    print("=" * width)
+
+# ------------------------------------
+
+def stampa_memoria(cache, processo, appena_avviato, top, differenze):
+    width = 90
+    print("\n" + "=" * width)
+    titolo = "🧠 MEMORIA CACHE"
+    if processo:
+        titolo += f" (picco processo {processo / 1024 / 1024:.0f} MB)"
+    print(titolo)
+    print("=" * width)
+    print(f" {'CACHE':<28} | {'VOCI':>8} | {'KB':>10} | {'TETTO KB':>9}")
+    print("-" * width)
+    for r in cache:
+        tetto = f"{r['limite_byte'] / 1024:>9.0f}" if r["limite_byte"] else f"{'-':>9}"
+        print(f" {r['nome'][:28]:<28} | {r['voci']:>8} | {r['byte'] / 1024:>10.0f} | {tetto}")
+
+    print("=" * width)
+    print(" ALLOCAZIONI PRINCIPALI (tracemalloc)")
+    print("-" * width)
+    if appena_avviato:
+        print(" tracemalloc avviato ora: vede solo le allocazioni da questo momento (riprova più tardi).")
+    for posizione, byte, blocchi in top:
+        print(f" {posizione[-60:]:<60} | {byte / 1024:>10.0f} KB | {blocchi:>7}")
+    if differenze:
+        print("-" * width)
+        print(" DIFFERENZA DALLA VOLTA PRECEDENTE")
+        for posizione, byte, blocchi in differenze:
+            print(f" {posizione[-60:]:<60} | {byte / 1024:>+10.0f} KB | {blocchi:>+7}")
+    print("=" * width)
+
+# ------------------------------------
+
 def messaggio_uscita():
     print("👋 Alla prossima!")
 
@@ -189,7 +441,8 @@ def avviso_info(msg):
 
 # ------------------------------------
 
-def stampa_dettagli_poste_completi(tracking, dati_json):
+def stampa_dettagli_poste_completi(tracking, dati_json, aggiornato=None):
+    """aggiornato: orario dei dati in cache da mostrare (Poste offline)."""
     if not dati_json:
         print(f"❌ Nessun dato trovato per {tracking}")
         return
@@ -198,6 +451,8 @@ def stampa_dettagli_poste_completi(tracking, dati_json):
     prevista = dati_json.get('dataPrevistaConsegna', '')
     
     print(f"\n📦 TRACKING POSTE: {tracking}")
+    if aggiornato:
+        print(f"   📴 Poste offline: dati del {aggiornato.strftime('%d/%m %H:%M')} ({eta_dati(aggiornato)})")
     print(f"   Prodotto: {prodotto}")
     if prevista:
         print(f"   📅 Previsione: {prevista}")
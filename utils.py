@@ -1,15 +1,86 @@
 from datetime import datetime
 
 import config
+import connessione
+import functools
 import math
 import re
-import requests
+import threading
+import time
+from concurrent.futures import Future
 
+import fixtures
 import logger
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import memoria
+import metrics
+import profilazione
+
+# NB: requests/urllib3 (~100 ms di import) vengono caricati solo alla prima
+# sessione HTTP, così il menu compare senza aspettare lo stack di rete.
 
 _TRACKING_CACHE = {}
+# Cresce a ogni scrittura nella cache tracking: la dashboard capisce se qualcosa è cambiato
+_TRACKING_LOCK = threading.Lock()
+_TRACKING_VERSIONE = 0
+
+
+@functools.lru_cache(maxsize=None)
+def _classe_sessione():
+    import requests
+
+    class _SessioneMisurata(requests.Session):
+        """
+        Session che registra latenza, retry e fallimenti di ogni chiamata in metrics.
+        Con HTTP_FIXTURE_MODE=record/replay salva o riproduce le risposte (fixtures.py).
+        Con il servizio offline (connessione.py) la chiamata fallisce subito.
+        """
+
+        def request(self, method, url, *args, **kwargs):
+            endpoint = metrics.nome_endpoint(url, kwargs.get("headers"))
+            modalita = fixtures.modalita()
+            servizio = connessione.servizio(url) if modalita != "replay" else None
+            if servizio and not connessione.consenti(servizio):
+                raise requests.ConnectionError(
+                    f"{connessione.NOMI[servizio]} offline: nuovo tentativo tra "
+                    f"{connessione.secondi_alla_prova(servizio)} s"
+                )
+            t0 = time.perf_counter()
+            try:
+                if modalita == "replay":
+                    response = fixtures.riproduci(method, url, endpoint, kwargs)
+                else:
+                    response = super().request(method, url, *args, **kwargs)
+            except Exception as e:
+                durata = time.perf_counter() - t0
+                metrics.registra_chiamata_http(endpoint, durata)
+                profilazione.registra("rete", durata)
+                if servizio and isinstance(e, requests.RequestException):
+                    # Arriva dopo tutti i retry di urllib3: senza connessione il servizio va subito offline
+                    connessione.registra_errore(
+                        servizio, type(e).__name__, grave=isinstance(e, (requests.ConnectionError, requests.Timeout)),
+                    )
+                raise
+            durata = time.perf_counter() - t0
+            if servizio:
+                if response.status_code >= 500:
+                    connessione.registra_errore(servizio, f"HTTP {response.status_code}")
+                else:
+                    connessione.registra_successo(servizio)
+            profilazione.registra("rete", durata)
+            # urllib3 allega alla risposta l'oggetto Retry finale: la history sono i tentativi ripetuti
+            retries = getattr(getattr(response, "raw", None), "retries", None)
+            metrics.registra_chiamata_http(
+                endpoint,
+                durata,
+                status=response.status_code,
+                retry=len(getattr(retries, "history", None) or ()),
+                byte_ricevuti=None if kwargs.get("stream") else len(response.content),
+            )
+            if modalita == "record":
+                fixtures.registra(method, url, endpoint, kwargs, response)
+            return response
+
+    return _SessioneMisurata
 
 
 def get_robust_session():
@@ -19,8 +90,12 @@ def get_robust_session():
     Note:
     - include retry anche su POST (utile per API esterne che possono rispondere 5xx/429)
     - rispetta Retry-After quando presente
+    - ogni chiamata alimenta le metriche (latenza/retry/fallimenti per endpoint)
     """
-    session = requests.Session()
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = _classe_sessione()()
     retry_kwargs = dict(
         total=config.HTTP_RETRIES,
         read=config.HTTP_RETRIES,
@@ -42,6 +117,38 @@ def get_robust_session():
     session.mount("https://", adapter)
     return session
 
+def _errore_requests():
+    import requests
+    return requests.RequestException
+
+def esegui_in_background(funzione, *args, nome=None, **kwargs):
+    """
+    Esegue funzione in un thread daemon e ritorna subito un Future.
+    Daemon: se l'operatore esce, il processo non resta appeso a una chiamata di rete.
+    """
+    futuro = Future()
+
+    def _esegui():
+        if not futuro.set_running_or_notify_cancel():
+            return
+        try:
+            futuro.set_result(funzione(*args, **kwargs))
+        except BaseException as e:
+            futuro.set_exception(e)
+
+    threading.Thread(target=_esegui, name=nome or getattr(funzione, "__name__", None), daemon=True).start()
+    return futuro
+
+def stampa_avanzamento(messaggio):
+    """
+    Messaggio di avanzamento per l'operatore. Dai thread in background (preriscaldamento,
+    coda eBay...) non si stampa, per non sporcare il menu: finisce solo nel log.
+    """
+    if threading.current_thread() is threading.main_thread():
+        print(messaggio)
+    else:
+        logger.log.debug(f"[background] {messaggio.strip()}")
+
 def arrotonda_peso_per_eccesso(peso: float) -> float:
     if peso <= 0:
         raise ValueError("Il peso deve essere positivo")
@@ -79,7 +186,7 @@ def get_stato_tracking_poste(tracking_code):
     """Scarica il JSON raw dalle API Poste."""
     if not tracking_code: return None
     
-    url = 'https://www.poste.it/online/dovequando/DQ-REST/ricercasemplice'
+    url = config.POSTE_TRACKING_URL
     headers = {
         'Accept': 'application/json',
         'Content-Type': 'application/json;charset=UTF-8',
@@ -116,7 +223,7 @@ def get_stato_tracking_poste(tracking_code):
                 f"Poste tracking risposta vuota (tracking={_mask_tracking(tracking_code)})"
             )
         return data
-    except requests.RequestException as e:
+    except _errore_requests() as e:
         logger.log.warning(
             f"Poste tracking richiesta fallita (tracking={_mask_tracking(tracking_code)}): {e}"
         )
@@ -141,19 +248,75 @@ def get_stato_tracking_poste_cached(tracking_code, ttl_seconds=None):
     if cached:
         age = (now - cached["ts"]).total_seconds()
         if age <= ttl_seconds:
+            metrics.registra_cache("tracking_poste", "hit")
             return cached["data"]
 
     data = get_stato_tracking_poste(tracking_code)
     if data is not None:
-        _TRACKING_CACHE[tracking_code] = {"ts": now, "data": data}
+        metrics.registra_cache("tracking_poste", "miss")
+        _scrivi_cache_tracking(tracking_code, now, data)
         return data
 
     # Se la fetch fallisce e avevamo dati in cache, usiamo quelli stale.
     if cached:
+        metrics.registra_cache("tracking_poste", "stale")
         return cached["data"]
+    metrics.registra_cache("tracking_poste", "miss")
     return None
 
 
+def esporta_cache_tracking():
+    """Copia serializzabile (JSON) della cache tracking, per lo snapshot su disco."""
+    return {
+        code: {"ts": entry["ts"].isoformat(timespec="seconds"), "data": entry["data"]}
+        for code, entry in list(_TRACKING_CACHE.items())
+    }
+
+def importa_cache_tracking(dati):
+    """Unisce uno snapshot nella cache tracking (vince la voce più recente). Ritorna le voci importate."""
+    importati = 0
+    for code, entry in (dati or {}).items():
+        try:
+            ts = datetime.fromisoformat(entry["ts"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        attuale = _TRACKING_CACHE.get(code)
+        if attuale is None or attuale["ts"] < ts:
+            _scrivi_cache_tracking(code, ts, entry.get("data"))
+            importati += 1
+    return importati
+
+def _scrivi_cache_tracking(tracking_code, ts, data):
+    global _TRACKING_VERSIONE
+    with _TRACKING_LOCK:
+        _TRACKING_CACHE[tracking_code] = {"ts": ts, "data": data}
+        _TRACKING_VERSIONE += 1
+        eccesso = len(_TRACKING_CACHE) - config.TRACKING_CACHE_MAX_VOCI
+        if eccesso > 0:
+            # Un decimo in più del necessario: non si riordina la cache a ogni scrittura
+            _togli_tracking_vecchi(eccesso + config.TRACKING_CACHE_MAX_VOCI // 10)
+
+def _togli_tracking_vecchi(n):
+    """Toglie le n voci più vecchie (con _TRACKING_LOCK già preso). Ritorna quante."""
+    global _TRACKING_VERSIONE
+    vecchie = sorted(_TRACKING_CACHE, key=lambda code: _TRACKING_CACHE[code]["ts"])[:n]
+    for code in vecchie:
+        del _TRACKING_CACHE[code]
+    if vecchie:
+        _TRACKING_VERSIONE += 1
+    return len(vecchie)
+
+def riduci_cache_tracking(n):
+    with _TRACKING_LOCK:
+        return _togli_tracking_vecchi(n)
+
+def versione_cache_tracking():
+    return _TRACKING_VERSIONE
+
+def ts_cache_tracking(tracking_code):
+    """Orario della voce in cache per il tracking (None se assente)."""
+    entry = _TRACKING_CACHE.get(tracking_code)
+    return entry["ts"] if entry else None
 
 def estrai_stato_poste(dati_json):
     """Estrae lo stato piu recente da Poste, se presente."""
@@ -245,3 +408,12 @@ def estrai_posizione_poste(dati_json):
                 return str(luogo).title()
     return ""
 
+
+
+memoria.registra_cache(
+    "tracking_poste",
+    lambda: dict(_TRACKING_CACHE),
+    lambda: len(_TRACKING_CACHE),
+    riduci=riduci_cache_tracking,
+    limite_mb=memoria.limite_mb("tracking_poste", 50),
+)